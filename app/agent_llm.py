@@ -4,11 +4,14 @@ Version complète avec boucle d'exécution
 """
 
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from .prompts import SYSTEM_PROMPT
-from .rag import rag_search
-from .tool_executor import execute_agent_with_tools
+from .rag import rag_search, rag_search_async
+from .history import get_history, get_history_async
+from .tenant_settings import get_tenant_settings
+from .tool_executor import execute_agent_with_tools, execute_agent_with_tools_async, stream_agent_with_tools_async
 
 
 def agent_reply(
@@ -16,15 +19,18 @@ def agent_reply(
     tenant_id: str,
     conversation_id: str,
     user_text: str,
-    customer_phone: str
+    customer_phone: str,
+    retrieval_mode: str = None
 ) -> Dict[str, Any]:
     """
     Point d'entrée principal de l'agent.
     
-    1. Recherche RAG dans la KB
+    1. Recherche RAG dans la KB + historique de la conversation (borné en tokens)
     2. Exécute l'agent avec tools
     3. Retourne réponse finale + métadonnées
     
+    retrieval_mode: lexical|vector|hybrid, défaut = réglage du tenant (tenant_settings)
+    
     Returns:
         {
             "reply_text": str,              # Réponse à envoyer au client
@@ -35,12 +41,16 @@ def agent_reply(
     """
     
     # RAG: chercher dans la KB
+    settings = get_tenant_settings(db, tenant_id)
     kb_chunks = rag_search(
         db=db,
         tenant_id=tenant_id,
         query=user_text,
-        top_k=5
+        top_k=3,
+        mode=retrieval_mode or settings["retrieval_mode"],
+        budget_ms=settings["retrieval_budget_ms"]
     )
+    history = get_history(db, conversation_id, user_text)
     
     # Exécuter agent avec boucle tools
     result = execute_agent_with_tools(
@@ -51,10 +61,92 @@ def agent_reply(
         user_text=user_text,
         kb_chunks=kb_chunks,
         system_prompt=SYSTEM_PROMPT,
-        max_iterations=3  # Maximum 3 aller-retours avec tools
+        max_iterations=3,  # Maximum 3 aller-retours avec tools
+        history=history
     )
     
     # Ajouter les KB chunks au debug
     result["debug"]["kb_chunks"] = kb_chunks
     
     return result
+
+
+async def agent_reply_async(
+    db: AsyncSession,
+    tenant_id: str,
+    conversation_id: str,
+    user_text: str,
+    customer_phone: str,
+    retrieval_mode: str = None
+) -> Dict[str, Any]:
+    """
+    Équivalent asyncio de agent_reply (webhooks Twilio).
+    Même contrat de retour.
+    """
+    
+    settings = await db.run_sync(get_tenant_settings, tenant_id)
+    kb_chunks = await rag_search_async(
+        db=db,
+        tenant_id=tenant_id,
+        query=user_text,
+        top_k=3,
+        mode=retrieval_mode or settings["retrieval_mode"],
+        budget_ms=settings["retrieval_budget_ms"]
+    )
+    history = await get_history_async(db, conversation_id, user_text)
+    
+    result = await execute_agent_with_tools_async(
+        db=db,
+        tenant_id=tenant_id,
+        conversation_id=conversation_id,
+        customer_phone=customer_phone,
+        user_text=user_text,
+        kb_chunks=kb_chunks,
+        system_prompt=SYSTEM_PROMPT,
+        max_iterations=3,
+        history=history
+    )
+    
+    result["debug"]["kb_chunks"] = kb_chunks
+    
+    return result
+
+
+async def agent_reply_stream_async(
+    db: AsyncSession,
+    tenant_id: str,
+    conversation_id: str,
+    user_text: str,
+    customer_phone: str,
+    retrieval_mode: str = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Variante streaming de agent_reply_async (voix: synthèse dès la première phrase).
+    Événements: voir stream_agent_with_tools_async; "done" porte le même contrat que agent_reply.
+    """
+    
+    settings = await db.run_sync(get_tenant_settings, tenant_id)
+    kb_chunks = await rag_search_async(
+        db=db,
+        tenant_id=tenant_id,
+        query=user_text,
+        top_k=3,
+        mode=retrieval_mode or settings["retrieval_mode"],
+        budget_ms=settings["retrieval_budget_ms"]
+    )
+    history = await get_history_async(db, conversation_id, user_text)
+    
+    async for event in stream_agent_with_tools_async(
+        db=db,
+        tenant_id=tenant_id,
+        conversation_id=conversation_id,
+        customer_phone=customer_phone,
+        user_text=user_text,
+        kb_chunks=kb_chunks,
+        system_prompt=SYSTEM_PROMPT,
+        max_iterations=3,
+        history=history
+    ):
+        if event["type"] == "done":
+            event["result"]["debug"]["kb_chunks"] = kb_chunks
+        yield event
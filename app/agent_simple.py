@@ -1,9 +1,18 @@
-import os
-from openai import OpenAI
+import time
+import logging
 from sqlalchemy.orm import Session
-from .rag import rag_search
+from sqlalchemy.ext.asyncio import AsyncSession
+from .rag import rag_search, rag_search_async
+from .tenant_settings import get_tenant_settings
+from .answer_cache import context_fingerprint, lookup_answer, store_answer, lookup_answer_async, store_answer_async
+from .streaming import SentenceSplitter, split_sentences
+from .history import trim_history
+from .transactions import release_connection, release_connection_async
+from .prompt_cache import assemble_messages, cache_params, record_usage
+from .llm_gateway import LLMUnavailable, chat, achat, astream, kb_fallback_reply
+from .metrics import timed, observe_stage, record_llm_fallback
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
 
 SYSTEM_PROMPT = """Tu es l'assistant virtuel du KTIOS Lounge, un bar haut de gamme à Québec.
 
@@ -18,36 +27,187 @@ IMPORTANT :
 - Si l'information n'est pas dans le contexte, dis "Je n'ai pas cette information précise" et suggère de contacter le 367-382-0451.
 """
 
-def agent_reply(db: Session, tenant_id: str, user_message: str, conversation_history: list = None) -> str:
+def _build_messages(kb_results: list, conversation_history: list, user_message: str) -> list:
+    # SYSTEM_PROMPT seul en tête (préfixe identique d'une requête à l'autre: cache de prompt du fournisseur),
+    # le contexte KB du tour vient après l'historique
+    turn_context = []
+    if kb_results and len(kb_results) > 0:
+        context = "\n\n".join([r['chunk_text'] for r in kb_results])
+        turn_context.append(f"Contexte KTIOS:\n{context}")
+
+    # Historique posté par le client: derniers messages dans le budget de tokens (HISTORY_TOKEN_BUDGET)
+    return assemble_messages(SYSTEM_PROMPT, trim_history(conversation_history), turn_context, user_message)
+
+
+def _fallback_reply(kb_results: list, error: Exception) -> str:
+    if isinstance(error, LLMUnavailable):
+        logger.warning("LLM indisponible, réponse de secours", extra={"reason": error.reason})
+        record_llm_fallback("simple", error.reason)
+    else:
+        logger.error("Appel OpenAI en échec: %s", error)
+        record_llm_fallback("simple", "error")
+    return kb_fallback_reply(kb_results)
+
+
+def agent_reply(db: Session, tenant_id: str, user_message: str, conversation_history: list = None, retrieval_mode: str = None) -> str:
     if conversation_history is None:
         conversation_history = []
 
-    kb_results = rag_search(db, tenant_id, user_message, top_k=3)
+    settings = get_tenant_settings(db, tenant_id)
+    kb_results = rag_search(
+        db, tenant_id, user_message, top_k=3,
+        mode=retrieval_mode or settings["retrieval_mode"],
+        budget_ms=settings["retrieval_budget_ms"]
+    )
+
+    # Cache de réponses: seulement pour une question sans historique (la réponse ne dépend que de la KB)
+    use_answer_cache = not conversation_history
+    if use_answer_cache:
+        fingerprint = context_fingerprint(kb_results)
+        cached_reply = lookup_answer(tenant_id, user_message, fingerprint)
+        if cached_reply is not None:
+            return cached_reply
+
+    messages = _build_messages(kb_results, conversation_history, user_message)
+    # Connexion rendue au pool pendant l'appel LLM
+    release_connection(db)
+
+    try:
+        with timed("llm"):
+            response = chat(
+                "simple",
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=200,
+                **cache_params()
+            )
+        record_usage("simple", response.usage)
+        reply = response.choices[0].message.content
+        if use_answer_cache and reply:
+            store_answer(tenant_id, user_message, fingerprint, reply)
+        return reply
+
+    except Exception as e:
+        return _fallback_reply(kb_results, e)
 
-    if kb_results and len(kb_results) > 0:
-        context = "\n\n".join([r['chunk_text'] for r in kb_results])
-        system_with_context = f"{SYSTEM_PROMPT}\n\nContexte KTIOS:\n{context}"
-    else:
-        system_with_context = SYSTEM_PROMPT
 
-    messages = [{"role": "system", "content": system_with_context}]
+async def agent_reply_async(db: AsyncSession, tenant_id: str, user_message: str, conversation_history: list = None, retrieval_mode: str = None) -> str:
+    """Équivalent asyncio de agent_reply (AsyncOpenAI + AsyncSession)"""
+    if conversation_history is None:
+        conversation_history = []
+
+    settings = await db.run_sync(get_tenant_settings, tenant_id)
+    kb_results = await rag_search_async(
+        db, tenant_id, user_message, top_k=3,
+        mode=retrieval_mode or settings["retrieval_mode"],
+        budget_ms=settings["retrieval_budget_ms"]
+    )
 
-    for msg in conversation_history[-6:]:
-        messages.append(msg)
+    use_answer_cache = not conversation_history
+    if use_answer_cache:
+        fingerprint = context_fingerprint(kb_results)
+        cached_reply = await lookup_answer_async(tenant_id, user_message, fingerprint)
+        if cached_reply is not None:
+            return cached_reply
 
-    messages.append({"role": "user", "content": user_message})
+    messages = _build_messages(kb_results, conversation_history, user_message)
+    await release_connection_async(db)
 
     try:
-        response = client.chat.completions.create(
+        with timed("llm"):
+            response = await achat(
+                "simple",
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=200,
+                **cache_params()
+            )
+        record_usage("simple", response.usage)
+        reply = response.choices[0].message.content
+        if use_answer_cache and reply:
+            await store_answer_async(tenant_id, user_message, fingerprint, reply)
+        return reply
+
+    except Exception as e:
+        return _fallback_reply(kb_results, e)
+
+
+
+async def agent_reply_stream_async(db: AsyncSession, tenant_id: str, user_message: str, conversation_history: list = None, retrieval_mode: str = None):
+    """
+    Variante streaming de agent_reply_async (SSE de /api/chat/stream).
+    Événements: {"type": "delta", "text"} à chaque token, {"type": "sentence", "text"} à chaque phrase
+    complète, puis {"type": "done", "reply"} avec la réponse entière.
+    """
+    if conversation_history is None:
+        conversation_history = []
+
+    settings = await db.run_sync(get_tenant_settings, tenant_id)
+    kb_results = await rag_search_async(
+        db, tenant_id, user_message, top_k=3,
+        mode=retrieval_mode or settings["retrieval_mode"],
+        budget_ms=settings["retrieval_budget_ms"]
+    )
+
+    use_answer_cache = not conversation_history
+    if use_answer_cache:
+        fingerprint = context_fingerprint(kb_results)
+        cached_reply = await lookup_answer_async(tenant_id, user_message, fingerprint)
+        if cached_reply is not None:
+            yield {"type": "delta", "text": cached_reply}
+            for sentence in split_sentences(cached_reply):
+                yield {"type": "sentence", "text": sentence}
+            yield {"type": "done", "reply": cached_reply}
+            return
+
+    messages = _build_messages(kb_results, conversation_history, user_message)
+    await release_connection_async(db)
+    splitter = SentenceSplitter()
+    parts = []
+
+    llm_started = time.perf_counter()
+    try:
+        stream = await astream(
+            "simple",
             model="gpt-4o-mini",
             messages=messages,
             temperature=0.7,
-            max_tokens=200
+            max_tokens=200,
+            stream_options={"include_usage": True},
+            **cache_params()
         )
-        return response.choices[0].message.content
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                record_usage("simple", chunk.usage)
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not parts:
+                observe_stage("llm_first_token", time.perf_counter() - llm_started)
+            parts.append(delta)
+            yield {"type": "delta", "text": delta}
+            for sentence in splitter.feed(delta):
+                yield {"type": "sentence", "text": sentence}
 
     except Exception as e:
-        print(f"ERROR OpenAI: {e}")
-        if kb_results:
-            return kb_results[0]['chunk_text'][:300]
-        return "Erreur technique. Contactez-nous au 367-382-0451."
\ No newline at end of file
+        if not parts:
+            reply = _fallback_reply(kb_results, e)
+            yield {"type": "delta", "text": reply}
+            yield {"type": "sentence", "text": reply}
+            yield {"type": "done", "reply": reply}
+            return
+        # Réponse interrompue: on garde ce qui a été envoyé, sans la mettre en cache
+        logger.error("Flux OpenAI interrompu: %s", e)
+        use_answer_cache = False
+    observe_stage("llm", time.perf_counter() - llm_started)
+
+    rest = splitter.flush()
+    if rest:
+        yield {"type": "sentence", "text": rest}
+
+    reply = "".join(parts)
+    if use_answer_cache and reply:
+        await store_answer_async(tenant_id, user_message, fingerprint, reply)
+    yield {"type": "done", "reply": reply}
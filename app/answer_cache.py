@@ -0,0 +1,129 @@
+"""
+Cache des réponses de l'agent FAQ (agent_simple)
+Clé = (tenant, question normalisée), cache L1 + L2 partagé entre workers (shared_cache), génération
+du tenant incrémentée à chaque ingestion. Une réponse n'est resservie que si le contexte
+KB retrouvé pour la question est identique à celui qui a servi à la générer.
+Option: correspondance par similarité d'embeddings (ANSWER_CACHE_SIMILARITY > 0, par process).
+"""
+
+import os
+import asyncio
+import hashlib
+import threading
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional
+from .cache import TTLCache
+from .shared_cache import SharedCache
+from .lexical import analyze, fold_accents
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "4096"))
+
+# Seuil de similarité cosinus (0 = désactivé): "c quoi le prix de la heineken" ≈ "prix heineken ?"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+# Nombre de questions récentes comparées par tenant
+ANSWER_CACHE_SIMILAR_CANDIDATES = int(os.getenv("ANSWER_CACHE_SIMILAR_CANDIDATES", "256"))
+
+_answers = SharedCache("answer", max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, l1_ttl=ANSWER_CACHE_TTL)
+_question_embeddings = TTLCache(max_entries=1024, ttl=ANSWER_CACHE_TTL)
+_embeddings_lock = threading.Lock()
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(sorted(set(analyze(question)))) or fold_accents(question).strip()
+
+
+def context_fingerprint(kb_results: List[Dict[str, Any]]) -> str:
+    """Empreinte du contexte KB retrouvé (textes des chunks, dans l'ordre)"""
+    digest = hashlib.sha256()
+    for result in kb_results or []:
+        digest.update(result["chunk_text"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _embed(question: str) -> List[float]:
+    from .embeddings import embed_texts
+    return embed_texts([question])[0]
+
+
+def _similar_key(tenant_id: str, version: int, question: str) -> Optional[tuple]:
+    """Clé (question normalisée,) de la question en cache la plus proche, si assez proche"""
+    candidates = _question_embeddings.get((tenant_id, version))
+    if not candidates:
+        return None
+    query = _embed(question)
+    with _embeddings_lock:
+        snapshot = list(candidates)
+    best_key, best_score = None, ANSWER_CACHE_SIMILARITY
+    for key, vector in snapshot:
+        score = sum(a * b for a, b in zip(query, vector))
+        if score >= best_score:
+            best_key, best_score = key, score
+    return best_key
+
+
+def lookup_answer(tenant_id, question: str, fingerprint: str) -> Optional[str]:
+    """Réponse en cache pour cette question si le contexte KB n'a pas changé, sinon None"""
+    tenant_key = str(tenant_id)
+    entry = _answers.get(tenant_key, (normalize_question(question),))
+    if entry is None and ANSWER_CACHE_SIMILARITY > 0:
+        try:
+            similar = _similar_key(tenant_key, _answers.generation(tenant_key), question)
+        except Exception as e:
+            logger.error("Embedding de la question en échec: %s", e)
+            similar = None
+        entry = _answers.get(tenant_key, similar) if similar else None
+
+    if entry and entry["fingerprint"] == fingerprint:
+        return entry["reply"]
+    return None
+
+
+def store_answer(tenant_id, question: str, fingerprint: str, reply: str) -> None:
+    tenant_key = str(tenant_id)
+    key = (normalize_question(question),)
+    _answers.set(tenant_key, key, {"reply": reply, "fingerprint": fingerprint})
+
+    if ANSWER_CACHE_SIMILARITY > 0:
+        version = _answers.generation(tenant_key)
+        try:
+            vector = _embed(question)
+        except Exception as e:
+            logger.error("Embedding de la question en échec: %s", e)
+            return
+        with _embeddings_lock:
+            candidates = _question_embeddings.get((tenant_key, version))
+            if candidates is None:
+                candidates = deque(maxlen=ANSWER_CACHE_SIMILAR_CANDIDATES)
+                _question_embeddings.set((tenant_key, version), candidates)
+            candidates.append((key, vector))
+
+
+async def lookup_answer_async(tenant_id, question: str, fingerprint: str) -> Optional[str]:
+    """Équivalent asyncio de lookup_answer (L2 et embeddings hors de l'event loop)"""
+    if ANSWER_CACHE_SIMILARITY > 0:
+        return await asyncio.to_thread(lookup_answer, tenant_id, question, fingerprint)
+    entry = await _answers.aget(str(tenant_id), (normalize_question(question),))
+    if entry and entry["fingerprint"] == fingerprint:
+        return entry["reply"]
+    return None
+
+
+async def store_answer_async(tenant_id, question: str, fingerprint: str, reply: str) -> None:
+    if ANSWER_CACHE_SIMILARITY > 0:
+        await asyncio.to_thread(store_answer, tenant_id, question, fingerprint, reply)
+        return
+    await _answers.aset(str(tenant_id), (normalize_question(question),), {"reply": reply, "fingerprint": fingerprint})
+
+
+def invalidate_tenant_answers(tenant_id) -> None:
+    _answers.invalidate_tenant(tenant_id)
+    _question_embeddings.invalidate_tenant(tenant_id)
+
+
+def answer_cache_stats() -> Dict[str, Any]:
+    return _answers.stats()
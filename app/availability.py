@@ -0,0 +1,287 @@
+"""
+Index d'occupation des réservations par tenant: check_availability sans requête SQL à chaque appel
+Le temps est découpé en tranches de BUCKET_MINUTES minutes. Pour chaque jour chargé, deux tableaux
+compacts (array) indexés par tranche: couverts et nombre de réservations qui commencent dans la tranche.
+
+Une heure t est disponible si, pour les réservations qui commencent à ±reservation_window_minutes de t
+(même règle que l'ancienne requête "start_time BETWEEN start ± 2h"):
+    couverts + party_size <= max_capacity  et  réservations < max_concurrent_reservations
+Capacités et heures de service: table tenant_settings.
+
+L'index est mis à jour en place par create/modify/cancel, et rechargé depuis la base au plus tard
+après AVAILABILITY_INDEX_TTL secondes (réservations écrites par un autre process).
+Chaque jour retient l'instant de son chargement: une écriture n'y est appliquée que si le jour a été
+chargé avant son commit, sinon le jour est écarté et relu (la ligne y figure peut-être déjà).
+Les tranches sont en heure murale du fuseau du tenant (tenants.timezone): une heure reçue avec un
+décalage (-05:00, Z) y est convertie, une heure sans décalage est lue comme heure du tenant.
+Les lignes chargées sont converties avec AT TIME ZONE :tz, jamais avec le fuseau de la session.
+"""
+
+import os
+import time
+import uuid
+import threading
+from array import array
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from .cache import TTLCache
+from .tenant_settings import get_tenant_settings
+
+BUCKET_MINUTES = 15
+BUCKETS_PER_DAY = 24 * 60 // BUCKET_MINUTES
+
+AVAILABILITY_INDEX_TTL = float(os.getenv("AVAILABILITY_INDEX_TTL", "60"))
+# Pas des créneaux proposés en suggestion (minutes, multiple de BUCKET_MINUTES)
+SUGGESTION_STEP_MINUTES = int(os.getenv("SUGGESTION_STEP_MINUTES", "30"))
+
+ACTIVE_STATUSES = ("confirmed", "pending")
+
+_indexes = TTLCache(max_entries=int(os.getenv("AVAILABILITY_INDEX_MAX_TENANTS", "256")), ttl=AVAILABILITY_INDEX_TTL)
+_indexes_lock = threading.Lock()
+
+
+def _parse_time(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value
+
+
+def aware_time(value, timezone: str) -> datetime:
+    """datetime ou chaîne ISO (suffixe Z accepté) → datetime avec fuseau (sans décalage: fuseau du tenant)"""
+    value = _parse_time(value)
+    return value if value.tzinfo else value.replace(tzinfo=ZoneInfo(timezone))
+
+
+def local_time(value, timezone: str) -> datetime:
+    """datetime ou chaîne ISO → heure murale naive dans le fuseau du tenant"""
+    value = _parse_time(value)
+    if value.tzinfo:
+        value = value.astimezone(ZoneInfo(timezone))
+    return value.replace(tzinfo=None)
+
+
+def _as_offset(value: datetime, timezone: str) -> str:
+    """Heure murale du tenant → ISO 8601 avec décalage (format attendu par les tools)"""
+    return value.replace(tzinfo=ZoneInfo(timezone)).isoformat()
+
+
+def bucket_of(value: datetime) -> int:
+    """Numéro absolu de tranche (jour ordinal * tranches/jour + tranche du jour)"""
+    return value.toordinal() * BUCKETS_PER_DAY + (value.hour * 60 + value.minute) // BUCKET_MINUTES
+
+
+def bucket_start(bucket: int) -> datetime:
+    day, slot = divmod(bucket, BUCKETS_PER_DAY)
+    return datetime.combine(date.fromordinal(day), datetime.min.time()) + timedelta(minutes=slot * BUCKET_MINUTES)
+
+
+class OccupancyIndex:
+    """Occupation d'un tenant, chargée jour par jour à la demande"""
+
+    def __init__(self, tenant_id: str, timezone: str):
+        self.tenant_id = str(tenant_id)
+        self.timezone = timezone
+        self._days: Dict[int, Tuple[array, array]] = {}
+        # Jour → time.monotonic() à la fin de la requête de chargement
+        self._loaded_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _load_days(self, db: Session, days: List[int]) -> Dict[int, Tuple[array, array]]:
+        """Tableaux des jours demandés, chargés depuis la base si absents"""
+        with self._lock:
+            present = {d: self._days[d] for d in days if d in self._days}
+        missing = [d for d in days if d not in present]
+        if not missing:
+            return present
+
+        first, last = min(missing), max(missing)
+        # Bornes et heures lues en heure murale du tenant (indépendant du TimeZone de la session)
+        rows = db.execute(
+            text("""
+            SELECT start_time AT TIME ZONE :tz AS local_start, party_size
+            FROM reservations
+            WHERE tenant_id = :tenant_id
+              AND status IN ('confirmed', 'pending')
+              AND start_time >= CAST(:from_time AS timestamp) AT TIME ZONE :tz
+              AND start_time < CAST(:to_time AS timestamp) AT TIME ZONE :tz
+            """),
+            {
+                "tenant_id": uuid.UUID(self.tenant_id),
+                "tz": self.timezone,
+                "from_time": bucket_start(first * BUCKETS_PER_DAY),
+                "to_time": bucket_start((last + 1) * BUCKETS_PER_DAY),
+            }
+        ).all()
+        loaded_at = time.monotonic()
+
+        loaded = {d: (array("i", bytes(4 * BUCKETS_PER_DAY)), array("i", bytes(4 * BUCKETS_PER_DAY))) for d in range(first, last + 1)}
+        for local_start, party_size in rows:
+            day, slot = divmod(bucket_of(local_start), BUCKETS_PER_DAY)
+            guests, counts = loaded[day]
+            guests[slot] += party_size
+            counts[slot] += 1
+
+        with self._lock:
+            for day, arrays in loaded.items():
+                # Un jour chargé entre-temps (autre thread) a peut-être déjà reçu des mises à jour: on le garde
+                if day not in self._days:
+                    self._days[day] = arrays
+                    self._loaded_at[day] = loaded_at
+            # Jours écartés par apply entre-temps: la copie chargée ici sert pour cette lecture
+            return {d: self._days.get(d) or present.get(d) or loaded[d] for d in days}
+
+    def apply(self, start: datetime, party_size: int, sign: int = 1, written_at: Optional[float] = None) -> None:
+        """
+        Ajoute (sign=1) ou retire (sign=-1) une réservation écrite à written_at (time.monotonic() pris
+        avant le commit). Ignoré si le jour n'est pas chargé; jour écarté s'il a été chargé après
+        written_at (la ligne peut y être déjà comptée) ou si written_at est inconnu.
+        """
+        day, slot = divmod(bucket_of(start), BUCKETS_PER_DAY)
+        with self._lock:
+            arrays = self._days.get(day)
+            if not arrays:
+                return
+            if written_at is None or self._loaded_at[day] >= written_at:
+                del self._days[day]
+                del self._loaded_at[day]
+                return
+            arrays[0][slot] += sign * party_size
+            arrays[1][slot] += sign
+
+    def _prefix_sums(self, days: Dict[int, Tuple[array, array]], first_bucket: int, last_bucket: int) -> Tuple[List[int], List[int]]:
+        """Sommes cumulées (couverts, réservations) sur [first_bucket, last_bucket]"""
+        guests_prefix, counts_prefix = [0], [0]
+        with self._lock:
+            for bucket in range(first_bucket, last_bucket + 1):
+                day, slot = divmod(bucket, BUCKETS_PER_DAY)
+                guests, counts = days[day]
+                guests_prefix.append(guests_prefix[-1] + guests[slot])
+                counts_prefix.append(counts_prefix[-1] + counts[slot])
+        return guests_prefix, counts_prefix
+
+    def occupancy(self, db: Session, first_bucket: int, last_bucket: int, half_width: int) -> List[Tuple[int, int, int]]:
+        """
+        [(tranche, couverts, réservations)] pour chaque tranche de [first_bucket, last_bucket],
+        occupation = réservations qui commencent à ±half_width tranches. O(tranches) via sommes cumulées.
+        """
+        low, high = first_bucket - half_width, last_bucket + half_width
+        days = self._load_days(db, list(range(low // BUCKETS_PER_DAY, high // BUCKETS_PER_DAY + 1)))
+        guests_prefix, counts_prefix = self._prefix_sums(days, low, high)
+
+        result = []
+        for bucket in range(first_bucket, last_bucket + 1):
+            start, end = bucket - half_width - low, bucket + half_width - low + 1
+            result.append((bucket, guests_prefix[end] - guests_prefix[start], counts_prefix[end] - counts_prefix[start]))
+        return result
+
+
+def get_occupancy_index(tenant_id, timezone: str) -> OccupancyIndex:
+    key = (str(tenant_id),)
+    index = _indexes.get(key)
+    if index is None or index.timezone != timezone:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            # Fuseau du tenant modifié: les tranches chargées sont dans l'ancien fuseau
+            if index is None or index.timezone != timezone:
+                index = OccupancyIndex(key[0], timezone)
+                _indexes.set(key, index)
+    return index
+
+
+def _is_free(guests: int, count: int, party_size: int, settings: Dict[str, Any]) -> bool:
+    return guests + party_size <= settings["max_capacity"] and count < settings["max_concurrent_reservations"]
+
+
+def _within_service(value: datetime, settings: Dict[str, Any]) -> bool:
+    return settings["first_seating_hour"] <= value.hour <= settings["last_seating_hour"]
+
+
+def find_available_slots(db: Session, tenant_id, start_time, party_size: int, limit: int = 3) -> List[str]:
+    """
+    Les limit créneaux réellement disponibles les plus proches de start_time, le même jour,
+    dans les heures de service (pas SUGGESTION_STEP_MINUTES). Un seul passage sur les tranches du jour.
+    """
+    settings = get_tenant_settings(db, tenant_id)
+    requested = local_time(start_time, settings["timezone"])
+    half_width = settings["reservation_window_minutes"] // BUCKET_MINUTES
+    step = max(1, SUGGESTION_STEP_MINUTES // BUCKET_MINUTES)
+
+    day_first = requested.toordinal() * BUCKETS_PER_DAY
+    first = day_first + settings["first_seating_hour"] * 60 // BUCKET_MINUTES
+    last = day_first + (settings["last_seating_hour"] + 1) * 60 // BUCKET_MINUTES - 1
+    if first > last:
+        return []
+
+    requested_bucket = bucket_of(requested)
+    occupancy = get_occupancy_index(tenant_id, settings["timezone"]).occupancy(db, first, last, half_width)
+    candidates = [
+        bucket for bucket, guests, count in occupancy
+        if (bucket - first) % step == 0 and bucket != requested_bucket and _is_free(guests, count, party_size, settings)
+    ]
+    candidates.sort(key=lambda bucket: (abs(bucket - requested_bucket), bucket))
+    return [_as_offset(bucket_start(bucket), settings["timezone"]) for bucket in candidates[:limit]]
+
+
+def check_availability(db: Session, tenant_id, start_time, party_size: int, suggestions: int = 3) -> Dict[str, Any]:
+    """Même contrat que l'ancien ToolExecutor._check_availability; suggestions vérifiées"""
+    settings = get_tenant_settings(db, tenant_id)
+    start = local_time(start_time, settings["timezone"])
+
+    if not _within_service(start, settings):
+        return {
+            "available": False,
+            "reason": "en_dehors_heures",
+            "suggestions": find_available_slots(db, tenant_id, start, party_size, suggestions),
+        }
+
+    bucket = bucket_of(start)
+    half_width = settings["reservation_window_minutes"] // BUCKET_MINUTES
+    _, guests, count = get_occupancy_index(tenant_id, settings["timezone"]).occupancy(db, bucket, bucket, half_width)[0]
+
+    if guests + party_size > settings["max_capacity"]:
+        reason = "capacité_atteinte"
+    elif count >= settings["max_concurrent_reservations"]:
+        reason = "trop_réservations_simultanées"
+    else:
+        return {
+            "available": True,
+            "start_time": _as_offset(start, settings["timezone"]),
+            "party_size": party_size,
+            "current_occupancy": guests,
+        }
+
+    return {
+        "available": False,
+        "reason": reason,
+        "suggestions": find_available_slots(db, tenant_id, start, party_size, suggestions),
+    }
+
+
+def record_reservation_change(
+    tenant_id,
+    old: Optional[Tuple[Any, int]] = None,
+    new: Optional[Tuple[Any, int]] = None,
+    written_at: Optional[float] = None,
+) -> None:
+    """
+    À appeler après le commit d'une écriture sur reservations.
+    old/new = (start_time, party_size) de la réservation active avant/après, None si elle ne l'était pas.
+    start_time avec décalage, ou heure murale du tenant.
+    written_at = time.monotonic() pris avant le commit (booking.py le retourne); sans lui, les jours
+    touchés sont relus depuis la base.
+    """
+    index = _indexes.get((str(tenant_id),))
+    if index is None:
+        # Pas d'index chargé: il lira la réservation depuis la base
+        return
+    if old:
+        index.apply(local_time(old[0], index.timezone), old[1], -1, written_at)
+    if new:
+        index.apply(local_time(new[0], index.timezone), new[1], 1, written_at)
+
+
+def invalidate_availability(tenant_id) -> None:
+    _indexes.delete((str(tenant_id),))
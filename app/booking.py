@@ -0,0 +1,227 @@
+"""
+Réservation atomique de capacité (pas de surréservation entre conversations concurrentes)
+
+Deux réservations ne se concurrencent que si leurs heures sont à moins de reservation_window_minutes
+l'une de l'autre (règle de check_availability). Chaque transaction d'écriture prend donc des verrous
+consultatifs Postgres (pg_advisory_xact_lock) par (tenant, bloc de temps de la taille de la fenêtre)
+dans l'ordre croissant, puis revérifie la capacité en SQL et écrit.
+Les verrous sont libérés au commit/rollback.
+
+Le contrôle via l'index en mémoire (availability.py) reste le filtre rapide; la vérification
+sous verrou est la seule qui fait foi.
+Heures: écrites avec leur fuseau (timestamptz), relues en heure murale du tenant (AT TIME ZONE :tz);
+les blocs verrouillés sont calculés sur l'heure murale du tenant.
+"""
+
+import os
+import time
+import random
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from .availability import ACTIVE_STATUSES, BUCKET_MINUTES, aware_time, local_time
+from .tenant_settings import get_tenant_settings
+
+BOOKING_RETRIES = int(os.getenv("BOOKING_RETRIES", "3"))
+# Attente max d'un verrou avant abandon (puis nouvel essai)
+BOOKING_LOCK_TIMEOUT_MS = int(os.getenv("BOOKING_LOCK_TIMEOUT_MS", "2000"))
+
+# Erreurs transitoires qui justifient un nouvel essai: sérialisation, interblocage, lock_timeout
+RETRYABLE_SQLSTATES = {"40001", "40P01", "55P03"}
+
+
+def _sqlstate(error: DBAPIError) -> Optional[str]:
+    orig = getattr(error, "orig", None)
+    return getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+
+
+def _lock_keys(start: datetime, window_minutes: int) -> List[int]:
+    """
+    Le temps est découpé en blocs de la taille de la fenêtre: une réservation à t verrouille le bloc
+    de t et ses deux voisins. Deux heures à moins d'une fenêtre d'écart partagent toujours un bloc,
+    deux services éloignés (midi / soir) ne se bloquent pas.
+    """
+    window = max(window_minutes, BUCKET_MINUTES)
+    block = (start.toordinal() * 24 * 60 + start.hour * 60 + start.minute) // window
+    return [block - 1, block, block + 1]
+
+
+def _lock_windows(db: Session, tenant_id: str, starts: List[datetime], window_minutes: int) -> None:
+    """Verrous (tenant, bloc) pour toutes les fenêtres, ordre croissant (pas d'interblocage)"""
+    keys = sorted({key for start in starts for key in _lock_keys(start, window_minutes)})
+    db.execute(text(f"SET LOCAL lock_timeout = '{BOOKING_LOCK_TIMEOUT_MS}ms'"))
+    for key in keys:
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:tenant_id), :block)"),
+            {"tenant_id": tenant_id, "block": key}
+        )
+
+
+def _window_occupancy(db: Session, tenant_id: str, start: datetime, window_minutes: int, exclude_id: Optional[str] = None) -> Dict[str, int]:
+    row = db.execute(
+        text("""
+        SELECT COUNT(*) AS cnt, COALESCE(SUM(party_size), 0) AS total_guests
+        FROM reservations
+        WHERE tenant_id = :tenant_id
+          AND status IN ('confirmed', 'pending')
+          AND start_time BETWEEN CAST(:start AS timestamptz) - CAST(:window AS int) * INTERVAL '1 minute'
+                             AND CAST(:start AS timestamptz) + CAST(:window AS int) * INTERVAL '1 minute'
+          AND (CAST(:exclude_id AS uuid) IS NULL OR id <> CAST(:exclude_id AS uuid))
+        """),
+        {"tenant_id": tenant_id, "start": start, "window": window_minutes, "exclude_id": exclude_id}
+    ).mappings().first()
+    return {"guests": row["total_guests"] or 0, "count": row["cnt"] or 0}
+
+
+def _capacity_refusal(occupancy: Dict[str, int], party_size: int, settings: Dict[str, Any]) -> Optional[str]:
+    if occupancy["guests"] + party_size > settings["max_capacity"]:
+        return "capacité_atteinte"
+    if occupancy["count"] >= settings["max_concurrent_reservations"]:
+        return "trop_réservations_simultanées"
+    return None
+
+
+def _with_retries(db: Session, operation) -> Dict[str, Any]:
+    """Exécute operation() (une transaction complète) avec nouveaux essais sur erreur transitoire"""
+    for attempt in range(1, BOOKING_RETRIES + 1):
+        try:
+            return operation()
+        except DBAPIError as e:
+            db.rollback()
+            if _sqlstate(e) not in RETRYABLE_SQLSTATES or attempt == BOOKING_RETRIES:
+                raise
+            # Backoff exponentiel avec jitter: les transactions en conflit ne repartent pas ensemble
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+
+def book_reservation(
+    db: Session,
+    tenant_id: str,
+    customer_id: str,
+    conversation_id: Optional[str],
+    start_time,
+    party_size: int,
+    notes: str = "",
+) -> Dict[str, Any]:
+    """
+    Insère une réservation confirmée si la capacité le permet, de façon atomique. Commit inclus.
+    Retourne {"success": True, "reservation_id", "local_start", "written_at"} ou {"success": False, "reason"}.
+    written_at: time.monotonic() juste avant le commit (record_reservation_change).
+    """
+    settings = get_tenant_settings(db, tenant_id)
+    timezone = settings["timezone"]
+    start = aware_time(start_time, timezone)
+    window = settings["reservation_window_minutes"]
+
+    def operation():
+        _lock_windows(db, tenant_id, [local_time(start, timezone)], window)
+        refusal = _capacity_refusal(_window_occupancy(db, tenant_id, start, window), party_size, settings)
+        if refusal:
+            db.rollback()
+            return {"success": False, "reason": refusal}
+
+        row = db.execute(
+            text("""
+            INSERT INTO reservations (
+                id, tenant_id, customer_id, source_conversation_id,
+                party_size, start_time, status, notes, created_at, updated_at
+            )
+            VALUES (
+                uuid_generate_v4(), :tenant_id, :customer_id, :conversation_id,
+                :party_size, :start_time, 'confirmed', :notes, now(), now()
+            )
+            RETURNING id, start_time AT TIME ZONE :tz AS local_start
+            """),
+            {
+                "tz": timezone,
+                "tenant_id": tenant_id,
+                "customer_id": customer_id,
+                "conversation_id": conversation_id,
+                "party_size": party_size,
+                "start_time": start,
+                "notes": notes,
+            }
+        ).one()
+        written_at = time.monotonic()
+        db.commit()
+        return {"success": True, "reservation_id": str(row.id), "local_start": row.local_start, "written_at": written_at}
+
+    return _with_retries(db, operation)
+
+
+def update_reservation(db: Session, tenant_id: str, reservation_id: str, set_clauses: List[str], params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    UPDATE d'une réservation (SET dynamique de modify/cancel), commit inclus.
+    Si l'heure ou le nombre de couverts change vers un état actif, la capacité de la nouvelle
+    fenêtre est revérifiée sous verrou (la réservation elle-même exclue du calcul).
+    Retourne {"success": True, "row", "written_at"} (valeurs avant/après) ou {"success": False, "reason"}.
+    """
+    settings = get_tenant_settings(db, tenant_id)
+    timezone = settings["timezone"]
+    window = settings["reservation_window_minutes"]
+    params = {**params, "reservation_id": reservation_id, "tenant_id": tenant_id, "tz": timezone}
+    if "new_start_time" in params:
+        # Heure sans décalage: heure murale du tenant (pas le fuseau de la session)
+        params["new_start_time"] = aware_time(params["new_start_time"], timezone)
+
+    def operation():
+        current = db.execute(
+            text("""
+            SELECT start_time AT TIME ZONE :tz AS local_start, party_size, status
+            FROM reservations
+            WHERE id = :reservation_id AND tenant_id = :tenant_id
+            FOR UPDATE
+            """),
+            params
+        ).mappings().first()
+        if not current:
+            db.rollback()
+            return {"success": False, "reason": "introuvable"}
+
+        new_start = local_time(params["new_start_time"], timezone) if "new_start_time" in params else current["local_start"]
+        new_party = params.get("new_party_size", current["party_size"])
+        new_status = params.get("new_status", current["status"])
+        needs_capacity = new_status in ACTIVE_STATUSES and (
+            current["status"] not in ACTIVE_STATUSES
+            or new_start != current["local_start"]
+            or new_party > current["party_size"]
+        )
+
+        if needs_capacity:
+            _lock_windows(db, tenant_id, [new_start], window)
+            occupancy = _window_occupancy(db, tenant_id, aware_time(new_start, timezone), window, exclude_id=reservation_id)
+            refusal = _capacity_refusal(occupancy, new_party, settings)
+            if refusal:
+                db.rollback()
+                return {"success": False, "reason": refusal}
+
+        # Valeurs avant/après retournées pour mettre à jour l'index d'occupation
+        row = db.execute(
+            text(f"""
+            WITH old AS (
+                SELECT id, start_time, party_size, status
+                FROM reservations
+                WHERE id = :reservation_id AND tenant_id = :tenant_id
+                FOR UPDATE
+            )
+            UPDATE reservations r
+            SET {", ".join(set_clauses)}
+            FROM old
+            WHERE r.id = old.id
+            RETURNING r.id,
+                      old.start_time AT TIME ZONE :tz AS old_start, old.party_size AS old_party_size, old.status AS old_status,
+                      r.start_time AT TIME ZONE :tz AS new_start, r.party_size AS new_party_size, r.status AS new_status
+            """),
+            params
+        ).mappings().first()
+        if not row:
+            db.rollback()
+            return {"success": False, "reason": "introuvable"}
+
+        written_at = time.monotonic()
+        db.commit()
+        return {"success": True, "row": dict(row), "written_at": written_at}
+
+    return _with_retries(db, operation)
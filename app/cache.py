@@ -0,0 +1,89 @@
+"""
+Cache mémoire LRU + TTL (par process), thread-safe
+Clés = tuples dont le premier élément est le tenant_id, pour pouvoir invalider un tenant entier.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU borné à max_entries entrées, chaque entrée expire après ttl secondes.
+    Compteurs hits/misses/evictions pour le suivi.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] <= now:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_tenant(self, tenant_id) -> int:
+        """Supprime toutes les entrées du tenant, retourne le nombre d'entrées supprimées"""
+        tenant_key = str(tenant_id)
+        with self._lock:
+            keys = [k for k in self._data if isinstance(k, tuple) and k and k[0] == tenant_key]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def invalidate_where(self, predicate) -> int:
+        """Supprime les entrées pour lesquelles predicate(key, value) est vrai (parcours complet: rare)"""
+        with self._lock:
+            keys = [k for k, (_, value) in self._data.items() if predicate(k, value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
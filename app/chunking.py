@@ -0,0 +1,122 @@
+"""
+Découpage des documents KB en chunks alignés sur la structure (paragraphes, listes, titres)
+Taille mesurée en tokens (tiktoken) plutôt qu'en caractères: un prix ou un nom de bouteille
+n'est jamais coupé en deux, et une liste trop longue est répartie entre plusieurs chunks
+qui reprennent chacun son titre ("Cognacs:", "Promotion spéciale:", ...).
+"""
+
+import os
+import re
+from typing import Dict, Any, List, Tuple, Optional
+from .tokens import count_tokens, tokenizer_name
+
+# Taille maximale d'un chunk (tokens)
+KB_CHUNK_TOKENS = int(os.getenv("KB_CHUNK_TOKENS", "200"))
+
+# Change quand l'algorithme ou la taille change (chunker_signature y ajoute le compteur de tokens): les documents seront re-découpés à la prochaine ingestion
+CHUNKER_SIGNATURE = f"structure-v1:{KB_CHUNK_TOKENS}"
+
+_PARAGRAPH_RE = re.compile(r"\S(?:.*\S)?(?:\n[ \t]*\S.*)*")
+_LINE_RE = re.compile(r"[^\n]*\S[^\n]*")
+_SENTENCE_RE = re.compile(r"[^.!?]+(?:[.!?]+|$)")
+_WORD_RE = re.compile(r"\S+")
+_LIST_ITEM_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+# Morceau de texte insécable: (début, fin, titre de la section ou None)
+Piece = Tuple[int, int, Optional[str]]
+
+
+def chunker_signature() -> str:
+    """CHUNKER_SIGNATURE + compteur de tokens (les tailles diffèrent entre tiktoken et l'estimation)"""
+    return f"{CHUNKER_SIGNATURE}:{tokenizer_name()}"
+
+
+def _is_heading(line: str) -> bool:
+    stripped = line.strip()
+    if stripped.startswith("#"):
+        return True
+    return stripped.endswith(":") and not _LIST_ITEM_RE.match(line) and len(stripped) <= 120
+
+
+def _split_oversized(text: str, start: int, end: int, max_tokens: int, heading: Optional[str]) -> List[Piece]:
+    """Ligne trop longue: découpe par phrases, puis par mots si nécessaire"""
+    pieces: List[Piece] = []
+    for sentence in _SENTENCE_RE.finditer(text, start, end):
+        s_start, s_end = sentence.start(), sentence.end()
+        if not text[s_start:s_end].strip():
+            continue
+        if count_tokens(text[s_start:s_end]) <= max_tokens:
+            pieces.append((s_start, s_end, heading))
+            continue
+        for word in _WORD_RE.finditer(text, s_start, s_end):
+            pieces.append((word.start(), word.end(), heading))
+    return pieces
+
+
+def _pieces(text: str, max_tokens: int) -> List[Piece]:
+    """Paragraphes entiers s'ils tiennent dans un chunk, sinon leurs lignes"""
+    pieces: List[Piece] = []
+    for paragraph in _PARAGRAPH_RE.finditer(text):
+        p_start, p_end = paragraph.span()
+        if count_tokens(paragraph.group()) <= max_tokens:
+            pieces.append((p_start, p_end, None))
+            continue
+
+        heading = None
+        for line in _LINE_RE.finditer(text, p_start, p_end):
+            l_start, l_end = line.span()
+            if _is_heading(line.group()):
+                heading = line.group().strip()
+                pieces.append((l_start, l_end, None))
+            elif count_tokens(line.group()) <= max_tokens:
+                pieces.append((l_start, l_end, heading))
+            else:
+                pieces.extend(_split_oversized(text, l_start, l_end, max_tokens, heading))
+    return pieces
+
+
+def chunk_document(text: str, max_tokens: int = None) -> List[Dict[str, Any]]:
+    """
+    Découpe un document en chunks d'au plus max_tokens tokens (défaut KB_CHUNK_TOKENS).
+    Retourne [{"text", "start", "end", "tokens", "heading"?}]: start/end = positions dans le texte source.
+    """
+    max_tokens = max_tokens or KB_CHUNK_TOKENS
+    chunks: List[Dict[str, Any]] = []
+    current: List[Piece] = []
+    prefix: Optional[str] = None
+
+    def chunk_body(pieces: List[Piece], heading: Optional[str]) -> str:
+        body = text[pieces[0][0]:pieces[-1][1]]
+        return f"{heading}\n{body}" if heading else body
+
+    def flush():
+        if not current:
+            return
+        body = chunk_body(current, prefix)
+        chunk = {
+            "text": body,
+            "start": current[0][0],
+            "end": current[-1][1],
+            "tokens": count_tokens(body),
+        }
+        if prefix:
+            chunk["heading"] = prefix
+        chunks.append(chunk)
+
+    for piece in _pieces(text or "", max_tokens):
+        if current and count_tokens(chunk_body(current + [piece], prefix)) > max_tokens:
+            flush()
+            current = []
+            # Suite d'une liste: on répète son titre pour garder le contexte
+            prefix = piece[2]
+            if prefix and count_tokens(chunk_body([piece], prefix)) > max_tokens:
+                prefix = None
+        current.append(piece)
+    flush()
+
+    return chunks
+
+
+def chunk_text(text: str, max_tokens: int = None) -> List[str]:
+    """Découpe le texte en chunks (texte seul)"""
+    return [chunk["text"] for chunk in chunk_document(text, max_tokens)]
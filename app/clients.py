@@ -0,0 +1,57 @@
+"""
+Clients des services externes (OpenAI, Twilio), créés au premier usage puis partagés par le process
+Importer un module de l'app ne construit aucun client, n'importe pas les SDK et ne lit aucun secret:
+un client manquant de configuration échoue à son premier appel, pas au démarrage.
+Un seul client (donc un seul pool de connexions keep-alive) par type pour tous les agents.
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict
+
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _shared(name: str, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _openai():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
+
+
+def _async_openai():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
+
+
+def _twilio():
+    from twilio.rest import Client
+    return Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
+
+
+def openai_client():
+    """Client OpenAI synchrone partagé"""
+    return _shared("openai", _openai)
+
+
+def async_openai_client():
+    """Client AsyncOpenAI partagé (un seul event loop par worker uvicorn)"""
+    return _shared("async_openai", _async_openai)
+
+
+def twilio_client():
+    """Client REST Twilio partagé (envoi des réponses différées)"""
+    return _shared("twilio", _twilio)
+
+
+def created_clients() -> list:
+    return sorted(_clients)
@@ -1,22 +1,210 @@
 import os
-from sqlalchemy import create_engine
+import time
+import threading
+from typing import Any, Dict
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-# Lecture de DATABASE_URL depuis l'environnement
+# Lecture de DATABASE_URL depuis l'environnement (vérifiée à la création du moteur, pas à l'import)
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable is not set!")
+# Pool de connexions, par moteur (sync et asyncio) et par process
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# PgBouncer (mode transaction): pas de cache de requêtes préparées côté asyncpg
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=3600)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class PoolStats:
+    """Attente pour obtenir une connexion du pool (checkout, création incluse), cumulée depuis le démarrage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 2),
+            }
+
+
+def _timed_pool(base):
+    """Pool dont chaque checkout est chronométré (épuisement du pool visible sur /health)"""
+
+    class TimedPool(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.stats = PoolStats()
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except exc.TimeoutError:
+                self.stats.record(time.perf_counter() - started, timed_out=True)
+                raise
+            self.stats.record(time.perf_counter() - started)
+            return connection
+
+        def recreate(self):
+            # dispose()/recreate() garde les compteurs
+            pool = super().recreate()
+            pool.stats = self.stats
+            return pool
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+
+TimedQueuePool = _timed_pool(QueuePool)
+TimedAsyncAdaptedQueuePool = _timed_pool(AsyncAdaptedQueuePool)
+
+_pool_options = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+
+
+def to_async_url(url: str):
+    """postgresql://... → postgresql+asyncpg://... (asyncpg ne comprend pas sslmode, passé en connect_args)"""
+    connect_args = {}
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    url = url.replace("postgresql+psycopg2://", "postgresql://", 1).replace("postgresql://", "postgresql+asyncpg://", 1)
+    if "sslmode=" in url:
+        base, _, query = url.partition("?")
+        params = [p for p in query.split("&") if p and not p.startswith("sslmode=")]
+        if any(p in query for p in ("sslmode=require", "sslmode=verify")):
+            connect_args["ssl"] = "require"
+        url = base + ("?" + "&".join(params) if params else "")
+    if DB_PGBOUNCER:
+        # Requêtes préparées liées à une connexion serveur: incompatibles avec le multiplexage PgBouncer
+        connect_args["statement_cache_size"] = 0
+        url += ("&" if "?" in url else "?") + "prepared_statement_cache_size=0"
+    return url, connect_args
+
+
+# Moteurs créés au premier usage (une fois par process): importer l'app n'ouvre rien
+_engines: Dict[str, Any] = {}
+_engines_lock = threading.Lock()
+
+
+def _database_url() -> str:
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL environment variable is not set!")
+    return DATABASE_URL
+
+
+def _create_engine():
+    return create_engine(_database_url(), poolclass=TimedQueuePool, **_pool_options)
+
+
+def _create_async_engine():
+    # Moteur asyncio (asyncpg) pour les webhooks: aucune requête SQL ne bloque l'event loop
+    url, connect_args = to_async_url(_database_url())
+    return create_async_engine(url, poolclass=TimedAsyncAdaptedQueuePool, connect_args=connect_args, **_pool_options)
+
+
+def _shared_engine(name: str, factory):
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                engine = _engines[name] = factory()
+    return engine
+
+
+def get_engine():
+    return _shared_engine("sync", _create_engine)
+
+
+def get_async_engine():
+    return _shared_engine("async", _create_async_engine)
+
+
+def __getattr__(name: str):
+    # from .db import engine / async_engine: moteur créé à ce moment-là
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazySessionmaker(sessionmaker):
+    """sessionmaker lié à son moteur à la première session (le moteur est créé à ce moment-là)"""
+
+    def __init__(self, engine_factory, **kw):
+        super().__init__(**kw)
+        self.engine_factory = engine_factory
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self.engine_factory())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = LazySessionmaker(get_engine, autocommit=False, autoflush=False)
+AsyncSessionLocal = LazySessionmaker(get_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
+
+def _pool_status(pool) -> Dict[str, Any]:
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "timeout_s": DB_POOL_TIMEOUT,
+        **pool.stats.snapshot(),
+    }
+
+
+def pool_status() -> Dict[str, Any]:
+    """État des pools (sync + asyncio) pour /health; None = moteur pas encore créé dans ce process"""
+    sync_engine, async_engine = _engines.get("sync"), _engines.get("async")
+    return {
+        "pgbouncer": DB_PGBOUNCER,
+        "sync": _pool_status(sync_engine.pool) if sync_engine else None,
+        "async": _pool_status(async_engine.sync_engine.pool) if async_engine else None,
+    }
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
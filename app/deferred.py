@@ -0,0 +1,286 @@
+"""
+Réponses différées: le webhook enregistre le message entrant, répond tout de suite à Twilio (TwiML vide),
+la réponse est générée par un pool de workers asyncio puis envoyée via l'API REST Twilio.
+La latence du webhook ne dépend plus de celle du LLM (timeout Twilio: 15 s).
+
+Durabilité: le message entrant est écrit (commit) avant l'accusé de réception, avec
+messages.reply_status = 'pending'. Un job ne porte que l'id du message; à la fin il passe à
+sent | skipped | failed. Les messages restés 'pending' (process arrêté, planté, redéployé) sont remis
+en file au démarrage puis toutes les DEFERRED_RECOVER_INTERVAL_S secondes, une fois réclamés depuis
+plus de DEFERRED_RECOVER_AFTER_S secondes (reply_claimed_at: un seul worker les reprend).
+
+Activation: DEFERRED_REPLIES=true (schema_simple.sql: colonnes reply_status / reply_claimed_at)
+Envoi: REPLY_SENDER=twilio (défaut) | fake (messages gardés en mémoire, tests/dev)
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .db import AsyncSessionLocal
+from .models import Message
+from .metrics import carry_request_context
+
+logger = logging.getLogger(__name__)
+
+DEFERRED_REPLIES = os.getenv("DEFERRED_REPLIES", "false").lower() == "true"
+DEFERRED_WORKERS = int(os.getenv("DEFERRED_WORKERS", "8"))
+DEFERRED_QUEUE_SIZE = int(os.getenv("DEFERRED_QUEUE_SIZE", "1000"))
+# Délai max pour vider la file à l'arrêt (secondes)
+DEFERRED_SHUTDOWN_TIMEOUT = float(os.getenv("DEFERRED_SHUTDOWN_TIMEOUT", "20"))
+# Reprise des messages 'pending': réclamés depuis plus de RECOVER_AFTER s, balayage toutes les RECOVER_INTERVAL s
+DEFERRED_RECOVER_AFTER_S = float(os.getenv("DEFERRED_RECOVER_AFTER_S", "300"))
+DEFERRED_RECOVER_INTERVAL_S = float(os.getenv("DEFERRED_RECOVER_INTERVAL_S", "60"))
+REPLY_SENDER = os.getenv("REPLY_SENDER", "twilio")
+
+SEND_RETRIES = 3
+SEND_RETRY_BASE_S = 0.5
+
+
+class TwilioReplySender:
+    """Envoi via l'API REST Twilio (client synchrone exécuté dans un thread)"""
+
+    async def send(self, to: str, from_: str, body: str) -> str:
+        from .whatsapp import send_message
+        return await asyncio.to_thread(send_message, to, body, from_)
+
+
+class FakeReplySender:
+    """Faux Twilio local: garde les messages envoyés en mémoire"""
+
+    def __init__(self):
+        self.sent: List[Dict[str, str]] = []
+
+    async def send(self, to: str, from_: str, body: str) -> str:
+        sid = f"SMfake{len(self.sent) + 1:06d}"
+        self.sent.append({"sid": sid, "to": to, "from": from_, "body": body})
+        return sid
+
+
+def get_reply_sender():
+    return FakeReplySender() if REPLY_SENDER == "fake" else TwilioReplySender()
+
+
+async def save_pending_message(db: AsyncSession, tenant_id, conversation_id, content: str, provider_message_id: str = None) -> uuid.UUID:
+    """
+    Message entrant écrit et committé avant l'accusé de réception (jamais via le journal différé),
+    marqué 'pending': sa réponse sera générée par le pool, ou reprise après un arrêt du process
+    """
+    now = datetime.now(timezone.utc)
+    message = Message(
+        id=uuid.uuid4(),
+        tenant_id=tenant_id,
+        conversation_id=conversation_id,
+        direction="in",
+        role="user",
+        content=content,
+        content_type="text",
+        provider_message_id=provider_message_id,
+        reply_status="pending",
+        reply_claimed_at=now,
+        created_at=now,
+    )
+    db.add(message)
+    await db.commit()
+    return message.id
+
+
+class ReplyStore:
+    """Statut des réponses différées sur la ligne du message entrant (messages.reply_status)"""
+
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory or AsyncSessionLocal
+
+    async def claim(self, message_id) -> Optional[Dict[str, Any]]:
+        """
+        Message encore 'pending' réclamé (reply_claimed_at = now()) avec ses adresses:
+        to = client (customers.phone_e164), from = channel (channels.address). None s'il a déjà été traité
+        """
+        async with self.session_factory() as db:
+            row = (await db.execute(
+                text("""
+                UPDATE messages m
+                SET reply_claimed_at = now()
+                FROM conversations c
+                JOIN customers cu ON cu.id = c.customer_id
+                JOIN channels ch ON ch.id = c.channel_id
+                WHERE m.id = :message_id
+                  AND m.reply_status = 'pending'
+                  AND c.id = m.conversation_id
+                RETURNING m.id, m.tenant_id, m.conversation_id, m.content,
+                          cu.phone_e164 AS to_address, ch.address AS from_address
+                """),
+                {"message_id": message_id}
+            )).first()
+            await db.commit()
+        return dict(row._mapping) if row else None
+
+    async def finish(self, message_id, status: str) -> None:
+        """status: sent | skipped | failed"""
+        async with self.session_factory() as db:
+            await db.execute(
+                text("UPDATE messages SET reply_status = :status WHERE id = :message_id"),
+                {"message_id": message_id, "status": status}
+            )
+            await db.commit()
+
+    async def claim_stale(self, older_than_s: float, limit: int) -> List[uuid.UUID]:
+        """
+        Messages 'pending' réclamés depuis plus de older_than_s secondes (process disparu): réclamés à
+        nouveau; un autre worker qui balaie en même temps ne les voit plus (reply_claimed_at rafraîchi)
+        """
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                text("""
+                UPDATE messages
+                SET reply_claimed_at = now()
+                WHERE id IN (
+                    SELECT id
+                    FROM messages
+                    WHERE reply_status = 'pending'
+                      AND reply_claimed_at < now() - make_interval(secs => :older_than_s)
+                    ORDER BY created_at
+                    LIMIT :limit
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id
+                """),
+                {"older_than_s": older_than_s, "limit": limit}
+            )).all()
+            await db.commit()
+        return [row.id for row in rows]
+
+
+# Génère le texte de la réponse d'un message réclamé (ReplyStore.claim), None s'il n'y a rien à envoyer
+ReplyHandler = Callable[[Dict[str, Any]], Awaitable[Optional[str]]]
+
+
+class DeferredReplyQueue:
+    """File bornée (ids des messages entrants) + pool de workers asyncio (démarrés au startup de l'app)"""
+
+    def __init__(self, workers: int = DEFERRED_WORKERS, max_size: int = DEFERRED_QUEUE_SIZE, sender=None, store=None):
+        self.workers = workers
+        self.max_size = max_size
+        self.sender = sender or get_reply_sender()
+        self.store = store or ReplyStore()
+        self.handler: Optional[ReplyHandler] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self._recovery: Optional[asyncio.Task] = None
+        self.stats = {"enqueued": 0, "recovered": 0, "sent": 0, "skipped": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self.tasks)
+
+    def start(self, handler: ReplyHandler, recover_interval: float = DEFERRED_RECOVER_INTERVAL_S) -> None:
+        if self.running:
+            return
+        self.handler = handler
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        if recover_interval:
+            self._recovery = asyncio.create_task(self._recover_loop(recover_interval))
+
+    async def stop(self, timeout: float = DEFERRED_SHUTDOWN_TIMEOUT) -> None:
+        """
+        Laisse les workers vider la file (au plus timeout secondes) puis les arrête.
+        Les messages non traités restent 'pending' en base: repris par le prochain process.
+        """
+        if not self.running:
+            return
+        if self._recovery:
+            self._recovery.cancel()
+            await asyncio.gather(self._recovery, return_exceptions=True)
+            self._recovery = None
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error("%s réponses différées non envoyées à l'arrêt (restent en attente en base)", self.queue.qsize())
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def enqueue(self, message_id) -> None:
+        """
+        Lève asyncio.QueueFull si la file est pleine (l'appelant répond alors en synchrone, puis finish())
+        Le job garde le contexte de la requête (request_id, tenant, canal) pour ses logs et métriques.
+        """
+        self.queue.put_nowait(carry_request_context(partial(self._reply, message_id)))
+        self.stats["enqueued"] += 1
+
+    async def finish(self, message_id, status: str) -> None:
+        """Réponse donnée hors du pool (file pleine: réponse synchrone)"""
+        await self.store.finish(message_id, status)
+
+    async def recover(self, older_than_s: float = DEFERRED_RECOVER_AFTER_S) -> int:
+        """Remet en file les messages restés 'pending' (attend qu'il y ait de la place)"""
+        message_ids = await self.store.claim_stale(older_than_s, self.max_size)
+        for message_id in message_ids:
+            await self.queue.put(carry_request_context(partial(self._reply, message_id)))
+        if message_ids:
+            self.stats["recovered"] += len(message_ids)
+            logger.warning("%s réponses différées reprises", len(message_ids))
+        return len(message_ids)
+
+    async def _recover_loop(self, interval: float) -> None:
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.error("Reprise des réponses différées en échec: %s", e)
+            await asyncio.sleep(interval)
+
+    async def _send_with_retries(self, to: str, from_: str, body: str) -> None:
+        for attempt in range(1, SEND_RETRIES + 1):
+            try:
+                await self.sender.send(to, from_, body)
+                return
+            except Exception as e:
+                if attempt == SEND_RETRIES:
+                    raise
+                logger.warning("Envoi de la réponse différée en échec (tentative %s): %s", attempt, e)
+                await asyncio.sleep(SEND_RETRY_BASE_S * 2 ** (attempt - 1))
+
+    async def _reply(self, message_id) -> None:
+        inbound = await self.store.claim(message_id)
+        if inbound is None:
+            # Déjà traité (reprise concurrente, réponse synchrone)
+            return
+        try:
+            body = await self.handler(inbound)
+            if body:
+                await self._send_with_retries(inbound["to_address"], inbound["from_address"], body)
+        except Exception:
+            await self.store.finish(message_id, "failed")
+            raise
+        status = "sent" if body else "skipped"
+        await self.store.finish(message_id, status)
+        self.stats[status] += 1
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job = await self.queue.get()
+            try:
+                await job()
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error("Réponse différée en échec (worker %s): %s", worker_id, e)
+            finally:
+                self.queue.task_done()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "workers": len(self.tasks),
+        }
+
+
+deferred_replies = DeferredReplyQueue()
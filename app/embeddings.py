@@ -0,0 +1,100 @@
+"""
+Embeddings pour la recherche vectorielle (kb_chunks.embedding, vector(1536))
+- OpenAIEmbedder: API OpenAI, appels groupés par lots
+- LocalHashEmbedder: déterministe, sans réseau (tests, dev hors-ligne)
+"""
+
+import os
+import math
+import hashlib
+from typing import List, Sequence
+from .lexical import fold_accents
+
+EMBEDDING_DIM = 1536
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# local | openai: l'API OpenAI (réseau, coût par appel) n'est utilisée que si elle est choisie explicitement
+EMBEDDER = os.getenv("EMBEDDER", "local")
+
+
+class LocalHashEmbedder:
+    """
+    Embedder local par hachage de n-grammes de caractères (trigrammes par mot).
+    Deux textes qui partagent des fragments de mots ("Hennes" / "Hennessy")
+    obtiennent des vecteurs proches, sans aucun appel réseau.
+    """
+
+    name = "local-hash"
+
+    def __init__(self, dim: int = EMBEDDING_DIM, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.dim = dim
+        self.batch_size = batch_size
+
+    def _bucket(self, feature: str) -> int:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.dim
+
+    def embed_one(self, value: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for word in fold_accents(value or "").split():
+            word = "".join(c for c in word if c.isalnum())
+            if not word:
+                continue
+            padded = f"#{word}#"
+            vector[self._bucket("w:" + word)] += 1.0
+            for i in range(len(padded) - 2):
+                vector[self._bucket(padded[i:i + 3])] += 1.0
+
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        return [self.embed_one(t) for t in texts]
+
+
+class OpenAIEmbedder:
+    """Embeddings OpenAI (text-embedding-3-small = 1536 dimensions)"""
+
+    name = "openai"
+
+    def __init__(self, model: str = EMBEDDING_MODEL, batch_size: int = EMBEDDING_BATCH_SIZE):
+        from .clients import openai_client
+        self.client = openai_client()
+        self.model = model
+        self.dim = EMBEDDING_DIM
+        self.batch_size = batch_size
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.model, input=list(texts))
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+_embedder = None
+
+
+def get_embedder():
+    """Embedder configuré par la variable EMBEDDER (instancié une seule fois)"""
+    global _embedder
+    if _embedder is None:
+        if EMBEDDER == "local":
+            _embedder = LocalHashEmbedder()
+        elif EMBEDDER == "openai":
+            _embedder = OpenAIEmbedder()
+        else:
+            raise ValueError(f"EMBEDDER inconnu: {EMBEDDER} (local | openai)")
+    return _embedder
+
+
+def embed_texts(texts: Sequence[str], embedder=None) -> List[List[float]]:
+    """Calcule les embeddings par lots de embedder.batch_size textes"""
+    embedder = embedder or get_embedder()
+    vectors: List[List[float]] = []
+    for start in range(0, len(texts), embedder.batch_size):
+        vectors.extend(embedder.embed(texts[start:start + embedder.batch_size]))
+    return vectors
+
+
+def to_pgvector(vector: Sequence[float]) -> str:
+    """Format texte accepté par pgvector: '[0.1,0.2,...]'"""
+    return "[" + ",".join(f"{v:.6f}" for v in vector) + "]"
@@ -0,0 +1,260 @@
+"""
+Historique de conversation pour le LLM, borné en tokens
+- Une seule requête (index messages (conversation_id, created_at)): contexte de la conversation
+  + les HISTORY_MAX_MESSAGES derniers messages user/assistant
+- Les messages les plus récents sont gardés tant que le budget HISTORY_TOKEN_BUDGET (tiktoken) le permet
+- Option HISTORY_SUMMARY=true: les messages sortis du budget sont résumés dans conversations.context
+  ("summary"), le résumé est envoyé au LLM à la place des anciens messages
+- Fenêtre assemblée (messages comptés en tokens, résumé) mise en cache par conversation; la requête est
+  toujours exécutée (source de vérité pour tous les workers) et la fenêtre n'est réutilisée que si les
+  ids des messages et summary_until lus sont les mêmes; sinon seuls les nouveaux messages sont comptés
+- Les messages pas encore écrits par message_sink (écriture différée) sont fusionnés au chargement
+"""
+
+import os
+import json
+import uuid
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from .cache import TTLCache
+from .message_sink import message_sink
+from .tokens import count_tokens
+from .llm_gateway import chat, achat
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "40"))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "300"))
+
+HISTORY_SUMMARY = os.getenv("HISTORY_SUMMARY", "false").lower() == "true"
+# Nombre min de messages sortis du budget avant de mettre le résumé à jour (un appel LLM)
+HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", "6"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Surcoût par message du format chat (rôle, séparateurs)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """Résume cette conversation entre un client et le réceptionniste d'un établissement.
+Garde uniquement les faits utiles pour la suite: demande du client, date/heure, nombre de personnes,
+nom, réservations créées ou modifiées (avec numéros), questions en suspens. 5 lignes maximum."""
+
+_windows = TTLCache(max_entries=int(os.getenv("HISTORY_CACHE_SIZE", "4096")), ttl=HISTORY_CACHE_TTL)
+
+
+def _message(role: str, content: str, created_at: Optional[datetime] = None, message_id=None) -> Dict[str, Any]:
+    # Horodatage ISO en UTC: comparable (ordre des chaînes) avec summary_until
+    return {
+        "id": str(message_id) if message_id else None,
+        "role": role,
+        "content": content,
+        "created_at": created_at.astimezone(timezone.utc).isoformat() if created_at else None,
+        "tokens": count_tokens(content) + MESSAGE_OVERHEAD_TOKENS,
+    }
+
+
+def trim_to_budget(messages: List[Dict[str, Any]], budget: int = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Garde les messages les plus récents qui tiennent dans le budget.
+    Retourne (gardés, écartés), chacun dans l'ordre chronologique.
+    """
+    budget = HISTORY_TOKEN_BUDGET if budget is None else budget
+    used = 0
+    cut = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        tokens = messages[i].get("tokens") or count_tokens(messages[i]["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + tokens > budget:
+            break
+        used += tokens
+        cut = i
+    return messages[cut:], messages[:cut]
+
+
+def trim_history(history: List[Dict[str, str]], budget: int = None) -> List[Dict[str, str]]:
+    """Historique fourni par le client (role/content) borné au budget de tokens"""
+    messages = [_message(m["role"], m["content"]) for m in history if m.get("role") in ("user", "assistant") and m.get("content")]
+    kept, _ = trim_to_budget(messages, budget)
+    return [{"role": m["role"], "content": m["content"]} for m in kept]
+
+
+def _load_window(db: Session, conversation_id: str, cached: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Fenêtre à jour de la conversation. cached (fenêtre précédente de ce worker) est renvoyée telle quelle si
+    elle correspond aux messages lus, sinon ses messages déjà comptés en tokens sont repris par id.
+    """
+    try:
+        # SAVEPOINT: un identifiant invalide ne doit pas casser la transaction de l'appelant
+        with db.begin_nested():
+            rows = db.execute(
+                text("""
+                SELECT c.context, m.id, m.role, m.content, m.created_at
+                FROM conversations c
+                LEFT JOIN LATERAL (
+                    SELECT id, role, content, created_at
+                    FROM messages
+                    WHERE conversation_id = c.id
+                      AND role IN ('user', 'assistant')
+                      AND content IS NOT NULL AND content <> ''
+                    ORDER BY created_at DESC
+                    LIMIT :limit
+                ) m ON true
+                WHERE c.id = :conversation_id
+                """),
+                {"conversation_id": uuid.UUID(str(conversation_id)), "limit": HISTORY_MAX_MESSAGES}
+            ).all()
+    except Exception as e:
+        logger.error("Lecture de l'historique en échec: %s", e)
+        rows = []
+
+    context = (rows[0].context if rows else None) or {}
+    loaded = [row for row in reversed(rows) if row.role]
+
+    # Messages encore dans le tampon d'écriture différée (message_sink): pas encore en base
+    loaded_ids = {row.id for row in loaded}
+    buffered = [
+        row for row in message_sink.pending_for(conversation_id)
+        if row["id"] not in loaded_ids and row["role"] in ("user", "assistant") and row["content"]
+    ]
+    if buffered:
+        loaded = sorted(
+            [(row.created_at, row.role, row.content, row.id) for row in loaded]
+            + [(row["created_at"], row["role"], row["content"], row["id"]) for row in buffered]
+        )[-HISTORY_MAX_MESSAGES:]
+    else:
+        loaded = [(row.created_at, row.role, row.content, row.id) for row in loaded]
+
+    ids = [str(message_id) for _, _, _, message_id in loaded]
+    if (
+        cached is not None
+        and [m["id"] for m in cached["messages"]] == ids
+        and cached.get("summary_until") == context.get("summary_until")
+    ):
+        return cached
+
+    counted = {m["id"]: m for m in cached["messages"]} if cached is not None else {}
+    messages = [
+        counted.get(str(message_id)) or _message(role, content, created_at, message_id)
+        for created_at, role, content, message_id in loaded
+    ]
+    return {
+        "summary": context.get("summary"),
+        "summary_until": context.get("summary_until"),
+        "messages": messages,
+    }
+
+
+def _get_window(db: Session, conversation_id) -> Dict[str, Any]:
+    key = (str(conversation_id),)
+    cached = _windows.get(key)
+    window = _load_window(db, key[0], cached)
+    if window is not cached:
+        _windows.set(key, window)
+    return window
+
+
+def invalidate_history(conversation_id) -> None:
+    _windows.delete((str(conversation_id),))
+
+
+def history_cache_stats() -> Dict[str, Any]:
+    return _windows.stats()
+
+
+def _split_window(window: Dict[str, Any], current_user_text: Optional[str]):
+    messages = window["messages"]
+    # Le message entrant est déjà sauvegardé: il est envoyé séparément par l'agent
+    if current_user_text and messages and messages[-1]["role"] == "user" and messages[-1]["content"] == current_user_text:
+        messages = messages[:-1]
+    kept, dropped = trim_to_budget(messages)
+    summary_until = window.get("summary_until")
+    unsummarized = [m for m in dropped if not summary_until or (m["created_at"] or "") > summary_until]
+    return kept, unsummarized
+
+
+def _as_chat_messages(summary: Optional[str], kept: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    chat = [{"role": "system", "content": f"Résumé de la conversation jusqu'ici:\n{summary}"}] if summary else []
+    chat.extend({"role": m["role"], "content": m["content"]} for m in kept)
+    return chat
+
+
+def _summary_request(previous: Optional[str], dropped: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+    if previous:
+        transcript = f"Résumé précédent:\n{previous}\n\nSuite:\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": transcript},
+    ]
+
+
+def _store_summary(db: Session, conversation_id, window: Dict[str, Any], summary: str, dropped: List[Dict[str, Any]]) -> None:
+    summary_until = dropped[-1]["created_at"]
+    window["summary"], window["summary_until"] = summary, summary_until
+    db.execute(
+        text("""
+        UPDATE conversations
+        SET context = COALESCE(context, '{}'::jsonb) || CAST(:patch AS jsonb), updated_at = now()
+        WHERE id = :conversation_id
+        """),
+        {
+            "conversation_id": uuid.UUID(str(conversation_id)),
+            "patch": json.dumps({"summary": summary, "summary_until": summary_until}, ensure_ascii=False),
+        }
+    )
+    db.commit()
+
+
+def get_history(db: Session, conversation_id, current_user_text: Optional[str] = None) -> List[Dict[str, str]]:
+    """Historique prêt pour l'API chat (résumé éventuel + derniers messages dans le budget)"""
+    if not conversation_id:
+        return []
+    with timed("history"):
+        window = _get_window(db, conversation_id)
+    kept, unsummarized = _split_window(window, current_user_text)
+
+    if HISTORY_SUMMARY and len(unsummarized) >= HISTORY_SUMMARY_BATCH:
+        try:
+            with timed("llm_summary"):
+                response = chat(
+                    "summary",
+                    model=HISTORY_SUMMARY_MODEL,
+                    messages=_summary_request(window["summary"], unsummarized),
+                    temperature=0,
+                    max_tokens=200,
+                )
+            _store_summary(db, conversation_id, window, response.choices[0].message.content, unsummarized)
+        except Exception as e:
+            logger.error("Résumé de l'historique en échec: %s", e)
+
+    return _as_chat_messages(window["summary"], kept)
+
+
+async def get_history_async(db: AsyncSession, conversation_id, current_user_text: Optional[str] = None) -> List[Dict[str, str]]:
+    """Équivalent asyncio de get_history (résumé via AsyncOpenAI: l'event loop n'est pas bloqué)"""
+    if not conversation_id:
+        return []
+    with timed("history"):
+        window = await db.run_sync(_get_window, conversation_id)
+    kept, unsummarized = _split_window(window, current_user_text)
+
+    if HISTORY_SUMMARY and len(unsummarized) >= HISTORY_SUMMARY_BATCH:
+        try:
+            with timed("llm_summary"):
+                response = await achat(
+                    "summary",
+                    model=HISTORY_SUMMARY_MODEL,
+                    messages=_summary_request(window["summary"], unsummarized),
+                    temperature=0,
+                    max_tokens=200,
+                )
+            summary = response.choices[0].message.content
+            await db.run_sync(lambda session: _store_summary(session, conversation_id, window, summary, unsummarized))
+        except Exception as e:
+            logger.error("Résumé de l'historique en échec: %s", e)
+
+    return _as_chat_messages(window["summary"], kept)
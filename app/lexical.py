@@ -0,0 +1,115 @@
+"""
+Recherche lexicale en mémoire - index inversé + score BM25
+Analyseur français: minuscules, suppression des accents, élisions, mots vides, racinisation légère
+"""
+
+import re
+import math
+import heapq
+import unicodedata
+from typing import Dict, Any, List, Tuple
+
+# Mots vides français (déjà sans accents, comparés après normalisation)
+STOP_WORDS = {
+    'le', 'la', 'les', 'un', 'une', 'des', 'du', 'de', 'et', 'ou', 'au', 'aux',
+    'est', 'sont', 'quel', 'quelle', 'quels', 'quelles', 'comment', 'combien',
+    'avez', 'vous', 'votre', 'vos', 'notre', 'nos', 'je', 'il', 'elle', 'nous', 'ils', 'elles',
+    'sur', 'dans', 'en', 'pour', 'par', 'avec', 'que', 'qui', 'qu', 'quoi', 'ce', 'ces', 'se', 'sa',
+    'son', 'ses', 'ne', 'pas', 'me', 'te', 'moi', 'toi',
+}
+
+# Suffixes retirés par la racinisation (du plus long au plus court)
+_SUFFIXES = (
+    "issements", "issement", "ements", "ement", "ations", "ation", "euses", "euse",
+    "eurs", "eur", "ives", "ive", "ifs", "elles", "elle", "ables", "able",
+    "ees", "ee", "es", "er", "ez", "e", "s", "x",
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Paramètres BM25 classiques
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def fold_accents(value: str) -> str:
+    """Minuscules + suppression des accents (é → e, ç → c)"""
+    decomposed = unicodedata.normalize("NFKD", value.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem_fr(word: str) -> str:
+    """Racinisation française légère: retire un seul suffixe flexionnel/dérivationnel"""
+    if word.endswith("aux") and len(word) > 5:
+        return word[:-3] + "al"
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def analyze(value: str) -> List[str]:
+    """Texte brut → liste de termes indexables (les apostrophes coupent les élisions: l'heure → heure)"""
+    terms = []
+    for token in _TOKEN_RE.findall(fold_accents(value or "")):
+        if token in STOP_WORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        terms.append(stem_fr(token))
+    return terms
+
+
+class BM25Index:
+    """
+    Index inversé en mémoire (terme → postings) avec score BM25.
+    La recherche ne parcourt que les postings des termes de la requête,
+    le coût ne dépend donc pas du nombre total de chunks.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Dict[str, Any]] = []
+        self.doc_lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, doc: Dict[str, Any], text_value: str) -> None:
+        """Ajoute un document (dict renvoyé tel quel dans les résultats)"""
+        doc_idx = len(self.docs)
+        terms = analyze(text_value)
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, tf in frequencies.items():
+            self.postings.setdefault(term, []).append((doc_idx, tf))
+        self.docs.append(doc)
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        n = len(self.docs)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[float, Dict[str, Any]]]:
+        """Retourne les top_k (score, doc) triés par score BM25 décroissant"""
+        if not self.docs:
+            return []
+
+        avg_length = self.total_length / len(self.docs) or 1.0
+        scores: Dict[int, float] = {}
+
+        for term in set(analyze(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_idx, tf in postings:
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_idx] / avg_length
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, self.docs[doc_idx]) for doc_idx, score in best]
@@ -0,0 +1,534 @@
+"""
+Passerelle des appels LLM (chat.completions): délai par canal, requête doublée, reprises, disjoncteur
+Tous les appels de l'agent passent par chat() / achat() / astream() au lieu du client OpenAI:
+- délai par appel selon le canal de la requête (LLM_DEADLINES): la voix n'attend pas 20 s un fournisseur lent
+- requête doublée (hedging): sans réponse après le p95 des latences récentes de l'agent, une 2e requête
+  identique part; la première réponse gagne, l'autre est annulée. Au plus LLM_HEDGE_RATIO des appels doublés.
+  Client synchrone (chat): la requête initiale reste dans le thread appelant, le doublon (pool llm-hedge)
+  ne sert que de relais si elle échoue
+- reprises sur erreur transitoire (délai dépassé, connexion, 408/409/429, 5xx): backoff exponentiel à gigue
+  complète (Retry-After respecté), seulement si le délai restant laisse le temps d'un nouvel essai
+- disjoncteur: trop d'échecs sur les derniers appels → ouvert, les appels échouent aussitôt pendant
+  LLM_BREAKER_COOLDOWN_S, puis un seul appel d'essai décide de la refermeture
+Échec final (reprises épuisées, délai dépassé, disjoncteur ouvert, requête refusée par le fournisseur):
+LLMUnavailable; l'appelant répond alors sans LLM (kb_fallback_reply: premier extrait de la KB).
+Clé refusée ou révoquée (401/403): compte comme un échec pour le disjoncteur, comme une panne.
+Flux (astream): délai, doublement et reprises portent sur le premier fragment; ensuite chaque fragment
+doit arriver en moins de LLM_STREAM_IDLE_S (rien n'est rejoué une fois du texte envoyé); une erreur en
+cours de flux remonte aussi en LLMUnavailable.
+
+Configuration:
+    LLM_DEADLINES=voice=4,whatsapp=15,sms=15,web=20,api=30    délai d'un appel (s) par canal
+    LLM_DEADLINE_DEFAULT=20                                  canal inconnu (tâches hors requête)
+    LLM_MAX_RETRIES=2
+    LLM_HEDGE=true
+    LLM_HEDGE_QUANTILE=0.95  LLM_HEDGE_MIN_SAMPLES=20  LLM_HEDGE_RATIO=0.1
+    LLM_BREAKER=true
+    LLM_BREAKER_WINDOW=20  LLM_BREAKER_MIN_CALLS=10  LLM_BREAKER_FAILURE_RATIO=0.5  LLM_BREAKER_COOLDOWN_S=30
+    LLM_STREAM_IDLE_S=5
+Métriques: ktios_llm_gateway_calls_total{outcome}, ktios_llm_retries_total, ktios_llm_hedges_total,
+ktios_llm_fallbacks_total, ktios_llm_breaker_state (app/metrics.py)
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional
+
+from .clients import openai_client, async_openai_client
+from .metrics import current_labels, record_llm_call, record_llm_retry, record_llm_hedge
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_deadlines(value: str) -> Dict[str, float]:
+    """"voice=4,sms=15" → {"voice": 4.0, "sms": 15.0}"""
+    deadlines = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        channel, _, seconds = item.partition("=")
+        deadlines[channel.strip()] = float(seconds)
+    return deadlines
+
+
+LLM_DEADLINES = _parse_deadlines(os.getenv("LLM_DEADLINES", "voice=4,whatsapp=15,sms=15,web=20,api=30"))
+LLM_DEADLINE_DEFAULT = float(os.getenv("LLM_DEADLINE_DEFAULT", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_S = float(os.getenv("LLM_RETRY_BASE_S", "0.2"))
+LLM_RETRY_CAP_S = float(os.getenv("LLM_RETRY_CAP_S", "2"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "true").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_RATIO = float(os.getenv("LLM_HEDGE_RATIO", "0.1"))
+LLM_BREAKER = os.getenv("LLM_BREAKER", "true").lower() == "true"
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_FAILURE_RATIO = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+LLM_BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+LLM_STREAM_IDLE_S = float(os.getenv("LLM_STREAM_IDLE_S", "5"))
+
+# Latences gardées par agent pour le seuil de doublement
+LATENCY_WINDOW = 200
+# En dessous, une nouvelle tentative n'a aucune chance d'aboutir: échec immédiat
+MIN_ATTEMPT_S = 0.3
+
+FALLBACK_NO_KB = "Erreur technique. Contactez-nous au 367-382-0451."
+
+
+class LLMUnavailable(Exception):
+    """Pas de réponse LLM utilisable: reason = breaker_open | deadline | error | client_error"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"LLM indisponible ({reason})")
+        self.reason = reason
+
+
+def kb_fallback_reply(kb_results: List[Dict[str, Any]]) -> str:
+    """Réponse sans LLM: début du meilleur extrait de la KB, sinon le numéro du bar"""
+    if kb_results:
+        return kb_results[0]['chunk_text'][:300]
+    return FALLBACK_NO_KB
+
+
+def _is_timeout(error: BaseException) -> bool:
+    import openai
+    return isinstance(error, (TimeoutError, openai.APITimeoutError))
+
+
+def _retryable(error: BaseException) -> bool:
+    import httpx
+    import openai
+    # httpx.TransportError: connexion coupée pendant la lecture d'un flux (non convertie par le SDK)
+    if isinstance(error, (TimeoutError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _refused(error: BaseException) -> bool:
+    """Réponse d'erreur du fournisseur (statut HTTP), par opposition à une erreur locale"""
+    import openai
+    return isinstance(error, openai.APIStatusError)
+
+
+def _auth_error(error: BaseException) -> bool:
+    """Clé refusée ou révoquée: tous les appels suivants échoueront aussi"""
+    return _refused(error) and error.status_code in (401, 403)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _settle(task: asyncio.Future, discard: Callable = None) -> None:
+    """Requête perdante (annulée ou terminée trop tard): erreur lue, réponse éventuelle fermée"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    if discard:
+        asyncio.ensure_future(discard(task.result()))
+
+
+class CircuitBreaker:
+    """
+    closed: appels normaux, issues gardées sur les window derniers appels
+    open: >= failure_ratio d'échecs (min_calls appels au moins) → refus immédiat pendant cooldown
+    half_open: un seul appel d'essai; succès → closed, échec → open
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, window: int, min_calls: int, failure_ratio: float, cooldown: float):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened = 0
+        self._results: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if ok:
+                    self.state = self.CLOSED
+                    self._results.clear()
+                    logger.info("Disjoncteur LLM refermé")
+                else:
+                    self._open()
+                return
+            if self.state == self.OPEN:
+                # Réponse d'un appel parti avant l'ouverture
+                return
+            self._results.append(ok)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures >= self.failure_ratio * len(self._results):
+                self._open()
+
+    def release(self) -> None:
+        """Appel annulé par l'appelant: pas d'issue, l'essai du semi-ouvert est rendu"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._results.clear()
+        self.opened += 1
+        logger.warning("Disjoncteur LLM ouvert", extra={"cooldown_s": self.cooldown})
+
+
+class LatencyTracker:
+    """Dernières latences réussies d'un agent: seuil de doublement (quantile)"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._values: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._values.append(seconds)
+
+    def quantile(self, q: float, min_samples: int) -> Optional[float]:
+        if len(self._values) < max(min_samples, 1):
+            return None
+        values = sorted(self._values)
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        max_retries: int = LLM_MAX_RETRIES,
+        hedge: bool = LLM_HEDGE,
+        hedge_quantile: float = LLM_HEDGE_QUANTILE,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        hedge_ratio: float = LLM_HEDGE_RATIO,
+        breaker: bool = LLM_BREAKER,
+        deadlines: Dict[str, float] = None,
+        default_deadline: float = None,
+    ):
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_ratio = hedge_ratio
+        self.deadlines = LLM_DEADLINES if deadlines is None else deadlines
+        self.default_deadline = LLM_DEADLINE_DEFAULT if default_deadline is None else default_deadline
+        self.breaker = CircuitBreaker(LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_FAILURE_RATIO, LLM_BREAKER_COOLDOWN_S) if breaker else None
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._calls = 0
+        self._hedges = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # ----- état partagé -----
+
+    def _deadline(self) -> float:
+        return time.monotonic() + self.deadlines.get(current_labels()[1], self.default_deadline)
+
+    def _hedge_delay(self, key: str, timeout: float) -> Optional[float]:
+        """Attente avant doublement, None si pas de doublement (désactivé, historique trop court, pas le temps)"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            self._calls += 1
+            tracker = self._latencies.get(key)
+        delay = tracker.quantile(self.hedge_quantile, self.hedge_min_samples) if tracker else None
+        if delay is None or delay >= timeout - MIN_ATTEMPT_S:
+            return None
+        return delay
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self._hedges >= self.hedge_ratio * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def _observe_latency(self, key: str, seconds: float) -> None:
+        with self._lock:
+            tracker = self._latencies.get(key)
+            if tracker is None:
+                tracker = self._latencies[key] = LatencyTracker()
+        tracker.observe(seconds)
+
+    def _admit(self, agent: str) -> None:
+        if self.breaker and not self.breaker.allow():
+            record_llm_call(agent, "breaker_open")
+            raise LLMUnavailable("breaker_open")
+
+    def _record(self, ok: bool) -> None:
+        if self.breaker:
+            self.breaker.record(ok)
+
+    def _release(self) -> None:
+        if self.breaker:
+            self.breaker.release()
+
+    def _after_failure(self, agent: str, attempt: int, error: Exception, deadline: float) -> float:
+        """Erreur d'une tentative: attente avant la reprise, ou exception finale"""
+        if not _retryable(error):
+            if not _refused(error):
+                # Erreur locale (paramètres, bug): pas d'appel abouti au fournisseur
+                self._record(True)
+                raise error
+            # Requête refusée (400, 404...): le fournisseur répond, pas une panne; clé refusée (401/403): panne
+            self._record(not _auth_error(error))
+            record_llm_call(agent, "client_error")
+            logger.warning("Appel LLM refusé", extra={"agent": agent, "status": error.status_code, "error": str(error)})
+            raise LLMUnavailable("client_error") from error
+        self._record(False)
+        reason = "deadline" if _is_timeout(error) else "error"
+        backoff = random.uniform(0, min(LLM_RETRY_CAP_S, LLM_RETRY_BASE_S * 2 ** attempt))
+        backoff = max(backoff, _retry_after(error) or 0)
+        if attempt >= self.max_retries or time.monotonic() + backoff > deadline - MIN_ATTEMPT_S:
+            record_llm_call(agent, reason)
+            logger.warning("Appel LLM abandonné", extra={"agent": agent, "reason": reason, "attempts": attempt + 1, "error": str(error)})
+            raise LLMUnavailable(reason) from error
+        record_llm_retry(agent, type(error).__name__)
+        return backoff
+
+    def _succeeded(self, agent: str, key: str, started: float) -> None:
+        self._record(True)
+        self._observe_latency(key, time.monotonic() - started)
+        record_llm_call(agent, "ok")
+
+    # ----- asyncio -----
+
+    async def _race(self, start: Callable[[float], Any], agent: str, key: str, deadline: float, discard: Callable = None):
+        """Une tentative: requête initiale, doublée si elle dépasse le seuil; la première réponse valide gagne"""
+        timeout = deadline - time.monotonic()
+        primary = asyncio.ensure_future(start(timeout))
+        tasks = {primary}
+        winner = None
+        try:
+            delay = self._hedge_delay(key, timeout)
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary.done() and self._take_hedge():
+                    record_llm_hedge(agent, "launched")
+                    tasks.add(asyncio.ensure_future(start(deadline - time.monotonic())))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError("Délai de l'appel LLM dépassé")
+                for task in done:
+                    if task.exception() is None and winner is None:
+                        winner = task
+                    elif task.exception() is not None:
+                        error = task.exception()
+                if winner is not None:
+                    if winner is not primary:
+                        record_llm_hedge(agent, "won")
+                    return winner.result()
+            raise error
+        finally:
+            for task in tasks - {winner}:
+                task.cancel()
+                task.add_done_callback(lambda done: _settle(done, discard))
+
+    async def _call_async(self, agent: str, key: str, start: Callable[[float], Any], discard: Callable = None):
+        deadline = self._deadline()
+        attempt = 0
+        while True:
+            self._admit(agent)
+            started = time.monotonic()
+            try:
+                result = await self._race(start, agent, key, deadline, discard)
+            except asyncio.CancelledError:
+                self._release()
+                raise
+            except Exception as error:
+                await asyncio.sleep(self._after_failure(agent, attempt, error, deadline))
+                attempt += 1
+                continue
+            self._succeeded(agent, key, started)
+            return result
+
+    async def achat(self, agent: str, **params):
+        """chat.completions.create (AsyncOpenAI) avec délai, doublement, reprises et disjoncteur"""
+        async def start(timeout: float):
+            client = async_openai_client().with_options(max_retries=0, timeout=timeout)
+            return await client.chat.completions.create(**params)
+
+        return await self._call_async(agent, agent, start)
+
+    async def astream(self, agent: str, **params) -> AsyncIterator[Any]:
+        """
+        chat.completions.create(stream=True): rend un itérateur de fragments une fois le premier reçu
+        (délai, doublement et reprises portent sur ce premier fragment)
+        """
+        async def start(timeout: float):
+            client = async_openai_client().with_options(max_retries=0, timeout=timeout)
+            stream = None
+            try:
+                stream = await client.chat.completions.create(stream=True, **params)
+                iterator = stream.__aiter__()
+                return stream, iterator, await iterator.__anext__()
+            except BaseException:
+                if stream is not None:
+                    await stream.close()
+                raise
+
+        async def discard(opened):
+            await opened[0].close()
+
+        stream, iterator, first = await self._call_async(agent, f"{agent}:first_chunk", start, discard)
+        return self._relay(agent, stream, iterator, first)
+
+    async def _relay(self, agent: str, stream, iterator, first) -> AsyncIterator[Any]:
+        try:
+            yield first
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), LLM_STREAM_IDLE_S)
+                except StopAsyncIteration:
+                    return
+                except Exception as error:
+                    # Flux coupé ou muet: même issue qu'un appel sans réponse
+                    reason = "deadline" if _is_timeout(error) else "error"
+                    self._record(False)
+                    record_llm_call(agent, f"stream_{reason}")
+                    logger.warning("Flux LLM interrompu", extra={"agent": agent, "reason": reason, "error": str(error)})
+                    raise LLMUnavailable(reason) from error
+                yield chunk
+        finally:
+            await stream.close()
+
+    # ----- synchrone -----
+
+    def _hedge_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+        return self._pool
+
+    def _race_sync(self, start: Callable[[float], Any], agent: str, key: str, deadline: float):
+        """
+        Équivalent de _race pour le client synchrone. La requête initiale tourne dans le thread appelant
+        (la capacité suit le threadpool de l'appelant), seule la requête doublée part dans le pool llm-hedge.
+        Une requête synchrone en cours ne peut pas être interrompue: le doublon prend le relais si la
+        requête initiale échoue; il est annulé (ou sa réponse ignorée) dès que la requête initiale aboutit.
+        """
+        timeout = deadline - time.monotonic()
+        delay = self._hedge_delay(key, timeout)
+        if delay is None:
+            return start(timeout)
+
+        lock = threading.Lock()
+        hedge: Dict[str, Any] = {"future": None, "closed": False}
+
+        def launch():
+            with lock:
+                if hedge["closed"] or not self._take_hedge():
+                    return
+                record_llm_hedge(agent, "launched")
+                hedge["future"] = self._hedge_pool().submit(start, deadline - time.monotonic())
+
+        timer = threading.Timer(delay, launch)
+        timer.daemon = True
+        timer.start()
+        try:
+            return start(timeout)
+        except Exception:
+            with lock:
+                hedge["closed"] = True
+                future = hedge["future"]
+            if future is None:
+                raise
+            try:
+                result = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception:
+                future.cancel()
+                raise
+            record_llm_hedge(agent, "won")
+            return result
+        finally:
+            timer.cancel()
+            with lock:
+                hedge["closed"] = True
+                future = hedge["future"]
+            if future is not None:
+                # Doublon pas encore démarré (pool saturé): annulé; déjà parti: sa réponse est ignorée
+                future.cancel()
+
+    def chat(self, agent: str, **params):
+        """chat.completions.create (client synchrone) avec délai, doublement, reprises et disjoncteur"""
+        def start(timeout: float):
+            client = openai_client().with_options(max_retries=0, timeout=timeout)
+            return client.chat.completions.create(**params)
+
+        deadline = self._deadline()
+        attempt = 0
+        while True:
+            self._admit(agent)
+            started = time.monotonic()
+            try:
+                result = self._race_sync(start, agent, agent, deadline)
+            except Exception as error:
+                time.sleep(self._after_failure(agent, attempt, error, deadline))
+                attempt += 1
+                continue
+            self._succeeded(agent, agent, started)
+            return result
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            hedge_thresholds = {
+                key: tracker.quantile(self.hedge_quantile, self.hedge_min_samples)
+                for key, tracker in self._latencies.items()
+            }
+        return {
+            "breaker": self.breaker.state if self.breaker else "disabled",
+            "breaker_opened": self.breaker.opened if self.breaker else 0,
+            "calls": self._calls,
+            "hedges": self._hedges,
+            "hedge_threshold_s": {key: round(value, 3) for key, value in hedge_thresholds.items() if value is not None},
+        }
+
+
+gateway = LLMGateway()
+
+
+def chat(agent: str, **params):
+    return gateway.chat(agent, **params)
+
+
+async def achat(agent: str, **params):
+    return await gateway.achat(agent, **params)
+
+
+async def astream(agent: str, **params) -> AsyncIterator[Any]:
+    return await gateway.astream(agent, **params)
+
+
+def gateway_status() -> Dict[str, Any]:
+    return gateway.status()
@@ -0,0 +1,285 @@
+"""
+Logs structurés (JSON, une ligne par événement) écrits par un thread dédié
+Les modules utilisent le logging standard: logger = logging.getLogger(__name__), puis
+logger.info("message", extra={"champ": valeur}). configure_logging() (create_app) branche le
+logger "app" sur une file:
+- thread de la requête: niveau vérifié par le logger (un debug désactivé ne coûte qu'un test),
+  ajout du contexte de la requête (request_id, tenant_id, channel, conversation_id),
+  échantillonnage, puis put_nowait dans une file bornée: jamais d'écriture ni d'attente sur stdout.
+  File pleine → l'événement est perdu et compté (ktios_log_records_total{outcome="dropped"} sur /metrics)
+- thread d'écriture: masquage des données personnelles, mise en forme JSON, stdout
+
+Événements DEBUG fréquents (ex. chaque recherche KB): sampled_debug(logger, "message", champ=valeur)
+tire l'échantillon avant de construire l'événement.
+
+Configuration:
+    LOG_LEVEL=INFO                          niveau par défaut des modules de l'app
+    LOG_LEVELS=app.rag=DEBUG,app.shared_cache=WARNING       niveau par module
+    LOG_TENANT_LEVELS=<tenant_id>=DEBUG     niveau par tenant (prioritaire, non échantillonné)
+    LOG_DEBUG_SAMPLE=0.1                    part des événements DEBUG gardés (champ "sample" du JSON)
+    LOG_FORMAT=json | text                  text: lisible en dev
+    LOG_QUEUE_SIZE=10000
+    LOG_PII=false                           true: pas de masquage (dev uniquement)
+
+Données personnelles: les champs extra listés dans PII_FIELDS (texte des messages, numéros) sont
+remplacés par leur longueur; les numéros de téléphone (E.164, whatsapp:+...) et les courriels
+présents dans le texte d'un log sont masqués.
+"""
+
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from .metrics import request_context
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "0.1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PII = os.getenv("LOG_PII", "false").lower() == "true"
+ROOT_LOGGER = "app"
+
+PII_FIELDS = {"body", "text", "query", "user_text", "reply", "content", "phone", "customer_phone", "from_number", "from_addr", "to_addr"}
+
+# Candidats larges (rapide), validés par _mask_phone: E.164 (+ et 8 chiffres ou plus) ou 10 chiffres collés
+_PHONE = re.compile(r"[+\d][\d .()-]{7,}\d")
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+# Attributs d'un LogRecord: tout le reste vient de extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+_CONTEXT_FIELDS = (("request_id", "request_id"), ("tenant", "tenant_id"), ("channel", "channel"), ("conversation_id", "conversation_id"))
+# Identifiants et champs techniques: pas de masquage
+_SAFE_FIELDS = {field for _, field in _CONTEXT_FIELDS} | {"sample", "document_id"}
+
+
+def _parse_levels(value: str) -> Dict[str, int]:
+    """"app.rag=DEBUG,x=INFO" → {"app.rag": 10, "x": 20}"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+_module_levels: Dict[str, int] = _parse_levels(os.getenv("LOG_LEVELS", ""))
+_tenant_levels: Dict[str, int] = _parse_levels(os.getenv("LOG_TENANT_LEVELS", ""))
+_stats = {"queued": 0, "dropped": 0, "sampled_out": 0, "written": 0}
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _configured_level(name: str) -> int:
+    """Niveau du module (ou de son paquet le plus proche), sinon LOG_LEVEL"""
+    while name:
+        if name in _module_levels:
+            return _module_levels[name]
+        name = name.rpartition(".")[0]
+    return logging.getLevelName(LOG_LEVEL)
+
+
+def mask_phone(value: str) -> str:
+    digits = re.sub(r"\D", "", value)
+    return f"+***{digits[-2:]}"
+
+
+def _mask_phone(match: re.Match) -> str:
+    text, start = match.group(0), match.start()
+    before = match.string[start - 1] if start else ""
+    # Fin d'un UUID, d'un identifiant, date "2026-10-18 19": pas un numéro
+    if before and (before.isalnum() or before in "-_"):
+        return text
+    if text[0] == "+":
+        is_phone = sum(c.isdigit() for c in text) >= 8
+    else:
+        is_phone = text.isdigit() and len(text) >= 10
+    return mask_phone(text) if is_phone else text
+
+
+def redact(value: Any) -> Any:
+    if LOG_PII or not isinstance(value, str):
+        return value
+    value = _PHONE.sub(_mask_phone, value)
+    return _EMAIL.sub("<courriel>", value) if "@" in value else value
+
+
+def _threshold(name: str, tenant_id) -> Tuple[int, bool]:
+    """(niveau minimal, DEBUG échantillonné?): le niveau du tenant prime et n'est pas échantillonné"""
+    tenant_level = _tenant_levels.get(str(tenant_id)) if _tenant_levels and tenant_id else None
+    if tenant_level is not None:
+        return tenant_level, False
+    # Logger abaissé pour un tenant: les autres tenants gardent le niveau du module
+    return _configured_level(name), True
+
+
+def _keep_sample() -> bool:
+    if LOG_DEBUG_SAMPLE >= 1.0 or random.random() < LOG_DEBUG_SAMPLE:
+        return True
+    _stats["sampled_out"] += 1
+    return False
+
+
+class RequestContextFilter(logging.Filter):
+    """Thread appelant: contexte de la requête, niveau par tenant, échantillonnage du DEBUG"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = request_context()
+        if context:
+            for key, field in _CONTEXT_FIELDS:
+                if context.get(key) and field not in record.__dict__:
+                    setattr(record, field, context[key])
+        level, sampled = _threshold(record.name, getattr(record, "tenant_id", None))
+        if record.levelno < level:
+            return False
+        if sampled and record.levelno <= logging.DEBUG and "sample" not in record.__dict__:
+            if not _keep_sample():
+                return False
+            record.sample = LOG_DEBUG_SAMPLE
+        return True
+
+
+def sampled_debug(logger: logging.Logger, msg: str, *args, **fields) -> None:
+    """
+    DEBUG fréquent (chemin chaud): niveau et échantillonnage décidés avant de construire l'événement,
+    un événement écarté ne coûte qu'un tirage
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    tenant_id = fields.get("tenant_id") or (request_context() or {}).get("tenant")
+    level, sampled = _threshold(logger.name, tenant_id)
+    if level > logging.DEBUG:
+        return
+    if sampled:
+        if not _keep_sample():
+            return
+        fields["sample"] = LOG_DEBUG_SAMPLE
+    logger.debug(msg, *args, extra=fields, stacklevel=2)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """File bornée: un événement qui ne rentre pas est perdu (compté), l'appelant n'attend jamais"""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            _stats["queued"] += 1
+        except queue.Full:
+            _stats["dropped"] += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Message et trace résolus ici (args potentiellement mutables); le JSON est fait par le thread d'écriture.
+        # Seul handler du logger "app" (propagate=False): l'événement est modifié sans copie
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(record.getMessage()),
+        }
+        for key, value in record.__dict__.items():
+            if key in _RECORD_ATTRS:
+                continue
+            if key in _SAFE_FIELDS:
+                entry[key] = value
+            elif key in PII_FIELDS and not LOG_PII and value is not None:
+                entry[key] = f"<{len(str(value))} car.>"
+            else:
+                entry[key] = redact(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(JsonFormatter):
+    """Format de dev: NIVEAU module: message clé=valeur"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = json.loads(super().format(record))
+        head = f"{entry.pop('level')} {entry.pop('logger')}: {entry.pop('msg')}"
+        entry.pop("ts")
+        exc = entry.pop("exc", None)
+        line = " ".join([head] + [f"{k}={v}" for k, v in entry.items()])
+        return f"{line}\n{exc}" if exc else line
+
+
+class _CountingStreamHandler(logging.StreamHandler):
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        _stats["written"] += 1
+
+
+def _apply_levels() -> None:
+    """Niveau effectif de chaque logger: le plus bas entre son niveau et les niveaux par tenant"""
+    floor = min(_tenant_levels.values(), default=logging.CRITICAL)
+    logging.getLogger(ROOT_LOGGER).setLevel(min(logging.getLevelName(LOG_LEVEL), floor))
+    for name, level in _module_levels.items():
+        logging.getLogger(name).setLevel(min(level, floor))
+
+
+def configure_logging() -> None:
+    """Branche le logger "app" sur la file + thread d'écriture (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+    output = _CountingStreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [handler]
+    # Pas de doublon via le logger racine (configuré par uvicorn)
+    root.propagate = False
+    _apply_levels()
+
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Écrit les événements encore en file (arrêt de l'app)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def set_log_level(level: str, module: str = None, tenant_id: str = None) -> None:
+    """Change un niveau à chaud: par module (app.rag), par tenant, ou LOG_LEVEL si aucun des deux"""
+    global LOG_LEVEL
+    value = logging.getLevelName(level.upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Niveau de log inconnu: {level}")
+    if tenant_id:
+        _tenant_levels[str(tenant_id)] = value
+    elif module:
+        _module_levels[module] = value
+    else:
+        LOG_LEVEL = level.upper()
+    _apply_levels()
+
+
+def log_stats() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "pending": _listener.queue.qsize() if _listener else 0,
+        "level": LOG_LEVEL,
+        "modules": {name: logging.getLevelName(level) for name, level in _module_levels.items()},
+        "tenants": {tenant: logging.getLevelName(level) for tenant, level in _tenant_levels.items()},
+    }
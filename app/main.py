@@ -1,16 +1,113 @@
-# ========================================
-# AJOUTE CES IMPORTS EN HAUT DE app/main.py
-# ========================================
+"""
+API complète: webhooks Twilio (SMS/WhatsApp + voix) avec agent à tools
+Chemin 100% asyncio: AsyncSession (asyncpg) + AsyncOpenAI, un worker uvicorn
+peut traiter de nombreuses conversations en parallèle.
+create_app(): l'import ne crée ni moteur ni client, le hook startup les préchauffe (warmup).
+"""
 
-from .agent_llm import agent_reply  # Remplace l'ancien import si présent
-import json
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, FastAPI, Request, Depends, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel
+from twilio.twiml.messaging_response import MessagingResponse
+from twilio.twiml.voice_response import VoiceResponse
+
+from .db import get_async_db, AsyncSessionLocal, pool_status
+from .models import Conversation, Message
+from .twilio_utils import twiml_say_and_gather
+from .agent_llm import agent_reply_async, agent_reply_stream_async
+from .resolution import resolve_channel, resolve_conversation, forget_conversation
+from .deferred import DEFERRED_REPLIES, deferred_replies, save_pending_message
+from .message_sink import MESSAGE_WRITE_BEHIND, message_sink
+from .warmup import prewarm
+from .metrics import MetricsMiddleware, CONTENT_TYPE, render_metrics, set_request_labels, timed
+from .log import configure_logging, stop_logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+async def startup():
+    configure_logging()
+    await prewarm()
+    if DEFERRED_REPLIES:
+        deferred_replies.start(_deferred_message_reply)
+    if MESSAGE_WRITE_BEHIND:
+        message_sink.start()
+
+
+async def shutdown():
+    await deferred_replies.stop()
+    # Après les réponses différées: leurs messages sont encore journalisés
+    await message_sink.stop()
+    stop_logging()
+
+
+@router.get("/health")
+async def health_check(db: AsyncSession = Depends(get_async_db)):
+    try:
+        await db.execute(select(1))
+        return {"status": "healthy", "database": "connected", "pool": pool_status()}
+    except Exception as e:
+        return {"status": "unhealthy", "error": repr(e), "pool": pool_status()}
 
-# ========================================
-# REMPLACE TES WEBHOOKS PAR CECI
-# ========================================
 
-@app.post("/webhooks/twilio/messages")
-async def twilio_messages(request: Request, db: Session = Depends(get_db)):
+VOICE_TURN_URL = "/webhooks/twilio/voice/turn"
+VOICE_CONTINUE_URL = "/webhooks/twilio/voice/continue"
+
+# Voix: réponse streamée, Twilio commence à parler dès la première phrase
+VOICE_STREAMING = os.getenv("VOICE_STREAMING", "false").lower() == "true"
+# Attente max de la première phrase; au-delà (ou si un tool est appelé) → message d'attente
+VOICE_FIRST_EVENT_TIMEOUT = float(os.getenv("VOICE_FIRST_EVENT_TIMEOUT", "4"))
+VOICE_HOLD_MESSAGE = "Un instant, je vérifie."
+VOICE_ERROR_MESSAGE = "Désolé, j'ai eu un problème technique. Pouvez-vous répéter?"
+
+def normalize_twilio_to(value: str) -> str:
+    return (value or "").strip()
+
+def normalize_twilio_from(value: str) -> str:
+    return (value or "").strip()
+
+def message_channel_name(from_addr: str) -> str:
+    """Canal des métriques: whatsapp ou sms (même webhook Twilio Messages)"""
+    return "whatsapp" if from_addr.startswith("whatsapp:") else "sms"
+
+async def add_message(db: AsyncSession, tenant_id, conversation_id, direction, role, content, provider_message_id=None, meta=None, commit: bool = True):
+    """
+    Journalise un message: écriture différée par lots si le sink tourne, sinon ajout à la session
+    (commit immédiat, ou commit=False pour l'inclure dans la transaction de l'appelant)
+    """
+    row = {
+        "id": uuid.uuid4(),
+        "tenant_id": tenant_id,
+        "conversation_id": conversation_id,
+        "direction": direction,
+        "role": role,
+        "content": content,
+        "content_type": "text",
+        "provider_message_id": provider_message_id,
+        "meta": meta,
+        "created_at": datetime.now(timezone.utc),
+    }
+    if not (MESSAGE_WRITE_BEHIND and message_sink.submit(row)):
+        db.add(Message(**row))
+        if commit:
+            with timed("message_commit"):
+                await db.commit()
+    return row["id"]
+
+
+@router.post("/webhooks/twilio/messages")
+async def twilio_messages(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Webhook Twilio Messages (SMS/WhatsApp) - VERSION AVEC TOOLS
     """
@@ -20,64 +117,114 @@ async def twilio_messages(request: Request, db: Session = Depends(get_db)):
     body      = (form.get("Body") or "").strip()
     msg_sid   = form.get("MessageSid")
 
-    # 1) Résoudre tenant via channel
-    channel = find_tenant_channel(db, to_addr)
-    tenant_id = channel.tenant_id
+    # 1) Résoudre tenant via channel (cache)
+    channel = await resolve_channel(db, to_addr)
+    tenant_id = channel["tenant_id"]
+    set_request_labels(tenant_id, message_channel_name(from_addr))
 
-    # 2) Upsert customer
-    customer = upsert_customer(db, tenant_id, from_addr)
-    
-    # 3) Get/create conversation
-    convo = get_or_create_conversation(db, tenant_id, channel.id, customer.id)
+    # 2-3) Customer + conversation ouverte (cache, sinon une seule requête)
+    customer_id, conversation_id = await resolve_conversation(db, tenant_id, channel["channel_id"], from_addr)
+    set_request_labels(conversation_id=conversation_id)
 
-    # 4) Sauvegarder message inbound
-    add_message(
-        db, tenant_id, convo.id,
-        direction="in",
-        role="user",
-        content=body,
-        provider_message_id=msg_sid
-    )
+    # 4-5) Mode différé: message inbound committé ('pending'), accusé de réception immédiat,
+    #      réponse générée par le pool et envoyée par l'API REST
+    pending_id = None
+    if DEFERRED_REPLIES and deferred_replies.running:
+        pending_id = await save_pending_message(db, tenant_id, conversation_id, body, msg_sid)
+        try:
+            deferred_replies.enqueue(pending_id)
+            return Response(content=str(MessagingResponse()), media_type="application/xml")
+        except asyncio.QueueFull:
+            logger.warning("File des réponses différées pleine, réponse synchrone")
+    else:
+        await add_message(
+            db, tenant_id, conversation_id,
+            direction="in",
+            role="user",
+            content=body,
+            provider_message_id=msg_sid
+        )
 
-    # 5) ✅ AGENT AVEC TOOLS
-    agent_result = agent_reply(
-        db=db,
-        tenant_id=str(tenant_id),
-        conversation_id=str(convo.id),
-        user_text=body,
-        customer_phone=from_addr
-    )
-    
-    reply_text = agent_result["reply_text"]
+    # 6) ✅ AGENT AVEC TOOLS + sauvegarde de la réponse
+    reply_text = await generate_message_reply(db, tenant_id, conversation_id, body, from_addr)
+    if pending_id:
+        await deferred_replies.finish(pending_id, "sent")
+
+    # 7) Répondre via TwiML
+    resp = MessagingResponse()
+    resp.message(reply_text)
+    return Response(content=str(resp), media_type="application/xml")
+
+
+async def save_agent_reply(db: AsyncSession, tenant_id, conversation_id, agent_result: Dict[str, Any]) -> bool:
+    """Sauvegarde la réponse outbound, passe la conversation en handoff si demandé. Retourne handoff"""
     tool_calls = agent_result.get("tool_calls_made", [])
 
-    # 6) Sauvegarder réponse outbound
-    add_message(
-        db, tenant_id, convo.id,
+    await add_message(
+        db, tenant_id, conversation_id,
         direction="out",
         role="assistant",
-        content=reply_text,
+        content=agent_result["reply_text"],
         meta={
             "tool_calls": tool_calls,
             "finish_reason": agent_result.get("finish_reason")
-        }
+        },
+        commit=False
     )
 
-    # 7) Si handoff → mettre conversation en handoff
-    if any(t["name"] == "handoff_to_human" for t in tool_calls):
-        convo.status = "handoff"
-        db.add(convo)
-        db.commit()
+    # Message outbound + passage en handoff: une seule transaction
+    handoff = any(t["name"] == "handoff_to_human" for t in tool_calls)
+    conversation = None
+    if handoff:
+        conversation = (await db.execute(
+            update(Conversation).where(Conversation.id == conversation_id).values(status="handoff")
+            .returning(Conversation.channel_id, Conversation.customer_id)
+        )).first()
+    await db.commit()
+    if conversation:
+        await forget_conversation(tenant_id, conversation.channel_id, conversation.customer_id)
+    return handoff
 
-    # 8) Répondre via TwiML
-    from twilio.twiml.messaging_response import MessagingResponse
-    resp = MessagingResponse()
-    resp.message(reply_text)
-    return Response(content=str(resp), media_type="application/xml")
+
+async def generate_message_reply(db: AsyncSession, tenant_id, conversation_id, body: str, from_addr: str) -> str:
+    """Agent + sauvegarde de la réponse outbound (+ handoff éventuel), retourne le texte"""
+    agent_result = await agent_reply_async(
+        db=db,
+        tenant_id=str(tenant_id),
+        conversation_id=str(conversation_id),
+        user_text=body,
+        customer_phone=from_addr
+    )
+    await save_agent_reply(db, tenant_id, conversation_id, agent_result)
+    return agent_result["reply_text"]
+
+
+async def _deferred_message_reply(inbound: Dict[str, Any]) -> str:
+    """Réponse d'un message du pool différé: session dédiée (celle de la requête est fermée)"""
+    customer_addr = inbound["to_address"]
+    set_request_labels(inbound["tenant_id"], message_channel_name(customer_addr), conversation_id=inbound["conversation_id"])
+    async with AsyncSessionLocal() as db:
+        return await generate_message_reply(db, inbound["tenant_id"], inbound["conversation_id"], inbound["content"], customer_addr)
+
+
+def voice_reply_twiml(reply_text: str, handoff: bool) -> str:
+    if handoff:
+        # TODO: Récupérer numéro de handoff depuis tenant_settings
+        handoff_number = "+14185551234"  # Remplacer par vraie config
+        say = f'\n  <Say language="fr-CA" voice="Polly.Celine">{reply_text}</Say>' if reply_text else ""
+
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<Response>{say}
+  <Dial timeout="20" answerOnBridge="true">{handoff_number}</Dial>
+  <Say language="fr-CA" voice="Polly.Celine">Personne n'est disponible. Laissez un message, on vous rappelle.</Say>
+  <Record maxLength="60" playBeep="true" />
+</Response>"""
+
+    return twiml_say_and_gather(reply=reply_text, action_url=VOICE_TURN_URL)
 
 
-@app.post("/webhooks/twilio/voice/turn")
-async def twilio_voice_turn(request: Request, db: Session = Depends(get_db)):
+@router.post(VOICE_TURN_URL)
+async def twilio_voice_turn(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     Webhook Twilio Voice Turn (speech) - VERSION AVEC TOOLS
     """
@@ -88,17 +235,18 @@ async def twilio_voice_turn(request: Request, db: Session = Depends(get_db)):
     speech = (form.get("SpeechResult") or "").strip()
     confidence = form.get("Confidence")
 
-    # 1) Résoudre tenant
-    channel = find_tenant_channel(db, to_addr)
-    tenant_id = channel.tenant_id
-    
-    # 2) Customer + conversation
-    customer = upsert_customer(db, tenant_id, from_addr)
-    convo = get_or_create_conversation(db, tenant_id, channel.id, customer.id)
+    # 1) Résoudre tenant (cache)
+    channel = await resolve_channel(db, to_addr)
+    tenant_id = channel["tenant_id"]
+    set_request_labels(tenant_id, "voice")
+
+    # 2) Customer + conversation (cache, sinon une seule requête)
+    customer_id, conversation_id = await resolve_conversation(db, tenant_id, channel["channel_id"], from_addr)
+    set_request_labels(conversation_id=conversation_id)
 
     # 3) Message inbound
-    add_message(
-        db, tenant_id, convo.id,
+    await add_message(
+        db, tenant_id, conversation_id,
         direction="in",
         role="user",
         content=speech,
@@ -106,71 +254,147 @@ async def twilio_voice_turn(request: Request, db: Session = Depends(get_db)):
         meta={"confidence": confidence}
     )
 
-    # 4) ✅ AGENT AVEC TOOLS
-    agent_result = agent_reply(
+    # 4) Streaming: on répond à Twilio dès la première phrase, la suite via /voice/continue
+    if VOICE_STREAMING and call_sid:
+        return await start_streaming_voice_turn(call_sid, tenant_id, conversation_id, speech, from_addr)
+
+    # 5) ✅ AGENT AVEC TOOLS
+    agent_result = await agent_reply_async(
         db=db,
         tenant_id=str(tenant_id),
-        conversation_id=str(convo.id),
+        conversation_id=str(conversation_id),
         user_text=speech,
         customer_phone=from_addr
     )
-    
-    reply_text = agent_result["reply_text"]
-    tool_calls = agent_result.get("tool_calls_made", [])
 
-    # 5) Sauvegarder réponse
-    add_message(
-        db, tenant_id, convo.id,
-        direction="out",
-        role="assistant",
-        content=reply_text,
-        meta={
-            "tool_calls": tool_calls,
-            "finish_reason": agent_result.get("finish_reason")
-        }
-    )
+    # 6) Sauvegarder réponse (+ handoff)
+    handoff = await save_agent_reply(db, tenant_id, conversation_id, agent_result)
 
-    # 6) Si handoff → Dial vers humain
-    if any(t["name"] == "handoff_to_human" for t in tool_calls):
-        convo.status = "handoff"
-        db.add(convo)
-        db.commit()
-        
-        # TODO: Récupérer numéro de handoff depuis tenant_settings
-        handoff_number = "+14185551234"  # Remplacer par vraie config
-        
-        twiml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-  <Say language="fr-CA" voice="Polly.Celine">{reply_text}</Say>
-  <Dial timeout="20" answerOnBridge="true">{handoff_number}</Dial>
-  <Say language="fr-CA" voice="Polly.Celine">Personne n'est disponible. Laissez un message, on vous rappelle.</Say>
-  <Record maxLength="60" playBeep="true" />
-</Response>"""
+    # 7) Handoff → Dial vers humain, sinon → continue conversation
+    twiml = voice_reply_twiml(agent_result["reply_text"], handoff)
+    return Response(content=twiml, media_type="application/xml")
+
+
+# ========================================
+# VOIX EN STREAMING
+# ========================================
+
+class StreamingVoiceTurn:
+    """
+    Tour de parole généré en tâche de fond: les phrases (ou la détection d'un tool)
+    arrivent dans une file au fil du flux LLM.
+    Registre en mémoire du process: suppose un seul worker uvicorn (ou sticky sessions par CallSid).
+    """
+
+    def __init__(self):
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.created_at = time.monotonic()
+
+    async def run(self, tenant_id, conversation_id, speech: str, from_addr: str) -> Dict[str, Any]:
+        result = None
+        try:
+            async with AsyncSessionLocal() as db:
+                async for event in agent_reply_stream_async(
+                    db=db,
+                    tenant_id=str(tenant_id),
+                    conversation_id=str(conversation_id),
+                    user_text=speech,
+                    customer_phone=from_addr
+                ):
+                    if event["type"] == "done":
+                        result = event["result"]
+                    else:
+                        await self.events.put(event)
+                result["handoff"] = await save_agent_reply(db, tenant_id, conversation_id, result)
+            return result
+        finally:
+            await self.events.put(None)
+
+
+_voice_turns: Dict[str, StreamingVoiceTurn] = {}
+# Tours jamais repris (appel raccroché avant la redirection) gardés au plus ce délai (secondes)
+VOICE_TURN_TTL = 120
+
+
+def _purge_voice_turns() -> None:
+    now = time.monotonic()
+    for call_sid, turn in list(_voice_turns.items()):
+        if turn.task.done() and now - turn.created_at > VOICE_TURN_TTL:
+            _voice_turns.pop(call_sid, None)
+
+
+async def start_streaming_voice_turn(call_sid: str, tenant_id, conversation_id, speech: str, from_addr: str) -> Response:
+    _purge_voice_turns()
+    turn = StreamingVoiceTurn()
+    turn.task = asyncio.create_task(turn.run(tenant_id, conversation_id, speech, from_addr))
+    _voice_turns[call_sid] = turn
+
+    try:
+        event = await asyncio.wait_for(turn.events.get(), timeout=VOICE_FIRST_EVENT_TIMEOUT)
+    except asyncio.TimeoutError:
+        event = {"type": "tool_call"}
+
+    if event is None:
+        # Flux terminé sans phrase (réponse vide ou erreur): réponse complète directement
+        return await twilio_voice_continue_response(call_sid)
+
+    vr = VoiceResponse()
+    first = event["text"] if event["type"] == "sentence" else VOICE_HOLD_MESSAGE
+    vr.say(first, language="fr-CA", voice="Polly.Celine")
+    vr.redirect(VOICE_CONTINUE_URL, method="POST")
+    return Response(content=str(vr), media_type="application/xml")
+
+
+async def twilio_voice_continue_response(call_sid: str) -> Response:
+    turn = _voice_turns.pop(call_sid, None)
+    if turn is None:
+        # Tour inconnu (redémarrage, autre worker): on relance l'écoute
+        twiml = twiml_say_and_gather(reply="Pardon, pouvez-vous répéter?", action_url=VOICE_TURN_URL)
+        return Response(content=twiml, media_type="application/xml")
+
+    try:
+        result = await turn.task
+    except Exception as e:
+        logger.error("Tour de parole streamé en échec: %s", e)
+        twiml = twiml_say_and_gather(reply=VOICE_ERROR_MESSAGE, action_url=VOICE_TURN_URL)
         return Response(content=twiml, media_type="application/xml")
 
-    # 7) Sinon → continue conversation
-    twiml = twiml_say_and_gather(reply=reply_text, action_url="/webhooks/twilio/voice/turn")
+    # Phrases pas encore dites (la première l'a été par /voice/turn)
+    remaining = []
+    while not turn.events.empty():
+        event = turn.events.get_nowait()
+        if event and event["type"] == "sentence":
+            remaining.append(event["text"])
+
+    twiml = voice_reply_twiml(" ".join(remaining), result.get("handoff", False))
     return Response(content=twiml, media_type="application/xml")
 
 
+@router.post(VOICE_CONTINUE_URL)
+async def twilio_voice_continue(request: Request):
+    """Suite d'un tour streamé: le reste de la réponse, puis écoute (ou Dial si handoff)"""
+    form = await request.form()
+    set_request_labels(channel="voice")
+    return await twilio_voice_continue_response(form.get("CallSid"))
+
+
 # ========================================
 # ENDPOINT DE TEST (très utile en dev)
 # ========================================
 
-from pydantic import BaseModel
-
 class TestAgentPayload(BaseModel):
     tenant_id: str
     conversation_id: str
     customer_phone: str
     user_text: str
 
-@app.post("/api/test/agent")
-def test_agent(payload: TestAgentPayload, db: Session = Depends(get_db)):
+@router.post("/api/test/agent")
+async def test_agent(payload: TestAgentPayload, db: AsyncSession = Depends(get_async_db)):
     """
     Endpoint de test pour tester l'agent sans Twilio.
     Pratique pour dev et debug.
-    
+
     Exemple:
     {
       "tenant_id": "xxx",
@@ -179,17 +403,37 @@ def test_agent(payload: TestAgentPayload, db: Session = Depends(get_db)):
       "user_text": "Je veux réserver pour 4 personnes ce soir à 19h"
     }
     """
-    result = agent_reply(
+    set_request_labels(payload.tenant_id, "api", payload.conversation_id)
+    result = await agent_reply_async(
         db=db,
         tenant_id=payload.tenant_id,
         conversation_id=payload.conversation_id,
         user_text=payload.user_text,
         customer_phone=payload.customer_phone
     )
-    
+
     return {
         "ok": True,
         "reply": result["reply_text"],
         "tools_executed": result.get("tool_calls_made", []),
         "debug": result.get("debug", {})
     }
+
+
+@router.get("/metrics")
+def metrics():
+    """Métriques du process au format Prometheus (latences par étape, tokens, caches, pools)"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+
+def create_app() -> FastAPI:
+    """Application: routes + métriques + préchauffage au démarrage + arrêt propre des tâches de fond"""
+    app = FastAPI(title="AI Front Desk MVP")
+    app.include_router(router)
+    app.add_middleware(MetricsMiddleware)
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+    return app
+
+
+app = create_app()
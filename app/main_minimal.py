@@ -1,30 +1,58 @@
 import os
+import asyncio
+import logging
+import time
 # WhatsApp integration - force redeploy
 import uuid as uuid_lib
-from fastapi import FastAPI, Request, Depends, Response, HTTPException
-from fastapi.responses import FileResponse
+from typing import Optional
+from fastapi import APIRouter, FastAPI, Request, Depends, Response, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, desc, text
 from pydantic import BaseModel
 from twilio.twiml.messaging_response import MessagingResponse
 
-from .db import get_db
+from .db import get_db, get_async_db, AsyncSessionLocal, pool_status
 from .models import Channel, Customer, Conversation, Message
-from .whatsapp import process_whatsapp_message
+from .whatsapp import process_whatsapp_message_async
+from .deferred import DEFERRED_REPLIES, deferred_replies, save_pending_message
+from .resolution import resolve_channel, resolve_conversation
+from .streaming import sse_event
+from .availability import aware_time, record_reservation_change
+from .tenant_settings import get_tenant_settings
+from .warmup import prewarm
+from .metrics import MetricsMiddleware, CONTENT_TYPE, metrics_summary, render_metrics, set_request_labels
+from .log import configure_logging, stop_logging
 
-app = FastAPI(title="AI Front Desk MVP")
+logger = logging.getLogger(__name__)
 
-@app.get("/")
+router = APIRouter()
+
+WHATSAPP_ERROR_REPLY = "Désolé, une erreur s'est produite. Contactez-nous au 367-382-0451."
+
+async def startup():
+    configure_logging()
+    # Routes sync (Session, client OpenAI sync) et async: les deux pools et clients
+    await prewarm(sync_db=True, sync_openai=True)
+    if DEFERRED_REPLIES:
+        deferred_replies.start(_deferred_whatsapp_reply)
+
+async def shutdown():
+    await deferred_replies.stop()
+    stop_logging()
+
+@router.get("/")
 def root():
     return {"message": "AI Front Desk API - Fonctionne!", "status": "ok"}
 
-@app.get("/health")
+@router.get("/health")
 def health_check(db: Session = Depends(get_db)):
     try:
         db.execute(select(1))
-        return {"status": "healthy", "database": "connected"}
+        return {"status": "healthy", "database": "connected", "pool": pool_status()}
     except Exception as e:
-        return {"status": "unhealthy", "error": repr(e)}
+        return {"status": "unhealthy", "error": repr(e), "pool": pool_status()}
 
 class KBIngestRequest(BaseModel):
     tenant_id: str
@@ -32,7 +60,7 @@ class KBIngestRequest(BaseModel):
     raw_text: str
     source: str = "manual"
 
-@app.post("/api/kb/quick_ingest")
+@router.post("/api/kb/quick_ingest")
 def kb_quick_ingest(request: KBIngestRequest, db: Session = Depends(get_db)):
     from .rag import ingest_kb_document
     try:
@@ -41,35 +69,83 @@ def kb_quick_ingest(request: KBIngestRequest, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class KBDocument(BaseModel):
+    title: str
+    raw_text: str
+    source: str = "manual"
+
+class KBBulkIngestRequest(BaseModel):
+    tenant_id: str
+    documents: list[KBDocument]
+    batch_size: Optional[int] = None
+    prune: bool = False
+
+@router.post("/api/kb/bulk_ingest")
+def kb_bulk_ingest(request: KBBulkIngestRequest, db: Session = Depends(get_db)):
+    from .rag import ingest_kb_documents
+    try:
+        documents = [d.model_dump() for d in request.documents]
+        result = ingest_kb_documents(db, request.tenant_id, documents, request.batch_size, request.prune)
+        return {"ok": True, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/kb/cache")
+def kb_cache_stats():
+    from .rag import retrieval_cache_stats
+    from .answer_cache import answer_cache_stats
+    return {"ok": True, **retrieval_cache_stats(), "answers": answer_cache_stats()}
+
+@router.get("/api/llm/usage")
+def llm_usage():
+    """Tokens consommés depuis le démarrage, par agent (dont tokens servis par le cache de prompt)"""
+    from .prompt_cache import llm_usage_stats
+    return {"ok": True, "usage": llm_usage_stats()}
+
+@router.get("/metrics")
+def metrics():
+    """Métriques du process au format Prometheus (latences par étape, tokens, caches, pools)"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+@router.get("/api/metrics")
+def metrics_json():
+    """Latences par étape / tenant / canal: p50, p95, p99 (ms) depuis le démarrage"""
+    return {"ok": True, **metrics_summary()}
+
 class KBSearchRequest(BaseModel):
     tenant_id: str
     query: str
     top_k: int = 3
+    mode: Optional[str] = None
 
-@app.post("/api/kb/search")
+@router.post("/api/kb/search")
 def kb_search(request: KBSearchRequest, db: Session = Depends(get_db)):
     from .rag import rag_search
     try:
-        results = rag_search(db, request.tenant_id, request.query, request.top_k)
+        results = rag_search(db, request.tenant_id, request.query, request.top_k, request.mode)
         return {"ok": True, "results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/test/reservation")
+@router.post("/api/test/reservation")
 def test_create_reservation(tenant_id: str, customer_name: str, party_size: int, start_time: str, db: Session = Depends(get_db)):
     try:
+        # Heure sans décalage: heure murale du tenant
+        start = aware_time(start_time, get_tenant_settings(db, tenant_id)["timezone"])
         customer = Customer(tenant_id=tenant_id, full_name=customer_name, phone_e164="+15555551234")
         db.add(customer)
         db.flush()
         new_reservation_id = uuid_lib.uuid4()
-        db.execute(text("""INSERT INTO reservations (id, tenant_id, customer_id, party_size, start_time, status, created_at, updated_at) VALUES (:res_id, :tenant_id, :customer_id, :party_size, :start_time, 'confirmed', now(), now())"""), {"res_id": new_reservation_id, "tenant_id": uuid_lib.UUID(tenant_id), "customer_id": customer.id, "party_size": party_size, "start_time": start_time})
+        db.execute(text("""INSERT INTO reservations (id, tenant_id, customer_id, party_size, start_time, status, created_at, updated_at) VALUES (:res_id, :tenant_id, :customer_id, :party_size, :start_time, 'confirmed', now(), now())"""), {"res_id": new_reservation_id, "tenant_id": uuid_lib.UUID(tenant_id), "customer_id": customer.id, "party_size": party_size, "start_time": start})
+        written_at = time.monotonic()
         db.commit()
+        record_reservation_change(tenant_id, new=(start, party_size), written_at=written_at)
         return {"ok": True, "reservation_id": str(new_reservation_id), "customer_name": customer_name, "party_size": party_size, "start_time": start_time}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/reservations")
+@router.get("/api/reservations")
 def list_reservations(tenant_id: str, db: Session = Depends(get_db)):
     try:
         rows = db.execute(text("""SELECT r.id, r.party_size, r.start_time, r.status, r.notes, c.full_name FROM reservations r LEFT JOIN customers c ON r.customer_id = c.id WHERE r.tenant_id = :tenant_id ORDER BY r.start_time DESC LIMIT 20"""), {"tenant_id": uuid_lib.UUID(tenant_id)}).mappings().all()
@@ -86,9 +162,10 @@ class ChatRequest(BaseModel):
     message: str
     history: list[ChatMessage] = []
 
-@app.post("/api/chat")
+@router.post("/api/chat")
 def chat(request: ChatRequest, db: Session = Depends(get_db)):
     from .agent_simple import agent_reply
+    set_request_labels(request.tenant_id, "web")
     try:
         history = [{"role": m.role, "content": m.content} for m in request.history]
         response = agent_reply(db, request.tenant_id, request.message, history)
@@ -96,8 +173,27 @@ def chat(request: ChatRequest, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/whatsapp")
-async def whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
+@router.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Variante SSE de /api/chat: événements delta/sentence au fil des tokens, puis done"""
+    from .agent_simple import agent_reply_stream_async
+    set_request_labels(request.tenant_id, "web")
+    history = [{"role": m.role, "content": m.content} for m in request.history]
+
+    async def events():
+        # Session ouverte dans le générateur: elle doit vivre pendant tout le flux
+        async with AsyncSessionLocal() as db:
+            try:
+                async for event in agent_reply_stream_async(db, request.tenant_id, request.message, history):
+                    yield sse_event(event, event=event["type"])
+            except Exception as e:
+                logger.error("Chat streamé en échec: %s", e)
+                yield sse_event({"type": "error", "detail": str(e)}, event="error")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.post("/api/whatsapp")
+async def whatsapp_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Webhook pour messages WhatsApp de Twilio"""
     
     # Parse le formulaire Twilio
@@ -106,11 +202,27 @@ async def whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
     from_number = form_data.get("From", "").replace("whatsapp:", "")
     message_body = form_data.get("Body", "")
     
-    print(f"📱 WhatsApp from {from_number}: {message_body}")
+    logger.info("Message WhatsApp entrant", extra={"from_number": from_number, "body": message_body})
+    
+    # Mode différé: message entrant committé ('pending') puis TwiML vide tout de suite,
+    # la réponse part par l'API REST Twilio
+    pending_id = None
+    if DEFERRED_REPLIES and deferred_replies.running:
+        channel = await resolve_channel(db, form_data.get("To", ""))
+        set_request_labels(channel["tenant_id"], "whatsapp")
+        _, conversation_id = await resolve_conversation(db, channel["tenant_id"], channel["channel_id"], form_data.get("From", ""))
+        pending_id = await save_pending_message(db, channel["tenant_id"], conversation_id, message_body, form_data.get("MessageSid"))
+        try:
+            deferred_replies.enqueue(pending_id)
+            return Response(content=str(MessagingResponse()), media_type="application/xml")
+        except asyncio.QueueFull:
+            logger.warning("File des réponses différées pleine, réponse synchrone")
     
     # Traite le message avec l'agent IA
     try:
-        response_text = process_whatsapp_message(from_number, message_body, db)
+        response_text = await process_whatsapp_message_async(from_number, message_body, db)
+        if pending_id:
+            await deferred_replies.finish(pending_id, "sent")
         
         # Crée réponse TwiML
         resp = MessagingResponse()
@@ -119,9 +231,30 @@ async def whatsapp_webhook(request: Request, db: Session = Depends(get_db)):
         return Response(content=str(resp), media_type="application/xml")
         
     except Exception as e:
-        print(f"ERROR in whatsapp webhook: {e}")
+        logger.error("Webhook WhatsApp en échec: %s", e)
         
         resp = MessagingResponse()
-        resp.message("Désolé, une erreur s'est produite. Contactez-nous au 367-382-0451.")
+        resp.message(WHATSAPP_ERROR_REPLY)
         
-        return Response(content=str(resp), media_type="application/xml")
\ No newline at end of file
+        return Response(content=str(resp), media_type="application/xml")
+
+async def _deferred_whatsapp_reply(inbound: dict) -> str:
+    """Réponse d'un message du pool différé, générée dans sa propre session"""
+    from_number = inbound["to_address"].replace("whatsapp:", "")
+    try:
+        async with AsyncSessionLocal() as db:
+            return await process_whatsapp_message_async(from_number, inbound["content"], db)
+    except Exception as e:
+        logger.error("Réponse WhatsApp différée en échec: %s", e)
+        return WHATSAPP_ERROR_REPLY
+
+def create_app() -> FastAPI:
+    """Application (Procfile: app.main_minimal:app); clients et moteurs créés au préchauffage"""
+    app = FastAPI(title="AI Front Desk MVP")
+    app.include_router(router)
+    app.add_middleware(MetricsMiddleware)
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+    return app
+
+app = create_app()
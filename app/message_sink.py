@@ -0,0 +1,212 @@
+"""
+Journal des messages en écriture différée (write-behind)
+add_message met la ligne en mémoire; une tâche de fond l'insère par lots multi-lignes
+(dès MESSAGE_BATCH_SIZE lignes ou toutes les MESSAGE_FLUSH_INTERVAL_MS millisecondes).
+La latence des webhooks n'inclut plus les commits du journal.
+
+- id et created_at sont fixés à la mise en file: l'ordre des messages ne dépend pas du lot
+- INSERT ... ON CONFLICT (id) DO NOTHING: un lot rejoué n'est jamais inséré deux fois
+- lot en échec: nouvel essai au tick suivant; après MESSAGE_FLUSH_RETRIES échecs, insertion ligne par
+  ligne (une ligne rejetée par la base ne bloque pas les autres)
+- arrêt: vidage complet (au plus MESSAGE_SHUTDOWN_TIMEOUT secondes); ce qui n'a pas pu être écrit est
+  copié dans MESSAGE_SPILL_PATH (JSONL) et réinséré au démarrage suivant
+- file pleine ou sink arrêté: submit() retourne False, l'appelant écrit de façon synchrone
+
+Activation: MESSAGE_WRITE_BEHIND=true
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from .db import AsyncSessionLocal
+from .models import Message
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "100"))
+MESSAGE_FLUSH_INTERVAL_MS = int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "200"))
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "10000"))
+MESSAGE_FLUSH_RETRIES = int(os.getenv("MESSAGE_FLUSH_RETRIES", "3"))
+MESSAGE_SHUTDOWN_TIMEOUT = float(os.getenv("MESSAGE_SHUTDOWN_TIMEOUT", "10"))
+MESSAGE_SPILL_PATH = os.getenv("MESSAGE_SPILL_PATH", "message_spill.jsonl")
+
+_UUID_FIELDS = ("id", "tenant_id", "conversation_id")
+
+# Base injoignable: les lignes ne sont pas en cause, elles restent en file
+CONNECTION_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+
+def _error_line(error: Exception) -> str:
+    """Première ligne de l'erreur (SQLAlchemy y ajoute la requête et ses paramètres)"""
+    return str(error).splitlines()[0] if str(error) else error.__class__.__name__
+
+
+def _to_json(row: Dict[str, Any]) -> str:
+    return json.dumps(row, default=str, ensure_ascii=False)
+
+
+def _from_json(line: str) -> Dict[str, Any]:
+    row = json.loads(line)
+    for field in _UUID_FIELDS:
+        row[field] = uuid.UUID(row[field])
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return row
+
+
+class MessageSink:
+    """Tampon en mémoire + tâche asyncio de vidage (démarrée au startup de l'app)"""
+
+    def __init__(
+        self,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        flush_interval_ms: int = MESSAGE_FLUSH_INTERVAL_MS,
+        max_pending: int = MESSAGE_QUEUE_SIZE,
+        spill_path: Optional[str] = MESSAGE_SPILL_PATH,
+        session_factory=None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.pending: List[Dict[str, Any]] = []
+        self.inflight: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._failures = 0
+        self.stats = {"submitted": 0, "flushed": 0, "batches": 0, "failed_batches": 0, "dropped": 0, "spilled": 0}
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self._stopping
+
+    def start(self) -> None:
+        if self.task is not None:
+            return
+        self._replay_spill()
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    def submit(self, row: Dict[str, Any]) -> bool:
+        """Met une ligne messages en file; False si le sink est arrêté ou plein (écrire en synchrone)"""
+        if not self.running or len(self.pending) >= self.max_pending:
+            return False
+        self.pending.append(row)
+        self.stats["submitted"] += 1
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def pending_for(self, conversation_id) -> List[Dict[str, Any]]:
+        """Messages d'une conversation pas encore (ou en cours d'être) écrits"""
+        conversation_id = str(conversation_id)
+        return [row for row in self.inflight + self.pending if str(row["conversation_id"]) == conversation_id]
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+        await self.flush()
+
+    async def _insert(self, rows: List[Dict[str, Any]]) -> None:
+        with timed("message_flush"):
+            async with self.session_factory() as db:
+                await db.execute(insert(Message.__table__).values(rows).on_conflict_do_nothing(index_elements=["id"]))
+                await db.commit()
+
+    async def flush(self) -> None:
+        """Écrit tout le tampon par lots; s'arrête au premier lot en échec (repris au tick suivant)"""
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            del self.pending[:len(batch)]
+            self.inflight = batch
+            try:
+                await self._insert(batch)
+                self.stats["flushed"] += len(batch)
+                self.stats["batches"] += 1
+                self._failures = 0
+            except Exception as e:
+                self.stats["failed_batches"] += 1
+                self._failures += 1
+                logger.error("Lot de %s messages non écrit (%s)", len(batch), _error_line(e))
+                if self._failures < MESSAGE_FLUSH_RETRIES:
+                    self.pending[:0] = batch
+                    return
+                await self._insert_one_by_one(batch)
+                self._failures = 0
+            finally:
+                self.inflight = []
+
+    async def _insert_one_by_one(self, rows: List[Dict[str, Any]]) -> None:
+        """Seules les lignes rejetées (contrainte, donnée invalide) sont abandonnées"""
+        for i, row in enumerate(rows):
+            try:
+                await self._insert([row])
+                self.stats["flushed"] += 1
+            except CONNECTION_ERRORS as e:
+                # Base indisponible: tout le reste repart en file
+                logger.error("Écriture des messages en échec: %s", _error_line(e))
+                self.pending[:0] = rows[i:]
+                return
+            except Exception as e:
+                self.stats["dropped"] += 1
+                logger.error("Message %s abandonné (%s)", row["id"], _error_line(e), extra={"conversation_id": str(row["conversation_id"]), "content": row["content"]})
+
+    async def stop(self, timeout: float = MESSAGE_SHUTDOWN_TIMEOUT) -> None:
+        """Vide le tampon (au plus timeout secondes); le reste est copié dans le fichier de secours"""
+        if self.task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self.task, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error("Vidage du tampon de messages incomplet à l'arrêt")
+        except Exception as e:
+            logger.error("Arrêt du tampon de messages en échec: %s", e)
+        self.task = None
+        self._spill(self.inflight + self.pending)
+        self.inflight, self.pending = [], []
+
+    def _spill(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        if not self.spill_path:
+            self.stats["dropped"] += len(rows)
+            logger.error("%s messages perdus (pas de MESSAGE_SPILL_PATH)", len(rows))
+            return
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(_to_json(row) + "\n")
+        self.stats["spilled"] += len(rows)
+        logger.warning("%s messages copiés dans %s", len(rows), self.spill_path)
+
+    def _replay_spill(self) -> None:
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            rows = [_from_json(line) for line in f if line.strip()]
+        # Lignes remises en file (puis réécrites dans le fichier si l'arrêt suivant échoue aussi)
+        self.pending[:0] = rows
+        os.remove(self.spill_path)
+        logger.info("%s messages du fichier de secours remis en file", len(rows))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"running": self.running, "pending": len(self.pending), "inflight": len(self.inflight), **self.stats}
+
+
+message_sink = MessageSink()
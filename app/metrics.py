@@ -0,0 +1,379 @@
+"""
+Métriques du pipeline de l'agent, exposées au format Prometheus sur /metrics (par process)
+- ktios_stage_seconds (histogramme): durée de chaque étape d'un tour, par étape / tenant / canal
+    rag, history, llm, llm_first_token, tool:<nom>, message_commit, message_flush
+- ktios_http_request_seconds (histogramme): durée des requêtes HTTP, par route / statut / tenant / canal
+- ktios_llm_tokens_total, ktios_llm_calls_total: tokens (prompt / completion / cached) par agent
+- ktios_agent_iterations (histogramme), ktios_agent_turns_total{finish_reason}
+- passerelle LLM (app/llm_gateway.py): ktios_llm_gateway_calls_total{outcome}, ktios_llm_retries_total,
+  ktios_llm_hedges_total{result}, ktios_llm_fallbacks_total{reason}, ktios_llm_breaker_state (au scrape)
+- caches (hits, misses, ratio) et pools DB: lus au moment du scrape, rien sur le chemin chaud
+
+Tenant et canal (whatsapp | sms | voice | web | api) sont portés par le contexte de la requête:
+set_request_labels() dans le webhook une fois le tenant résolu; les étapes appelées ensuite
+(y compris dans asyncio.to_thread et les tâches créées par la requête) les héritent.
+Le même contexte (+ request_id, conversation_id) est ajouté à chaque log (app/log.py).
+Quantiles p50/p95/p99: interpolés dans les buckets (histogram_quantile côté Prometheus,
+metrics_summary() côté app).
+
+Désactivation: METRICS_ENABLED=false (les appels deviennent des no-op)
+"""
+
+import os
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_PREFIX = "ktios"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets exponentiels ×1.5 de 1 ms à ~57 s: erreur d'interpolation des quantiles bornée par bucket
+LATENCY_BUCKETS = tuple(round(0.001 * 1.5 ** i, 6) for i in range(28))
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 10)
+
+# Labels de la requête en cours: dict partagé (une copie de contexte, ex. route sync dans le
+# threadpool, modifie le même dict que le middleware)
+_request_labels: contextvars.ContextVar = contextvars.ContextVar("metrics_request_labels", default=None)
+
+
+def begin_request(request_id: str = None) -> Dict[str, str]:
+    labels = {"tenant": "", "channel": "", "request_id": request_id or uuid.uuid4().hex[:16], "conversation_id": ""}
+    _request_labels.set(labels)
+    return labels
+
+
+def set_request_labels(tenant_id=None, channel: str = None, conversation_id=None) -> None:
+    labels = _request_labels.get()
+    if labels is None:
+        labels = begin_request()
+    if tenant_id is not None:
+        labels["tenant"] = str(tenant_id)
+    if channel:
+        labels["channel"] = channel
+    if conversation_id is not None:
+        labels["conversation_id"] = str(conversation_id)
+
+
+def request_context() -> Optional[Dict[str, str]]:
+    return _request_labels.get()
+
+
+def carry_request_context(job):
+    """Job asyncio exécuté plus tard (pool différé) avec une copie du contexte de la requête courante"""
+    labels = dict(_request_labels.get() or {})
+
+    async def run():
+        if labels:
+            _request_labels.set(dict(labels))
+        else:
+            begin_request()
+        return await job()
+
+    return run
+
+
+def current_labels() -> Tuple[str, str]:
+    labels = _request_labels.get()
+    return (labels["tenant"], labels["channel"]) if labels else ("", "")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Sequence[str]):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(v)}" for labels, v in values]
+        return lines
+
+
+class Histogram:
+    """Buckets fixes: observe() = une recherche dichotomique + trois additions sous verrou"""
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels → [compte par bucket (+Inf en dernier), somme, nombre]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> List[Tuple[tuple, List[int], float, int]]:
+        with self._lock:
+            return [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+
+    def quantile(self, counts: List[int], total: int, q: float) -> Optional[float]:
+        """Interpolation linéaire dans le bucket qui contient le rang q (comme histogram_quantile)"""
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total, count in self.snapshot():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.label_names, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+stage_seconds = Histogram(f"{METRICS_PREFIX}_stage_seconds", "Durée des étapes du pipeline de l'agent", ("stage", "tenant", "channel"))
+stage_errors = Counter(f"{METRICS_PREFIX}_stage_errors_total", "Étapes terminées par une exception", ("stage", "tenant", "channel"))
+http_seconds = Histogram(f"{METRICS_PREFIX}_http_request_seconds", "Durée des requêtes HTTP", ("route", "method", "status", "tenant", "channel"))
+llm_tokens = Counter(f"{METRICS_PREFIX}_llm_tokens_total", "Tokens LLM (prompt, completion, cached = prompt servi par le cache du fournisseur)", ("agent", "kind", "tenant", "channel"))
+llm_calls = Counter(f"{METRICS_PREFIX}_llm_calls_total", "Appels LLM", ("agent", "tenant", "channel"))
+agent_iterations = Histogram(f"{METRICS_PREFIX}_agent_iterations", "Appels LLM par tour de l'agent à tools", ("tenant", "channel"), ITERATION_BUCKETS)
+agent_turns = Counter(f"{METRICS_PREFIX}_agent_turns_total", "Tours de l'agent à tools par finish_reason", ("finish_reason", "tenant", "channel"))
+
+llm_gateway_calls = Counter(f"{METRICS_PREFIX}_llm_gateway_calls_total", "Appels de la passerelle LLM par issue (ok, error, deadline, breaker_open, client_error, stream_error, stream_deadline)", ("agent", "outcome", "tenant", "channel"))
+llm_retries = Counter(f"{METRICS_PREFIX}_llm_retries_total", "Reprises d'appels LLM après une erreur transitoire", ("agent", "error"))
+llm_hedges = Counter(f"{METRICS_PREFIX}_llm_hedges_total", "Requêtes LLM doublées (launched) et réponses venues du doublon (won)", ("agent", "result"))
+llm_fallbacks = Counter(f"{METRICS_PREFIX}_llm_fallbacks_total", "Réponses de secours sans LLM (extrait de la KB)", ("agent", "reason", "tenant", "channel"))
+
+_METRICS = (stage_seconds, stage_errors, http_seconds, llm_tokens, llm_calls, agent_iterations, agent_turns,
+            llm_gateway_calls, llm_retries, llm_hedges, llm_fallbacks)
+
+
+def observe_stage(stage: str, seconds: float, tenant_id=None) -> None:
+    if not METRICS_ENABLED:
+        return
+    tenant, channel = current_labels()
+    stage_seconds.observe((stage, str(tenant_id) if tenant_id is not None else tenant, channel), seconds)
+
+
+@contextmanager
+def timed(stage: str, tenant_id=None):
+    """with timed("rag"): ... → ktios_stage_seconds{stage="rag"} (+ stage_errors si exception)"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        tenant, channel = current_labels()
+        stage_errors.inc((stage, str(tenant_id) if tenant_id is not None else tenant, channel))
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started, tenant_id)
+
+
+def record_llm_usage(agent: str, usage: Dict[str, int]) -> None:
+    """usage = prompt_cache.usage_of(...)"""
+    if not METRICS_ENABLED:
+        return
+    tenant, channel = current_labels()
+    llm_calls.inc((agent, tenant, channel))
+    llm_tokens.inc((agent, "prompt", tenant, channel), usage["prompt_tokens"])
+    llm_tokens.inc((agent, "completion", tenant, channel), usage["completion_tokens"])
+    llm_tokens.inc((agent, "cached", tenant, channel), usage["cached_tokens"])
+
+
+def record_agent_turn(iterations: int, finish_reason: str) -> None:
+    if not METRICS_ENABLED:
+        return
+    tenant, channel = current_labels()
+    agent_iterations.observe((tenant, channel), iterations)
+    agent_turns.inc((finish_reason or "", tenant, channel))
+
+
+def record_llm_call(agent: str, outcome: str) -> None:
+    if not METRICS_ENABLED:
+        return
+    tenant, channel = current_labels()
+    llm_gateway_calls.inc((agent, outcome, tenant, channel))
+
+
+def record_llm_retry(agent: str, error: str) -> None:
+    if METRICS_ENABLED:
+        llm_retries.inc((agent, error))
+
+
+def record_llm_hedge(agent: str, result: str) -> None:
+    if METRICS_ENABLED:
+        llm_hedges.inc((agent, result))
+
+
+def record_llm_fallback(agent: str, reason: str) -> None:
+    if not METRICS_ENABLED:
+        return
+    tenant, channel = current_labels()
+    llm_fallbacks.inc((agent, reason, tenant, channel))
+
+
+# ========================================
+# Valeurs lues au scrape (caches, pools)
+# ========================================
+
+def _cache_stats() -> Dict[str, Dict[str, Any]]:
+    from .rag import retrieval_cache_stats
+    from .answer_cache import answer_cache_stats
+    from .resolution import resolution_cache_stats
+    from .history import history_cache_stats
+    from .tenant_settings import tenant_settings_cache_stats
+    retrieval = retrieval_cache_stats()
+    return {
+        "rag": retrieval["results"],
+        "lexical_index": retrieval["lexical_indexes"],
+        "answer": answer_cache_stats(),
+        **{f"resolution_{name}": stats for name, stats in resolution_cache_stats().items()},
+        "history": history_cache_stats(),
+        "tenant_settings": tenant_settings_cache_stats(),
+    }
+
+
+def _gauge(name: str, help: str, kind: str, samples: List[Tuple[str, float]], label: str) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines += [f'{name}{{{label}="{_escape(key)}"}} {_format_value(value)}' for key, value in samples]
+    return lines
+
+
+def _collected() -> List[str]:
+    lines: List[str] = []
+    caches = _cache_stats()
+    lines += _gauge(f"{METRICS_PREFIX}_cache_hits_total", "Succès de cache", "counter", [(k, s["hits"]) for k, s in caches.items()], "cache")
+    lines += _gauge(f"{METRICS_PREFIX}_cache_misses_total", "Défauts de cache", "counter", [(k, s["misses"]) for k, s in caches.items()], "cache")
+    lines += _gauge(f"{METRICS_PREFIX}_cache_hit_ratio", "Taux de succès depuis le démarrage", "gauge",
+                    [(k, s["hit_ratio"]) for k, s in caches.items() if s["hit_ratio"] is not None], "cache")
+    lines += _gauge(f"{METRICS_PREFIX}_cache_entries", "Entrées en mémoire (L1)", "gauge", [(k, s["entries"]) for k, s in caches.items()], "cache")
+
+    from .db import pool_status
+    pools = {name: status for name, status in pool_status().items() if isinstance(status, dict)}
+    lines += _gauge(f"{METRICS_PREFIX}_db_pool_checked_out", "Connexions empruntées", "gauge", [(k, p["checked_out"]) for k, p in pools.items()], "engine")
+    lines += _gauge(f"{METRICS_PREFIX}_db_pool_size", "Connexions ouvertes dans le pool", "gauge", [(k, p["checked_in"] + p["checked_out"]) for k, p in pools.items()], "engine")
+    lines += _gauge(f"{METRICS_PREFIX}_db_pool_timeouts_total", "Attentes de connexion expirées", "counter", [(k, p["timeouts"]) for k, p in pools.items()], "engine")
+    lines += _gauge(f"{METRICS_PREFIX}_db_pool_wait_seconds_max", "Plus longue attente de connexion", "gauge", [(k, p["wait_max_ms"] / 1000) for k, p in pools.items()], "engine")
+
+    from .log import log_stats
+    logs = log_stats()
+    lines += _gauge(f"{METRICS_PREFIX}_log_records_total", "Événements de log par issue", "counter",
+                    [(k, logs[k]) for k in ("queued", "written", "dropped", "sampled_out")], "outcome")
+    lines += _gauge(f"{METRICS_PREFIX}_log_queue_pending", "Événements de log en attente d'écriture", "gauge", [("app", logs["pending"])], "logger")
+
+    from .llm_gateway import gateway_status
+    gateway = gateway_status()
+    lines += _gauge(f"{METRICS_PREFIX}_llm_breaker_state", "Disjoncteur LLM: 0 fermé, 1 semi-ouvert, 2 ouvert", "gauge",
+                    [("openai", {"half_open": 1, "open": 2}.get(gateway["breaker"], 0))], "provider")
+    lines += _gauge(f"{METRICS_PREFIX}_llm_breaker_opened_total", "Ouvertures du disjoncteur LLM", "counter", [("openai", gateway["breaker_opened"])], "provider")
+    return lines
+
+
+def render_metrics() -> str:
+    """Texte d'exposition Prometheus"""
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines += metric.expose()
+    try:
+        lines += _collected()
+    except Exception as e:
+        logger.error("Collecte des métriques en échec: %s", e)
+    return "\n".join(lines) + "\n"
+
+
+def metrics_summary() -> Dict[str, Any]:
+    """p50/p95/p99 (ms) par étape / tenant / canal"""
+    stages = []
+    for (stage, tenant, channel), counts, total, count in stage_seconds.snapshot():
+        stages.append({
+            "stage": stage,
+            "tenant": tenant,
+            "channel": channel,
+            "count": count,
+            "avg_ms": round(total / count * 1000, 2),
+            **{f"p{int(q * 100)}_ms": round(stage_seconds.quantile(counts, count, q) * 1000, 2) for q in (0.5, 0.95, 0.99)},
+        })
+    return {"stages": sorted(stages, key=lambda s: (s["stage"], s["tenant"], s["channel"]))}
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: labels de requête + durée de chaque requête HTTP (réponses streamées comprises)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # X-Request-Id repris de l'appelant (proxy) s'il existe, renvoyé dans la réponse
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"")[:64].decode("latin-1")
+        labels = begin_request(incoming or None)
+        if not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", labels["request_id"].encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Routes sans paramètres de chemin: le chemin est une valeur bornée (sauf 404)
+            route = scope["path"] if status["code"] != 404 else "unmatched"
+            http_seconds.observe(
+                (route, scope["method"], str(status["code"]), labels["tenant"], labels["channel"]),
+                time.perf_counter() - started
+            )
@@ -45,4 +45,7 @@ class Message(Base):
     content_type = Column(String, nullable=False, default="text")
     provider_message_id = Column(String, nullable=True)
     meta = Column(JSONB, nullable=True)
+    # Réponses différées (deferred.py): pending | sent | skipped | failed, NULL hors mode différé
+    reply_status = Column(String, nullable=True)
+    reply_claimed_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Assemblage des prompts pour le cache de prompt côté fournisseur (OpenAI: préfixes >= 1024 tokens)
+Le fournisseur ne réutilise que le plus long préfixe identique octet pour octet d'une requête
+à l'autre. Ordre des messages: du plus stable au plus variable
+    [tools] + prompt système (statique) → historique (croît en fin) → KB du tour → message client
+Tout ce qui dépend du tour (KB, date, tenant) reste après le préfixe statique.
+
+- taille en tokens du préfixe statique calculée une seule fois par prompt système
+- usage par appel (prompt / complétion / tokens servis depuis le cache) + totaux par process
+
+PROMPT_CACHE_KEY (optionnel): envoyé en prompt_cache_key, regroupe les requêtes qui partagent
+le préfixe sur les mêmes serveurs du fournisseur.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+from .tokens import count_tokens
+from .metrics import record_llm_usage
+
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY", "")
+# Taille minimale d'un préfixe mis en cache par le fournisseur
+PROVIDER_CACHE_MIN_TOKENS = 1024
+
+_static_prefixes: Dict[tuple, Dict[str, Any]] = {}
+_static_lock = threading.Lock()
+
+_usage_totals: Dict[str, Dict[str, int]] = {}
+_usage_lock = threading.Lock()
+
+
+def static_prefix(system_prompt: str, tools: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Tokens et empreinte du préfixe statique (tools + prompt système), calculés une fois"""
+    key = (system_prompt, id(tools) if tools is not None else None)
+    info = _static_prefixes.get(key)
+    if info is None:
+        tools_json = json.dumps(tools, ensure_ascii=False, separators=(",", ":")) if tools else ""
+        system_tokens = count_tokens(system_prompt)
+        tools_tokens = count_tokens(tools_json)
+        info = {
+            "system_tokens": system_tokens,
+            "tools_tokens": tools_tokens,
+            "tokens": system_tokens + tools_tokens,
+            "cacheable": system_tokens + tools_tokens >= PROVIDER_CACHE_MIN_TOKENS,
+            "fingerprint": hashlib.sha256((system_prompt + "\x00" + tools_json).encode("utf-8")).hexdigest()[:16],
+        }
+        with _static_lock:
+            _static_prefixes[key] = info
+    return info
+
+
+def assemble_messages(
+    system_prompt: str,
+    history: Optional[List[Dict[str, str]]],
+    turn_context: List[str],
+    user_text: str,
+) -> List[Dict[str, Any]]:
+    """
+    [système statique] + historique + contexte du tour (messages système) + message client.
+    Le premier message ne doit jamais contenir de donnée du tour.
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        *(history or []),
+        *({"role": "system", "content": part} for part in turn_context),
+        {"role": "user", "content": user_text},
+    ]
+
+
+def cache_params() -> Dict[str, Any]:
+    """Paramètres additionnels de chat.completions.create"""
+    return {"prompt_cache_key": PROMPT_CACHE_KEY} if PROMPT_CACHE_KEY else {}
+
+
+def usage_of(usage) -> Dict[str, int]:
+    """Usage d'une réponse OpenAI (objet usage, éventuellement None) → dict"""
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    }
+
+
+def record_usage(agent: str, usage) -> Dict[str, int]:
+    """Ajoute l'usage d'un appel aux totaux du process, retourne l'usage de l'appel"""
+    call = usage_of(usage)
+    with _usage_lock:
+        totals = _usage_totals.setdefault(agent, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+        totals["calls"] += 1
+        for field, value in call.items():
+            totals[field] += value
+    record_llm_usage(agent, call)
+    return call
+
+
+def summarize_usage(calls: List[Dict[str, int]], prefix: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Usage d'un tour (plusieurs appels LLM): détail par appel + sommes"""
+    summary = {
+        "calls": calls,
+        "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+        "completion_tokens": sum(c["completion_tokens"] for c in calls),
+        "cached_tokens": sum(c["cached_tokens"] for c in calls),
+    }
+    if prefix:
+        summary["static_prefix_tokens"] = prefix["tokens"]
+    return summary
+
+
+def llm_usage_stats() -> Dict[str, Any]:
+    with _usage_lock:
+        stats = {agent: dict(totals) for agent, totals in _usage_totals.items()}
+    for totals in stats.values():
+        totals["cached_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 3) if totals["prompt_tokens"] else None
+    return stats
@@ -1,126 +1,647 @@
 import os
+import json
+import time
+import hashlib
 import uuid
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from typing import Dict, Any, List, Tuple
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
+from .lexical import BM25Index, analyze, fold_accents
+from .cache import TTLCache
+from .shared_cache import SharedCache
+from .metrics import timed
+from .log import sampled_debug
+from .embeddings import embed_texts, to_pgvector
+from .chunking import chunk_document, chunker_signature
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50):
-    """Découpe le texte en chunks avec chevauchement"""
-    chunks = []
-    start = 0
-    text_length = len(text)
-    
-    while start < text_length:
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start = end - overlap
-    
-    return chunks
+logger = logging.getLogger(__name__)
 
-def ingest_kb_document(db: Session, tenant_id: str, title: str, raw_text: str, source: str = "manual"):
-    """Ingère un document dans la base de connaissance"""
+# Durée de vie (secondes) de l'index lexical en mémoire d'un tenant
+KB_INDEX_TTL = float(os.getenv("KB_INDEX_TTL", "300"))
+
+# Calcul des embeddings à l'ingestion: opt-in, nécessite la colonne kb_chunks.embedding (kb_schema.sql,
+# absente de kb_schema_simple.sql). Requis pour RETRIEVAL_MODE=vector | hybrid
+KB_EMBEDDINGS = os.getenv("KB_EMBEDDINGS", "false").lower() == "true"
+
+# lexical | vector | hybrid (surchargeable par tenant, voir tenant_settings)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "lexical")
+
+# Mode hybrid: budget de latence, taille du pool, candidats par retriever (top_k × facteur), constante RRF
+HYBRID_BUDGET_MS = int(os.getenv("HYBRID_BUDGET_MS", "300"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+HYBRID_CANDIDATES_FACTOR = 3
+RRF_K = 60
+
+# Nombre de listes ivfflat visitées par requête (rappel ↑, latence ↑)
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+
+# Colonnes écrites dans kb_chunks (CAST appliqué au paramètre quand le type SQL l'exige)
+_CHUNK_COLUMNS = ["id", "document_id", "tenant_id", "chunk_index", "chunk_text", "content_hash", "metadata"]
+if KB_EMBEDDINGS:
+    _CHUNK_COLUMNS.append("embedding")
+_CHUNK_CASTS = {"embedding": "vector", "metadata": "jsonb"}
+
+# Nombre de documents écrits par transaction lors d'une ingestion en masse
+KB_INGEST_BATCH_SIZE = int(os.getenv("KB_INGEST_BATCH_SIZE", "50"))
+
+# Cache des résultats de rag_search (L1 + L2 partagé entre workers): clé (mots-clés normalisés, top_k, mode)
+RAG_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "2048"))
+RAG_CACHE_TTL = float(os.getenv("RAG_CACHE_TTL", "600"))
+
+_lexical_indexes = TTLCache(max_entries=int(os.getenv("KB_INDEX_MAX_TENANTS", "256")), ttl=KB_INDEX_TTL)
+# Génération du tenant = version de sa KB, incrémentée à chaque ingestion (partagée via le L2):
+# elle fait partie des clés, une recherche lancée avant l'ingestion ne peut donc pas ré-insérer
+# un résultat périmé. Invalidation par génération uniquement: le L1 garde ses entrées RAG_CACHE_TTL.
+_retrieval_cache = SharedCache("rag", max_entries=RAG_CACHE_SIZE, ttl=RAG_CACHE_TTL, l1_ttl=RAG_CACHE_TTL)
+
+_retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+def load_kb_file(path: str) -> List[Dict[str, Any]]:
+    """Lit des documents KB depuis un fichier JSON (liste) ou JSONL (un document par ligne)"""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+def _values_clause(columns: List[str], rows: List[Dict[str, Any]], casts: Dict[str, str] = None) -> Tuple[str, Dict[str, Any]]:
+    """Construit 'VALUES (...), (...)' avec des paramètres nommés uniques par ligne"""
+    casts = casts or {}
+    params = {}
+    values = []
+    for i, row in enumerate(rows):
+        placeholders = []
+        for column in columns:
+            params[f"{column}_{i}"] = row[column]
+            placeholder = f":{column}_{i}"
+            if column in casts:
+                placeholder = f"CAST({placeholder} AS {casts[column]})"
+            placeholders.append(placeholder)
+        values.append(f"({', '.join(placeholders)})")
+    return "VALUES " + ", ".join(values), params
+
+
+def _insert_rows(db: Session, table: str, columns: List[str], rows: List[Dict[str, Any]], casts: Dict[str, str] = None):
+    """INSERT multi-lignes: un seul aller-retour pour tout le lot"""
+    if not rows:
+        return
+    values, params = _values_clause(columns, rows, casts)
+    db.execute(text(f"INSERT INTO {table} ({', '.join(columns)}) {values}"), params)
+
+
+def _update_rows(db: Session, table: str, columns: List[str], rows: List[Dict[str, Any]], casts: Dict[str, str] = None, extra_set: str = None):
+    """UPDATE multi-lignes par id (UPDATE ... FROM (VALUES ...)): un seul aller-retour"""
+    if not rows:
+        return
+    values, params = _values_clause(["id"] + columns, rows, {"id": "uuid", **(casts or {})})
+    assignments = ", ".join([f"{column} = v.{column}" for column in columns] + ([extra_set] if extra_set else []))
+    db.execute(
+        text(f"UPDATE {table} t SET {assignments} FROM ({values}) AS v(id, {', '.join(columns)}) WHERE t.id = v.id"),
+        params
+    )
+
+
+def _delete_rows(db: Session, table: str, ids: List[str]):
+    if ids:
+        db.execute(text(f"DELETE FROM {table} WHERE id = ANY(CAST(:ids AS uuid[]))"), {"ids": ids})
+
+
+def content_hash(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def document_hash(raw_text: str) -> str:
+    """Hash d'un document: inclut la signature du découpage pour forcer un re-découpage s'il change"""
+    return content_hash(f"{chunker_signature()}\n{raw_text}")
+
+
+def _document_key(doc: Dict[str, Any]) -> Tuple[str, str]:
+    """Clé d'upsert d'un document: (titre, source)"""
+    return doc["title"], doc.get("source") or "manual"
+
+
+def _dedupe_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Un même (titre, source) présent deux fois: la dernière version l'emporte"""
+    return list({_document_key(doc): doc for doc in documents}.values())
+
+
+def _select_documents(db: Session, tenant_uuid: uuid.UUID, titles: List[str]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    return {
+        (row["title"], row["source"] or "manual"): row
+        for row in db.execute(
+            text("""
+            SELECT id, title, source, content_hash
+            FROM kb_documents
+            WHERE tenant_id = :tenant_id AND title = ANY(:titles)
+            """),
+            {"tenant_id": tenant_uuid, "titles": titles}
+        ).mappings().all()
+    }
+
+
+def _insert_new_documents(db: Session, rows: List[Dict[str, Any]]) -> Dict[Tuple[str, str], str]:
+    """
+    INSERT des documents absents; une ligne déjà créée par une ingestion concurrente est ignorée
+    (ON CONFLICT sur l'index unique tenant/titre/source). Retourne {clé: id} des lignes insérées.
+    """
+    if not rows:
+        return {}
+    columns = ["id", "tenant_id", "title", "source", "raw_text", "content_hash"]
+    values, params = _values_clause(columns, rows)
+    inserted = db.execute(
+        text(f"""
+        INSERT INTO kb_documents ({', '.join(columns)}) {values}
+        ON CONFLICT (tenant_id, title, COALESCE(source, 'manual')) DO NOTHING
+        RETURNING id, title, source
+        """),
+        params
+    ).mappings().all()
+    return {(row["title"], row["source"] or "manual"): str(row["id"]) for row in inserted}
+
+
+def _write_documents_batch(db: Session, tenant_uuid: uuid.UUID, documents: List[Dict[str, Any]], stats: Dict[str, int]) -> List[str]:
+    """
+    Upsert d'un lot de documents clé (tenant, titre, source).
+    - document inchangé (même hash)  → aucune écriture
+    - document modifié → seuls les chunks dont le hash a changé sont écrits (et ré-embeddés),
+      les chunks disparus sont supprimés, les chunks déplacés gardent leur ligne (index/positions mis à jour)
+    Retourne les ids des documents du lot.
+    """
+    documents = _dedupe_documents(documents)
+    existing_docs = _select_documents(db, tenant_uuid, list({doc["title"] for doc in documents}))
     
-    try:
-        print(f"DEBUG: Starting ingest for tenant {tenant_id}")
-        
-        doc_id = uuid.uuid4()
-        
-        print(f"DEBUG: Inserting document with id {doc_id}")
-        
-        db.execute(
+    # Documents absents insérés en premier: un document créé entre-temps par une ingestion concurrente
+    # (INSERT ignoré) est relu et suit le chemin des documents existants
+    missing = [doc for doc in documents if _document_key(doc) not in existing_docs]
+    inserted = _insert_new_documents(db, [
+        {
+            "id": uuid.uuid4(),
+            "tenant_id": tenant_uuid,
+            "title": _document_key(doc)[0],
+            "source": _document_key(doc)[1],
+            "raw_text": doc["raw_text"],
+            "content_hash": document_hash(doc["raw_text"]),
+        }
+        for doc in missing
+    ])
+    if len(inserted) < len(missing):
+        existing_docs.update(_select_documents(db, tenant_uuid, [doc["title"] for doc in missing if _document_key(doc) not in inserted]))
+    
+    changed_ids = [
+        str(existing_docs[_document_key(doc)]["id"])
+        for doc in documents
+        if _document_key(doc) in existing_docs
+        and existing_docs[_document_key(doc)]["content_hash"] != document_hash(doc["raw_text"])
+    ]
+    existing_chunks: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    if changed_ids:
+        for row in db.execute(
             text("""
-            INSERT INTO kb_documents (id, tenant_id, title, source, raw_text, created_at, updated_at)
-            VALUES (:id, :tenant_id, :title, :source, :raw_text, now(), now())
+            SELECT id, document_id, chunk_index, content_hash, metadata
+            FROM kb_chunks
+            WHERE document_id = ANY(CAST(:ids AS uuid[]))
             """),
-            {
-                "id": doc_id,
-                "tenant_id": uuid.UUID(tenant_id),
-                "title": title,
-                "source": source,
-                "raw_text": raw_text
-            }
-        )
-        
-        print(f"DEBUG: Document inserted successfully")
-        
-        chunks = chunk_text(raw_text)
-        
-        print(f"DEBUG: Created {len(chunks)} chunks")
-        
-        for idx, chunk in enumerate(chunks):
-            db.execute(
-                text("""
-                INSERT INTO kb_chunks (id, document_id, tenant_id, chunk_index, chunk_text, metadata, created_at)
-                VALUES (:id, :document_id, :tenant_id, :chunk_index, :chunk_text, :metadata, now())
-                """),
-                {
-                    "id": uuid.uuid4(),
-                    "document_id": doc_id,
-                    "tenant_id": uuid.UUID(tenant_id),
-                    "chunk_index": idx,
-                    "chunk_text": chunk,
-                    "metadata": None
-                }
-            )
-        
-        print(f"DEBUG: All chunks inserted")
-        
-        db.commit()
-        
-        print(f"DEBUG: Transaction committed")
+            {"ids": changed_ids}
+        ).mappings().all():
+            by_hash = existing_chunks.setdefault(str(row["document_id"]), {})
+            by_hash.setdefault(row["content_hash"], []).append(row)
+    
+    document_ids = []
+    updated_docs = []
+    new_chunks, moved_chunks, removed_chunks = [], [], []
+    
+    for doc in documents:
+        doc_hash = document_hash(doc["raw_text"])
+        key = _document_key(doc)
+        existing = existing_docs.get(key)
         
-        return str(doc_id)
+        if key in inserted:
+            doc_id = inserted[key]
+            stats["documents_inserted"] += 1
+        elif existing["content_hash"] == doc_hash:
+            document_ids.append(str(existing["id"]))
+            stats["documents_unchanged"] += 1
+            continue
+        else:
+            doc_id = existing["id"]
+            updated_docs.append({"id": str(doc_id), "raw_text": doc["raw_text"], "content_hash": doc_hash})
+            stats["documents_updated"] += 1
+        document_ids.append(str(doc_id))
         
-    except Exception as e:
-        print(f"ERROR in ingest_kb_document: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise
-
-def rag_search(db: Session, tenant_id: str, query: str, top_k: int = 3):
-    """Recherche dans la base de connaissance avec extraction de mots-clés"""
+        old_by_hash = existing_chunks.get(str(doc_id), {})
+        for idx, chunk in enumerate(chunk_document(doc["raw_text"])):
+            chunk_hash = content_hash(chunk["text"])
+            # Positions du chunk dans raw_text (+ titre de section répété le cas échéant)
+            metadata = {key: value for key, value in chunk.items() if key != "text"}
+            candidates = old_by_hash.get(chunk_hash)
+            if candidates:
+                kept = candidates.pop()
+                if kept["chunk_index"] != idx or kept["metadata"] != metadata:
+                    moved_chunks.append({"id": str(kept["id"]), "chunk_index": idx, "metadata": json.dumps(metadata)})
+                stats["chunks_unchanged"] += 1
+                continue
+            new_chunks.append({
+                "id": uuid.uuid4(),
+                "document_id": doc_id,
+                "tenant_id": tenant_uuid,
+                "chunk_index": idx,
+                "chunk_text": chunk["text"],
+                "content_hash": chunk_hash,
+                "metadata": json.dumps(metadata),
+            })
+        removed_chunks.extend(str(row["id"]) for rows in old_by_hash.values() for row in rows)
     
-    print(f"DEBUG RAG_SEARCH: tenant_id={tenant_id}, type={type(tenant_id)}")
-    print(f"DEBUG RAG_SEARCH: query={query}")
+    if KB_EMBEDDINGS and new_chunks:
+        # Seuls les chunks nouveaux/modifiés sont embeddés, par paquets de EMBEDDING_BATCH_SIZE
+        embeddings = embed_texts([row["chunk_text"] for row in new_chunks])
+        for row, embedding in zip(new_chunks, embeddings):
+            row["embedding"] = to_pgvector(embedding)
     
-    # Extrait les mots importants (retire les mots vides français)
-    stop_words = {'le', 'la', 'les', 'un', 'une', 'des', 'du', 'de', 'd', 'et', 'ou', 'à', 'au', 
-              'est', 'sont', 'quel', 'quelle', 'quels', 'quelles', 'comment', 'combien',
-              'avez', 'vous', 'votre', 'vos', 'notre', 'nos', 'je', 'il', 'elle', 'nous', 'ils', 'elles', 'sur', 'dans', 'prix'}
+    _update_rows(db, "kb_documents", ["raw_text", "content_hash"], updated_docs, extra_set="updated_at = now()")
+    # Suppression avant les déplacements/insertions: libère les chunk_index réutilisés
+    _delete_rows(db, "kb_chunks", removed_chunks)
+    _update_rows(db, "kb_chunks", ["chunk_index", "metadata"], moved_chunks, {"chunk_index": "int", "metadata": "jsonb"})
+    _insert_rows(db, "kb_chunks", _CHUNK_COLUMNS, new_chunks, _CHUNK_CASTS)
     
-    words = [w.lower().strip('?.,!') for w in query.split() if len(w) > 2 and w.lower() not in stop_words]
-    keywords = ' '.join(words) if words else query
+    stats["chunks_inserted"] += len(new_chunks)
+    stats["chunks_deleted"] += len(removed_chunks)
+    return document_ids
+
+
+def _prune_documents(db: Session, tenant_uuid: uuid.UUID, documents: List[Dict[str, Any]]) -> int:
+    """Supprime les documents du tenant absents de l'ingestion (pour les sources ingérées)"""
+    keys = {_document_key(doc) for doc in documents}
+    rows = db.execute(
+        text("""
+        SELECT id, title, source
+        FROM kb_documents
+        WHERE tenant_id = :tenant_id AND COALESCE(source, 'manual') = ANY(:sources)
+        """),
+        {"tenant_id": tenant_uuid, "sources": list({source for _, source in keys})}
+    ).mappings().all()
+    stale = [str(row["id"]) for row in rows if (row["title"], row["source"] or "manual") not in keys]
+    # kb_chunks suivent via ON DELETE CASCADE
+    _delete_rows(db, "kb_documents", stale)
+    return len(stale)
+
+
+def ingest_kb_documents(db: Session, tenant_id: str, documents: List[Dict[str, Any]], batch_size: int = None, prune: bool = False) -> Dict[str, Any]:
+    """
+    Ingestion en masse idempotente: documents = [{"title", "raw_text", "source"?}, ...]
+    Une transaction par lot de batch_size documents (défaut KB_INGEST_BATCH_SIZE).
+    prune=True supprime ensuite les documents du tenant (mêmes sources) absents de la liste.
+    """
+    batch_size = batch_size or KB_INGEST_BATCH_SIZE
+    tenant_uuid = uuid.UUID(str(tenant_id))
+    documents = _dedupe_documents(documents)
+    document_ids: List[str] = []
+    stats = dict.fromkeys([
+        "documents_inserted", "documents_updated", "documents_unchanged", "documents_deleted",
+        "chunks_inserted", "chunks_unchanged", "chunks_deleted",
+    ], 0)
+    batches = 0
+    started = time.perf_counter()
     
-    print(f"DEBUG RAG_SEARCH: keywords extracted = '{keywords}'")
+    try:
+        for start in range(0, len(documents), batch_size):
+            document_ids.extend(_write_documents_batch(db, tenant_uuid, documents[start:start + batch_size], stats))
+            db.commit()
+            batches += 1
+            logger.debug("Lot %s d'ingestion validé", batches, extra={"tenant_id": str(tenant_id), "stats": dict(stats)})
+        if prune and documents:
+            stats["documents_deleted"] = _prune_documents(db, tenant_uuid, documents)
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ingestion KB en échec: %s", e, extra={"tenant_id": str(tenant_id)})
+        raise
+    finally:
+        if stats["documents_inserted"] or stats["documents_updated"] or stats["documents_deleted"]:
+            invalidate_tenant_kb(tenant_id)
     
+    elapsed = time.perf_counter() - started
+    return {
+        "document_ids": document_ids,
+        "documents": len(document_ids),
+        "chunks": stats["chunks_inserted"] + stats["chunks_unchanged"],
+        "batches": batches,
+        **stats,
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(len(document_ids) / elapsed, 1) if elapsed else None,
+        "chunks_per_second": round((stats["chunks_inserted"] + stats["chunks_unchanged"]) / elapsed, 1) if elapsed else None,
+    }
+
+
+def ingest_kb_document(db: Session, tenant_id: str, title: str, raw_text: str, source: str = "manual"):
+    """Ingère un document dans la base de connaissance"""
+    result = ingest_kb_documents(db, tenant_id, [{"title": title, "raw_text": raw_text, "source": source}])
+    logger.info("Document KB ingéré", extra={"tenant_id": str(tenant_id), "document_id": result["document_ids"][0], "chunks": result["chunks"]})
+    return result["document_ids"][0]
+
+def _load_lexical_index(db: Session, tenant_id) -> BM25Index:
+    """Charge tous les chunks du tenant dans un index BM25 (une seule requête indexée sur tenant_id)"""
     rows = db.execute(
         text("""
-        SELECT
-            chunk_text,
-            1.0 as rank
+        SELECT id, document_id, chunk_index, chunk_text
         FROM kb_chunks
         WHERE tenant_id = :tenant_id
-          AND chunk_text ILIKE '%' || :query || '%'
-        ORDER BY rank DESC
+        """),
+        {"tenant_id": tenant_id}
+    ).mappings().all()
+
+    index = BM25Index()
+    for row in rows:
+        index.add(
+            {
+                "chunk_id": str(row["id"]),
+                "document_id": str(row["document_id"]),
+                "chunk_index": row["chunk_index"],
+                "chunk_text": row["chunk_text"],
+            },
+            row["chunk_text"]
+        )
+    return index
+
+
+def get_lexical_index(db: Session, tenant_id) -> BM25Index:
+    """Index BM25 du tenant, reconstruit au plus toutes les KB_INDEX_TTL secondes ou après ingestion"""
+    key = (str(tenant_id), kb_version(tenant_id))
+    index = _lexical_indexes.get(key)
+    if index is None:
+        index = _load_lexical_index(db, uuid.UUID(str(tenant_id)))
+        _lexical_indexes.set(key, index)
+    return index
+
+
+def kb_version(tenant_id) -> int:
+    """Version de la KB du tenant (commune à tous les workers si le cache L2 est configuré)"""
+    return _retrieval_cache.generation(tenant_id)
+
+
+def invalidate_tenant_kb(tenant_id) -> None:
+    """Invalide l'index lexical et les résultats en cache du tenant (appelé après ingestion)"""
+    _retrieval_cache.invalidate_tenant(tenant_id)
+    _lexical_indexes.invalidate_tenant(tenant_id)
+    from .answer_cache import invalidate_tenant_answers
+    invalidate_tenant_answers(tenant_id)
+
+
+def retrieval_cache_stats() -> Dict[str, Any]:
+    return {"results": _retrieval_cache.stats(), "lexical_indexes": _lexical_indexes.stats()}
+
+
+def vector_search(db: Session, tenant_id, query: str, top_k: int = 3, probes: int = None, query_vector: List[float] = None):
+    """Recherche ANN (pgvector ivfflat, distance cosinus) filtrée par tenant"""
+    if query_vector is None:
+        query_vector = embed_texts([query])[0]
+    
+    # set_config(..., true) = SET LOCAL: limité à la transaction en cours
+    db.execute(
+        text("SELECT set_config('ivfflat.probes', :probes, true)"),
+        {"probes": str(probes or IVFFLAT_PROBES)}
+    )
+    
+    rows = db.execute(
+        text("""
+        SELECT id, document_id, chunk_index, chunk_text,
+               embedding <=> CAST(CAST(:query_vector AS text) AS vector) AS distance
+        FROM kb_chunks
+        WHERE tenant_id = :tenant_id
+          AND embedding IS NOT NULL
+        ORDER BY embedding <=> CAST(CAST(:query_vector AS text) AS vector)
         LIMIT :top_k
         """),
         {
-            "tenant_id": uuid.UUID(tenant_id) if isinstance(tenant_id, str) else tenant_id,
-            "query": keywords,
+            "tenant_id": uuid.UUID(str(tenant_id)),
+            "query_vector": to_pgvector(query_vector),
             "top_k": top_k
         }
     ).mappings().all()
     
-    print(f"DEBUG RAG_SEARCH: Found {len(rows)} results")
-    
-    results = []
-    for row in rows:
-        results.append({
+    return [
+        {
+            "chunk_id": str(row["id"]),
+            "document_id": str(row["document_id"]),
+            "chunk_index": row["chunk_index"],
             "chunk_text": row["chunk_text"],
-            "score": float(row["rank"])
-        })
+            "score": 1.0 - float(row["distance"])
+        }
+        for row in rows
+    ]
+
+
+def lexical_search(db: Session, tenant_id, query: str, top_k: int = 3):
+    """Recherche lexicale classée (BM25) sur l'index en mémoire du tenant"""
+    index = get_lexical_index(db, tenant_id)
+    return [
+        {**chunk, "score": float(score)}
+        for score, chunk in index.search(query, top_k=top_k)
+    ]
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], top_k: int, k: int = RRF_K):
+    """Fusionne des listes classées: score(chunk) = Σ 1 / (k + rang)"""
+    fused: Dict[str, Dict[str, Any]] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            key = result["chunk_id"]
+            if key not in fused:
+                fused[key] = {**result, "score": 0.0}
+            fused[key]["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda r: r["score"], reverse=True)[:top_k]
+
+
+def _search_in_own_session(search_fn, bind, tenant_id, query: str, top_k: int):
+    """Exécute une recherche dans sa propre session (une Session SQLAlchemy n'est pas thread-safe)"""
+    session = Session(bind=bind)
+    try:
+        return search_fn(session, tenant_id, query, top_k)
+    finally:
+        session.close()
+
+
+def hybrid_search(db: Session, tenant_id, query: str, top_k: int = 3, budget_ms: int = None):
+    return _hybrid_search(db, tenant_id, query, top_k, budget_ms)[0]
+
+
+def _hybrid_search(db: Session, tenant_id, query: str, top_k: int, budget_ms: int = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Lance les recherches lexicale et vectorielle en parallèle puis les fusionne (RRF).
+    Si le budget de latence expire, on garde le(s) retriever(s) déjà terminé(s);
+    si aucun n'a fini, on attend seulement le premier.
+    Retourne (résultats, complet): complet=False si un retriever a été ignoré.
+    """
+    budget = (budget_ms or HYBRID_BUDGET_MS) / 1000.0
+    candidates = top_k * HYBRID_CANDIDATES_FACTOR
+    bind = db.get_bind()
+    
+    futures = {
+        _retrieval_pool.submit(_search_in_own_session, search_fn, bind, tenant_id, query, candidates): name
+        for name, search_fn in (("lexical", lexical_search), ("vector", vector_search))
+    }
+    
+    done, pending = wait(futures, timeout=budget)
+    if not done:
+        done, pending = wait(futures, return_when=FIRST_COMPLETED)
+    
+    result_lists = []
+    errors = []
+    for future in done:
+        try:
+            result_lists.append(future.result())
+        except Exception as e:
+            errors.append(e)
+            logger.error("Recherche hybride, retriever %s en échec: %s", futures[future], e)
+    
+    if pending:
+        logger.info("Recherche hybride: budget de %s ms dépassé, ignoré: %s", budget_ms or HYBRID_BUDGET_MS, [futures[f] for f in pending])
+    
+    if not result_lists:
+        if pending:
+            # Le premier retriever a échoué: on se rabat sur l'autre, même hors budget
+            return _first_result(pending), False
+        raise errors[0]
+    
+    return reciprocal_rank_fusion(result_lists, top_k), not pending and not errors
+
+
+def _first_result(futures):
+    for future in as_completed(futures):
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error("Recherche hybride, repli en échec: %s", e)
+    return []
+
+
+def _cache_key(query: str, top_k: int, mode: str) -> Tuple:
+    keywords = " ".join(sorted(set(analyze(query)))) or fold_accents(query).strip()
+    return (keywords, top_k, mode)
+
+
+def rag_search(db: Session, tenant_id: str, query: str, top_k: int = 3, mode: str = None, budget_ms: int = None):
+    """
+    Recherche dans la base de connaissance du tenant.
+    mode: lexical (BM25) | vector (embeddings + ivfflat) | hybrid (les deux + RRF), défaut RETRIEVAL_MODE
+    budget_ms: budget de latence du mode hybrid, défaut HYBRID_BUDGET_MS
+    Les résultats sont mis en cache (RAG_CACHE_TTL) jusqu'à la prochaine ingestion du tenant;
+    une même question posée en même temps n'est cherchée qu'une fois.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode not in ("hybrid", "vector", "lexical"):
+        raise ValueError(f"Mode de recherche inconnu: {mode}")
+    
+    def search():
+        # Un résultat hybride dégradé (budget dépassé) n'est pas mis en cache
+        if mode == "hybrid":
+            return _hybrid_search(db, tenant_id, query, top_k, budget_ms)
+        if mode == "vector":
+            return vector_search(db, tenant_id, query, top_k), True
+        return lexical_search(db, tenant_id, query, top_k), True
+    
+    with timed("rag", tenant_id):
+        results = _retrieval_cache.get_or_compute(tenant_id, _cache_key(query, top_k, mode), search)
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        _log_search(tenant_id, mode, query, results)
+    return results
+
+
+def _log_search(tenant_id, mode: str, query: str, results: List[Dict[str, Any]]) -> None:
+    sampled_debug(
+        logger, "Recherche KB",
+        tenant_id=str(tenant_id),
+        mode=mode,
+        query=query,
+        results=len(results),
+        top_chunk=results[0].get("chunk_id") if results else None,
+        top_score=results[0].get("score") if results else None,
+    )
+
+
+# ========================================
+# Version asyncio (webhooks): le SQL passe par AsyncSession.run_sync (asyncpg),
+# les appels réseau bloquants (embeddings) par un thread
+# ========================================
+
+async def _embed_query_async(query: str) -> List[float]:
+    return (await asyncio.to_thread(embed_texts, [query]))[0]
+
+
+async def _vector_search_async(db: AsyncSession, tenant_id, query: str, top_k: int):
+    query_vector = await _embed_query_async(query)
+    return await db.run_sync(vector_search, tenant_id, query, top_k, None, query_vector)
+
+
+async def _search_in_own_async_session(search_fn, bind, tenant_id, query: str, top_k: int):
+    """Une AsyncSession n'accepte pas d'opérations concurrentes: une session par retriever"""
+    async with AsyncSession(bind=bind) as session:
+        if search_fn is vector_search:
+            return await _vector_search_async(session, tenant_id, query, top_k)
+        return await session.run_sync(search_fn, tenant_id, query, top_k)
+
+
+async def _hybrid_search_async(db: AsyncSession, tenant_id, query: str, top_k: int, budget_ms: int = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """Équivalent asyncio de _hybrid_search (mêmes règles de budget et de repli)"""
+    budget = (budget_ms or HYBRID_BUDGET_MS) / 1000.0
+    candidates = top_k * HYBRID_CANDIDATES_FACTOR
+    
+    tasks = {
+        asyncio.ensure_future(_search_in_own_async_session(search_fn, db.bind, tenant_id, query, candidates)): name
+        for name, search_fn in (("lexical", lexical_search), ("vector", vector_search))
+    }
+    
+    done, pending = await asyncio.wait(tasks, timeout=budget)
+    if not done:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    
+    result_lists = []
+    errors = []
+    for task in done:
+        try:
+            result_lists.append(task.result())
+        except Exception as e:
+            errors.append(e)
+            logger.error("Recherche hybride, retriever %s en échec: %s", tasks[task], e)
+    
+    if not result_lists and pending:
+        # Le premier retriever a échoué: on se rabat sur l'autre, même hors budget
+        for task in asyncio.as_completed(pending):
+            try:
+                return await task, False
+            except Exception as e:
+                logger.error("Recherche hybride, repli en échec: %s", e)
+        return [], False
+    
+    for task in pending:
+        task.cancel()
+    
+    if not result_lists:
+        raise errors[0]
+    
+    return reciprocal_rank_fusion(result_lists, top_k), not pending and not errors
+
+
+async def rag_search_async(db: AsyncSession, tenant_id: str, query: str, top_k: int = 3, mode: str = None, budget_ms: int = None):
+    """Équivalent asyncio de rag_search (même cache, mêmes modes)"""
+    mode = mode or RETRIEVAL_MODE
+    if mode not in ("hybrid", "vector", "lexical"):
+        raise ValueError(f"Mode de recherche inconnu: {mode}")
     
-    print(f"DEBUG RAG_SEARCH: Returning {len(results)} results")
-    print(f"DEBUG RAG_SEARCH: First result = {results[0] if results else 'NONE'}")
+    async def search():
+        if mode == "hybrid":
+            return await _hybrid_search_async(db, tenant_id, query, top_k, budget_ms)
+        if mode == "vector":
+            return await _vector_search_async(db, tenant_id, query, top_k), True
+        return await db.run_sync(lexical_search, tenant_id, query, top_k), True
     
-    return results
\ No newline at end of file
+    with timed("rag", tenant_id):
+        results = await _retrieval_cache.get_or_compute_async(tenant_id, _cache_key(query, top_k, mode), search)
+    if logger.isEnabledFor(logging.DEBUG):
+        _log_search(tenant_id, mode, query, results)
+    return results
@@ -0,0 +1,123 @@
+"""
+Résolution channel / client / conversation des webhooks, mise en cache (L1 + L2 partagé entre workers)
+- adresse Twilio (To) → tenant + channel
+- (tenant, téléphone) → client
+- (tenant, channel, client) → conversation ouverte
+Cache chaud: aucune requête SQL avant l'enregistrement du message entrant.
+Cache froid: client + conversation résolus/créés en une seule requête (CTE), puis commit.
+
+Invalidation: forget_conversation() quand une conversation quitte l'état "open" (handoff),
+invalidate_channel() si un channel change; sinon expiration après RESOLUTION_CACHE_TTL secondes
+(écritures faites hors de l'app). Avec L2, les autres workers voient l'invalidation au plus
+CACHE_L1_TTL secondes plus tard.
+"""
+
+import os
+import uuid
+from typing import Any, Dict, Tuple
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from .shared_cache import SharedCache
+
+PROVIDER = "twilio"
+
+RESOLUTION_CACHE_TTL = float(os.getenv("RESOLUTION_CACHE_TTL", "300"))
+RESOLUTION_CACHE_SIZE = int(os.getenv("RESOLUTION_CACHE_SIZE", "10000"))
+
+# Un channel n'a pas encore de tenant: namespace global (tenant_id=None)
+_channels = SharedCache("channel", max_entries=1024, ttl=RESOLUTION_CACHE_TTL)
+_customers = SharedCache("customer", max_entries=RESOLUTION_CACHE_SIZE, ttl=RESOLUTION_CACHE_TTL)
+_conversations = SharedCache("conversation", max_entries=RESOLUTION_CACHE_SIZE, ttl=RESOLUTION_CACHE_TTL)
+
+
+async def resolve_channel(db: AsyncSession, to_address: str) -> Dict[str, Any]:
+    """{"tenant_id", "channel_id"} du channel actif, HTTP 404 si non configuré"""
+    key = (to_address,)
+    channel = await _channels.aget(None, key)
+    if channel is None:
+        row = (await db.execute(
+            text("""
+            SELECT id, tenant_id
+            FROM channels
+            WHERE provider = :provider AND address = :address AND is_active = true
+            LIMIT 1
+            """),
+            {"provider": PROVIDER, "address": to_address}
+        )).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Channel not configured")
+        channel = {"tenant_id": row.tenant_id, "channel_id": row.id}
+        await _channels.aset(None, key, channel)
+    return channel
+
+
+async def resolve_conversation(db: AsyncSession, tenant_id, channel_id, phone: str) -> Tuple[uuid.UUID, uuid.UUID]:
+    """(customer_id, conversation_id): client upserté + conversation ouverte (créée si besoin)"""
+    customer_id = await _customers.aget(tenant_id, (phone,))
+    if customer_id is not None:
+        conversation_id = await _conversations.aget(tenant_id, (str(channel_id), str(customer_id)))
+        if conversation_id is not None:
+            return customer_id, conversation_id
+
+    # Une seule requête: upsert client, conversation ouverte la plus récente, sinon création
+    row = (await db.execute(
+        text("""
+        WITH customer AS (
+            INSERT INTO customers (id, tenant_id, phone_e164, created_at, updated_at)
+            VALUES (:new_customer_id, :tenant_id, :phone, now(), now())
+            ON CONFLICT (tenant_id, phone_e164) DO UPDATE SET phone_e164 = EXCLUDED.phone_e164
+            RETURNING id
+        ),
+        existing AS (
+            SELECT c.id
+            FROM conversations c, customer
+            WHERE c.tenant_id = :tenant_id
+              AND c.channel_id = :channel_id
+              AND c.customer_id = customer.id
+              AND c.status = 'open'
+            ORDER BY c.created_at DESC
+            LIMIT 1
+        ),
+        created AS (
+            INSERT INTO conversations (id, tenant_id, channel_id, customer_id, status, context, created_at, updated_at)
+            SELECT :new_conversation_id, :tenant_id, :channel_id, customer.id, 'open', CAST(:context AS jsonb), now(), now()
+            FROM customer
+            WHERE NOT EXISTS (SELECT 1 FROM existing)
+            RETURNING id
+        )
+        SELECT customer.id AS customer_id,
+               COALESCE((SELECT id FROM existing), (SELECT id FROM created)) AS conversation_id
+        FROM customer
+        """),
+        {
+            "new_customer_id": uuid.uuid4(),
+            "new_conversation_id": uuid.uuid4(),
+            "tenant_id": tenant_id,
+            "channel_id": channel_id,
+            "phone": phone,
+            "context": '{"state": "INTENT"}',
+        }
+    )).one()
+    await db.commit()
+
+    await _customers.aset(tenant_id, (phone,), row.customer_id)
+    await _conversations.aset(tenant_id, (str(channel_id), str(row.customer_id)), row.conversation_id)
+    return row.customer_id, row.conversation_id
+
+
+async def forget_conversation(tenant_id, channel_id, customer_id) -> None:
+    """La conversation n'est plus ouverte: le prochain message en résout/crée une autre"""
+    await _conversations.adelete(tenant_id, (str(channel_id), str(customer_id)))
+
+
+def invalidate_channel(to_address: str) -> None:
+    _channels.delete(None, (to_address,))
+
+
+def resolution_cache_stats() -> Dict[str, Any]:
+    return {
+        "channels": _channels.stats(),
+        "customers": _customers.stats(),
+        "conversations": _conversations.stats(),
+    }
@@ -0,0 +1,529 @@
+"""
+Cache à deux niveaux partagé entre workers
+- L1: TTLCache en mémoire du process (aucun aller-retour réseau)
+- L2: serveur Redis (protocole Redis: Redis, Valkey, KeyDB...) partagé par tous les workers / dynos
+Un worker qui démarre (ou un worker de plus) trouve en L2 ce que les autres ont déjà calculé.
+
+Clés L2: {CACHE_KEY_PREFIX}:{namespace}:{tenant}:{génération}:{sha256 de la clé}
+- génération par (namespace, tenant), stockée en L2: invalidate_tenant() l'incrémente (INCR),
+  les entrées de l'ancienne génération ne sont plus lues et expirent d'elles-mêmes
+- valeurs en JSON (UUID et datetime balisés), jamais de pickle
+- protection contre les rafales (get_or_compute): un seul calcul par clé dans le process (verrou par
+  clé) et entre workers (SET NX PX sur {clé}:lock, les autres attendent le résultat en L2)
+- L2 injoignable: WARNING, puis L1 seul pendant CACHE_L2_RETRY_S secondes
+
+Sans L2 les entrées et l'invalidation restent locales, le L1 vit ttl secondes. Avec L2 une entrée
+L1 vit au plus CACHE_L1_TTL secondes (delete() sur un autre worker), comme la génération d'un tenant.
+
+CACHE_REDIS_URL (ou REDIS_URL): redis://... ; memory:// = faux serveur en mémoire (tests, benchmarks)
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", os.getenv("REDIS_URL", ""))
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "ktios")
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "10"))
+CACHE_REDIS_TIMEOUT_MS = int(os.getenv("CACHE_REDIS_TIMEOUT_MS", "100"))
+CACHE_L2_RETRY_S = float(os.getenv("CACHE_L2_RETRY_S", "5"))
+# Verrou de remplissage: durée max d'un calcul, attente max des autres workers
+CACHE_LOCK_TTL_MS = int(os.getenv("CACHE_LOCK_TTL_MS", "5000"))
+CACHE_LOCK_WAIT_MS = int(os.getenv("CACHE_LOCK_WAIT_MS", "2000"))
+CACHE_LOCK_POLL_MS = 10
+
+GLOBAL_TENANT = "global"
+
+_MISSING = object()
+_DEFAULT_L2 = object()
+
+
+# ========================================
+# Sérialisation JSON (les valeurs en cache sont des dicts / listes / UUID / dates)
+# ========================================
+
+def _encode_default(value):
+    if isinstance(value, uuid.UUID):
+        return {"$uuid": str(value)}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"{value.__class__.__name__} non sérialisable en cache")
+
+
+def _decode_object(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        if "$uuid" in obj:
+            return uuid.UUID(obj["$uuid"])
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def encode(value: Any) -> bytes:
+    """JSON compact; les tuples deviennent des listes"""
+    return json.dumps(value, default=_encode_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode(data: bytes) -> Any:
+    return json.loads(data, object_hook=_decode_object)
+
+
+# ========================================
+# L2
+# ========================================
+
+class InMemoryRedis:
+    """Faux serveur Redis en mémoire: sous-ensemble de l'API redis-py utilisé ici (get/set/delete/incr)"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Optional[float], bytes]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, name: str, now: float):
+        entry = self._data.get(name)
+        if entry is not None and entry[0] is not None and entry[0] <= now:
+            del self._data[name]
+            return None
+        return entry
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._live(name, time.monotonic())
+        return entry[1] if entry else None
+
+    def set(self, name: str, value, ex: float = None, px: int = None, nx: bool = False) -> Optional[bool]:
+        now = time.monotonic()
+        expires_at = now + ex if ex else now + px / 1000.0 if px else None
+        data = value if isinstance(value, bytes) else str(value).encode("utf-8")
+        with self._lock:
+            if nx and self._live(name, now) is not None:
+                return None
+            self._data[name] = (expires_at, data)
+        return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            entry = self._live(name, time.monotonic())
+            value = int(entry[1]) + 1 if entry else 1
+            self._data[name] = (entry[0] if entry else None, str(value).encode("utf-8"))
+        return value
+
+    def ping(self) -> bool:
+        return True
+
+
+class L2Client:
+    """
+    Client L2 tolérant aux pannes: une erreur (réseau, timeout) compte comme un défaut de cache
+    et suspend le L2 pendant CACHE_L2_RETRY_S secondes
+    """
+
+    def __init__(self, client, name: str = "redis"):
+        self.client = client
+        self.name = name
+        self.errors = 0
+        self._down_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self._down_until <= time.monotonic()
+
+    def _call(self, method: str, *args, **kwargs):
+        if self._down_until > time.monotonic():
+            return _MISSING
+        try:
+            return getattr(self.client, method)(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            self._down_until = time.monotonic() + CACHE_L2_RETRY_S
+            logger.warning("Cache L2 indisponible (%s: %s), L1 seul pendant %gs", e.__class__.__name__, e, CACHE_L2_RETRY_S)
+            return _MISSING
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._call("get", key)
+        return None if value is _MISSING else value
+
+    def set(self, key: str, data: bytes, ttl: float) -> None:
+        self._call("set", key, data, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self._call("delete", key)
+
+    def incr(self, key: str) -> Optional[int]:
+        value = self._call("incr", key)
+        return None if value is _MISSING else int(value)
+
+    def lock(self, key: str, token: str) -> bool:
+        """True si le verrou est pris (ou si le L2 ne répond pas: le calcul se fait localement)"""
+        acquired = self._call("set", key, token, px=CACHE_LOCK_TTL_MS, nx=True)
+        return acquired is _MISSING or bool(acquired)
+
+    def unlock(self, key: str, token: str) -> None:
+        # Lecture puis suppression (non atomique): au pire un verrou expiré d'un autre est retiré tôt
+        current = self.get(key)
+        if current is not None and current.decode("utf-8") == token:
+            self.delete(key)
+
+
+_default_l2: Optional[L2Client] = None
+_default_l2_loaded = False
+_default_l2_lock = threading.Lock()
+
+
+def default_l2() -> Optional[L2Client]:
+    """L2 configuré par CACHE_REDIS_URL, créé au premier usage (None = L1 seul)"""
+    global _default_l2, _default_l2_loaded
+    if not _default_l2_loaded:
+        with _default_l2_lock:
+            if not _default_l2_loaded:
+                _default_l2 = connect_l2(CACHE_REDIS_URL)
+                _default_l2_loaded = True
+    return _default_l2
+
+
+def connect_l2(url: str) -> Optional[L2Client]:
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return L2Client(InMemoryRedis(), name="memory")
+    try:
+        import redis
+    except ImportError:
+        logger.warning("Cache L2: paquet redis non installé, L1 seul")
+        return None
+    timeout = CACHE_REDIS_TIMEOUT_MS / 1000.0
+    return L2Client(redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout))
+
+
+def _tenant_key(tenant_id) -> str:
+    return GLOBAL_TENANT if tenant_id is None else str(tenant_id)
+
+
+# ========================================
+# Cache à deux niveaux
+# ========================================
+
+class SharedCache:
+    """
+    Cache L1 + L2 d'un namespace. Clés = (tenant_id, tuple de str/int); tenant_id=None pour les
+    données sans tenant (résolution d'un channel). Une valeur None n'est pas mise en cache.
+    l1_ttl: durée de vie L1 avec L2 (défaut CACHE_L1_TTL); un cache invalidé uniquement par
+    invalidate_tenant() peut garder ses entrées L1 ttl secondes (la génération suffit).
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 1024, ttl: float = 300.0, l1_ttl: float = None, l2=_DEFAULT_L2):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.l1_ttl = l1_ttl
+        self.local = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._l2 = l2 if l2 is _DEFAULT_L2 or l2 is None or isinstance(l2, L2Client) else L2Client(l2, name="memory" if isinstance(l2, InMemoryRedis) else "redis")
+        self._generations = TTLCache(max_entries=4096, ttl=CACHE_L1_TTL)
+        self._known_generations: Dict[str, int] = {}
+        self._flights: Dict[Hashable, list] = {}
+        self._flights_lock = threading.Lock()
+        self._async_flights: Dict[Hashable, list] = {}
+        self.hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.computes = 0
+        self.lock_waits = 0
+
+    @property
+    def l2(self) -> Optional[L2Client]:
+        return default_l2() if self._l2 is _DEFAULT_L2 else self._l2
+
+    def _l1_ttl(self, ttl: float) -> float:
+        if self.l2 is None:
+            return ttl
+        return min(ttl, self.l1_ttl if self.l1_ttl is not None else CACHE_L1_TTL)
+
+    # --- générations (invalidation par tenant) ---
+
+    def _generation_key(self, tenant: str) -> str:
+        return f"{CACHE_KEY_PREFIX}:{self.namespace}:{tenant}:gen"
+
+    def _cached_generation(self, tenant: str) -> Optional[int]:
+        if self.l2 is None:
+            return self._known_generations.get(tenant, 0)
+        return self._generations.get((tenant,))
+
+    def generation(self, tenant_id) -> int:
+        """Génération courante du tenant (lue en L2 au plus toutes les CACHE_L1_TTL secondes)"""
+        tenant = _tenant_key(tenant_id)
+        generation = self._cached_generation(tenant)
+        if generation is None:
+            raw = self.l2.get(self._generation_key(tenant))
+            if raw is None and not self.l2.available:
+                # L2 en panne: dernière génération connue
+                return self._known_generations.get(tenant, 0)
+            generation = int(raw) if raw is not None else 0
+            self._known_generations[tenant] = generation
+            self._generations.set((tenant,), generation)
+        return generation
+
+    async def generation_async(self, tenant_id) -> int:
+        tenant = _tenant_key(tenant_id)
+        generation = self._cached_generation(tenant)
+        if generation is None:
+            generation = await asyncio.to_thread(self.generation, tenant_id)
+        return generation
+
+    def invalidate_tenant(self, tenant_id) -> None:
+        """Toutes les entrées du tenant, dans tous les workers (au plus CACHE_L1_TTL secondes plus tard)"""
+        tenant = _tenant_key(tenant_id)
+        l2 = self.l2
+        generation = l2.incr(self._generation_key(tenant)) if l2 is not None else None
+        if generation is None:
+            if l2 is not None:
+                logger.error("Cache %s: invalidation non propagée (L2 indisponible)", self.namespace, extra={"tenant_id": tenant})
+            generation = self._known_generations.get(tenant, 0) + 1
+        self._known_generations[tenant] = generation
+        if l2 is not None:
+            self._generations.set((tenant,), generation)
+        self.local.invalidate_tenant(tenant)
+
+    # --- clés ---
+
+    def _keys_for(self, tenant_id, generation: int, key: tuple) -> Tuple[tuple, str]:
+        tenant = _tenant_key(tenant_id)
+        digest = hashlib.sha256(json.dumps(list(key), default=str, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+        return (tenant, generation) + tuple(key), f"{CACHE_KEY_PREFIX}:{self.namespace}:{tenant}:{generation}:{digest}"
+
+    def _keys(self, tenant_id, key: tuple) -> Tuple[tuple, str]:
+        return self._keys_for(tenant_id, self.generation(tenant_id), key)
+
+    async def _keys_async(self, tenant_id, key: tuple) -> Tuple[tuple, str]:
+        # Génération lue hors de l'event loop: pas de seconde lecture (bloquante) par _keys()
+        return self._keys_for(tenant_id, await self.generation_async(tenant_id), key)
+
+    # --- lecture / écriture ---
+
+    def _remote_get(self, local_key: tuple, remote_key: str) -> Any:
+        raw = self.l2.get(remote_key)
+        if raw is None:
+            return _MISSING
+        try:
+            value = decode(raw)
+        except ValueError as e:
+            logger.error("Cache %s: entrée L2 illisible (%s)", self.namespace, e)
+            return _MISSING
+        self.local.set(local_key, value, ttl=self._l1_ttl(self.ttl))
+        return value
+
+    def _count(self, value, level: str) -> None:
+        if value is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if level == "l2":
+                self.l2_hits += 1
+
+    def _lookup(self, local_key: tuple, remote_key: str, count: bool = True) -> Any:
+        value = self.local.get(local_key, _MISSING)
+        level = "l1"
+        if value is _MISSING and self.l2 is not None:
+            value, level = self._remote_get(local_key, remote_key), "l2"
+        if count:
+            self._count(value, level)
+        return value
+
+    async def _lookup_async(self, local_key: tuple, remote_key: str, count: bool = True) -> Any:
+        value = self.local.get(local_key, _MISSING)
+        level = "l1"
+        if value is _MISSING and self.l2 is not None:
+            value, level = await asyncio.to_thread(self._remote_get, local_key, remote_key), "l2"
+        if count:
+            self._count(value, level)
+        return value
+
+    def _store(self, local_key: tuple, remote_key: str, value: Any, ttl: float = None) -> None:
+        if value is None:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(local_key, value, ttl=self._l1_ttl(ttl))
+        if self.l2 is not None:
+            try:
+                data = encode(value)
+            except (TypeError, ValueError) as e:
+                logger.error("Cache %s: valeur non encodable (%s)", self.namespace, e)
+                return
+            self.l2.set(remote_key, data, ttl)
+
+    def get(self, tenant_id, key: tuple, default: Any = None) -> Any:
+        value = self._lookup(*self._keys(tenant_id, key))
+        return default if value is _MISSING else value
+
+    async def aget(self, tenant_id, key: tuple, default: Any = None) -> Any:
+        value = await self._lookup_async(*(await self._keys_async(tenant_id, key)))
+        return default if value is _MISSING else value
+
+    def set(self, tenant_id, key: tuple, value: Any, ttl: float = None) -> None:
+        self._store(*self._keys(tenant_id, key), value, ttl)
+
+    async def aset(self, tenant_id, key: tuple, value: Any, ttl: float = None) -> None:
+        local_key, remote_key = await self._keys_async(tenant_id, key)
+        if self.l2 is None:
+            self._store(local_key, remote_key, value, ttl)
+        else:
+            await asyncio.to_thread(self._store, local_key, remote_key, value, ttl)
+
+    def delete(self, tenant_id, key: tuple) -> None:
+        local_key, remote_key = self._keys(tenant_id, key)
+        self.local.delete(local_key)
+        if self.l2 is not None:
+            self.l2.delete(remote_key)
+
+    async def adelete(self, tenant_id, key: tuple) -> None:
+        if self.l2 is None:
+            self.delete(tenant_id, key)
+        else:
+            await asyncio.to_thread(self.delete, tenant_id, key)
+
+    # --- protection contre les rafales ---
+
+    @contextmanager
+    def _single_flight(self, local_key: tuple):
+        with self._flights_lock:
+            flight = self._flights.setdefault(local_key, [threading.Lock(), 0])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self._flights_lock:
+                flight[1] -= 1
+                if not flight[1]:
+                    del self._flights[local_key]
+
+    @asynccontextmanager
+    async def _single_flight_async(self, local_key: tuple):
+        flight = self._async_flights.setdefault(local_key, [asyncio.Lock(), 0])
+        flight[1] += 1
+        try:
+            async with flight[0]:
+                yield
+        finally:
+            flight[1] -= 1
+            if not flight[1]:
+                del self._async_flights[local_key]
+
+    def _wait_for_fill(self, local_key: tuple, remote_key: str) -> Any:
+        """Un autre worker calcule: on attend son résultat (ou la fin de son verrou)"""
+        self.lock_waits += 1
+        deadline = time.monotonic() + CACHE_LOCK_WAIT_MS / 1000.0
+        while time.monotonic() < deadline:
+            time.sleep(CACHE_LOCK_POLL_MS / 1000.0)
+            value = self._remote_get(local_key, remote_key)
+            if value is not _MISSING or self.l2.get(remote_key + ":lock") is None:
+                return value
+        return _MISSING
+
+    def get_or_compute(self, tenant_id, key: tuple, compute: Callable[[], Tuple[Any, bool]]) -> Any:
+        """
+        Valeur en cache, sinon compute() -> (valeur, à_mettre_en_cache).
+        Requêtes simultanées sur la même clé: un seul compute() (process et workers).
+        """
+        local_key, remote_key = self._keys(tenant_id, key)
+        value = self._lookup(local_key, remote_key)
+        if value is not _MISSING:
+            return value
+        with self._single_flight(local_key):
+            value = self._lookup(local_key, remote_key, count=False)
+            if value is not _MISSING:
+                return value
+            l2 = self.l2
+            token = uuid.uuid4().hex
+            locked = l2 is None or l2.lock(remote_key + ":lock", token)
+            if not locked:
+                value = self._wait_for_fill(local_key, remote_key)
+                if value is not _MISSING:
+                    return value
+            try:
+                value, cacheable = compute()
+                self.computes += 1
+                if cacheable:
+                    self._store(local_key, remote_key, value)
+            finally:
+                if l2 is not None and locked:
+                    l2.unlock(remote_key + ":lock", token)
+            return value
+
+    async def get_or_compute_async(self, tenant_id, key: tuple, compute) -> Any:
+        """Équivalent asyncio de get_or_compute: compute est une coroutine (async def)"""
+        local_key, remote_key = await self._keys_async(tenant_id, key)
+        value = await self._lookup_async(local_key, remote_key)
+        if value is not _MISSING:
+            return value
+        async with self._single_flight_async(local_key):
+            value = await self._lookup_async(local_key, remote_key, count=False)
+            if value is not _MISSING:
+                return value
+            l2 = self.l2
+            token = uuid.uuid4().hex
+            locked = l2 is None or await asyncio.to_thread(l2.lock, remote_key + ":lock", token)
+            if not locked:
+                value = await self._wait_for_fill_async(local_key, remote_key)
+                if value is not _MISSING:
+                    return value
+            try:
+                value, cacheable = await compute()
+                self.computes += 1
+                if cacheable:
+                    if l2 is None:
+                        self._store(local_key, remote_key, value)
+                    else:
+                        await asyncio.to_thread(self._store, local_key, remote_key, value)
+            finally:
+                if l2 is not None and locked:
+                    await asyncio.to_thread(l2.unlock, remote_key + ":lock", token)
+            return value
+
+    async def _wait_for_fill_async(self, local_key: tuple, remote_key: str) -> Any:
+        self.lock_waits += 1
+        deadline = time.monotonic() + CACHE_LOCK_WAIT_MS / 1000.0
+        while time.monotonic() < deadline:
+            await asyncio.sleep(CACHE_LOCK_POLL_MS / 1000.0)
+            value = await asyncio.to_thread(self._remote_get, local_key, remote_key)
+            if value is not _MISSING or await asyncio.to_thread(self.l2.get, remote_key + ":lock") is None:
+                return value
+        return _MISSING
+
+    def clear(self) -> None:
+        """Vide le L1 de ce process (le L2 n'est pas touché)"""
+        self.local.clear()
+        self._generations.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        l2 = self.l2
+        return {
+            "namespace": self.namespace,
+            "l2": l2.name if l2 is not None else None,
+            "entries": len(self.local),
+            "max_entries": self.local.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "l1_hits": self.hits - self.l2_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "computes": self.computes,
+            "lock_waits": self.lock_waits,
+            "evictions": self.local.evictions,
+            "l2_errors": l2.errors if l2 is not None else 0,
+        }
@@ -0,0 +1,55 @@
+"""
+Outils de streaming des réponses LLM
+- SentenceSplitter: découpe le flux de tokens en phrases complètes (synthèse vocale dès la 1re phrase)
+- sse_event: formatage Server-Sent Events
+"""
+
+import os
+import re
+import json
+from typing import Any, Dict, List
+
+# Longueur min d'une phrase émise seule ("Oui." est regroupé avec la suivante)
+SENTENCE_MIN_CHARS = int(os.getenv("SENTENCE_MIN_CHARS", "12"))
+
+# Fin de phrase: ponctuation (+ guillemet/parenthèse fermante) suivie d'un blanc, ou saut de ligne.
+# Le blanc est exigé: "12.50$" ou "17h..." en cours de flux ne coupent pas.
+_SENTENCE_END = re.compile(r'[.!?…]+["»)\]]*\s+|\n+')
+
+
+class SentenceSplitter:
+    """Accumule les deltas de texte et rend les phrases dès qu'elles sont terminées"""
+
+    def __init__(self, min_chars: int = SENTENCE_MIN_CHARS):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self.buffer += delta
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self.buffer):
+            candidate = self.buffer[start:match.end()].strip()
+            if len(candidate) >= self.min_chars:
+                sentences.append(candidate)
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> str:
+        """Reste du texte (dernière phrase sans ponctuation finale)"""
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest
+
+
+def split_sentences(value: str, min_chars: int = SENTENCE_MIN_CHARS) -> List[str]:
+    splitter = SentenceSplitter(min_chars)
+    sentences = splitter.feed(value)
+    rest = splitter.flush()
+    return sentences + [rest] if rest else sentences
+
+
+def sse_event(data: Dict[str, Any], event: str = None) -> str:
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,71 @@
+"""
+Réglages par tenant (table tenant_settings), mis en cache en mémoire
+Un tenant sans ligne dans tenant_settings utilise les valeurs par défaut (variables d'environnement)
+Fuseau horaire: tenants.timezone (heures murales des réservations, voir availability.py)
+"""
+
+import os
+import uuid
+import logging
+from typing import Dict, Any
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from .rag import RETRIEVAL_MODE, HYBRID_BUDGET_MS
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+TENANT_SETTINGS_TTL = float(os.getenv("TENANT_SETTINGS_TTL", "60"))
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "retrieval_mode": RETRIEVAL_MODE,
+    "retrieval_budget_ms": HYBRID_BUDGET_MS,
+    # Réservations (voir availability.py)
+    "max_capacity": int(os.getenv("DEFAULT_MAX_CAPACITY", "80")),
+    "max_concurrent_reservations": int(os.getenv("DEFAULT_MAX_CONCURRENT_RESERVATIONS", "15")),
+    "first_seating_hour": 11,
+    "last_seating_hour": 23,
+    "reservation_window_minutes": 120,
+    "timezone": os.getenv("DEFAULT_TIMEZONE", "America/Montreal"),
+}
+
+_settings_cache = TTLCache(max_entries=1024, ttl=TENANT_SETTINGS_TTL)
+
+
+def _load_tenant_settings(db: Session, tenant_id: str) -> Dict[str, Any]:
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        # SAVEPOINT: une table absente (migration non appliquée) ne doit pas casser la transaction
+        with db.begin_nested():
+            row = db.execute(
+                text("""
+                SELECT t.timezone, s.retrieval_mode, s.retrieval_budget_ms,
+                       s.max_capacity, s.max_concurrent_reservations,
+                       s.first_seating_hour, s.last_seating_hour, s.reservation_window_minutes
+                FROM tenants t
+                LEFT JOIN tenant_settings s ON s.tenant_id = t.id
+                WHERE t.id = :tenant_id
+                """),
+                {"tenant_id": uuid.UUID(tenant_id)}
+            ).mappings().first()
+    except Exception as e:
+        logger.error("Lecture des réglages du tenant en échec: %s", e, extra={"tenant_id": tenant_id})
+        row = None
+
+    if row:
+        settings.update({k: v for k, v in row.items() if v is not None})
+    return settings
+
+
+def get_tenant_settings(db: Session, tenant_id) -> Dict[str, Any]:
+    """Réglages du tenant (relus au plus toutes les TENANT_SETTINGS_TTL secondes)"""
+    key = (str(tenant_id),)
+    settings = _settings_cache.get(key)
+    if settings is None:
+        settings = _load_tenant_settings(db, key[0])
+        _settings_cache.set(key, settings)
+    return settings
+
+
+def tenant_settings_cache_stats() -> Dict[str, Any]:
+    return _settings_cache.stats()
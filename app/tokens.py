@@ -0,0 +1,51 @@
+"""
+Comptage de tokens (tiktoken, encodage de gpt-4o-mini)
+Si l'encodage n'est pas disponible (pas de réseau au premier chargement), on retombe sur une estimation.
+"""
+
+import os
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """Encodage tiktoken chargé une seule fois (None si indisponible)"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+                except Exception as e:
+                    logger.warning("tiktoken indisponible (%s), estimation du nombre de tokens", e)
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def tokenizer_name() -> str:
+    """Compteur de tokens en usage: nom de l'encodage tiktoken, ou "estimate" pour l'estimation"""
+    encoding = get_encoding()
+    return encoding.name if encoding is not None else "estimate"
+
+
+def count_tokens(value: str) -> int:
+    if not value:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(value, disallowed_special=()))
+    # Estimation: ~1,3 token par mot/ponctuation en français
+    return int(len(_WORD_RE.findall(value)) * 1.3) + 1
@@ -5,19 +5,40 @@ Boucle complète: LLM → tool call → execution → résultat → LLM → rép
 
 import os
 import json
+import time
+import asyncio
+import contextvars
 import requests
-from typing import Dict, Any, List
-from openai import OpenAI
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, Any, List, AsyncIterator
+from datetime import datetime
 from sqlalchemy import text
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from .streaming import SentenceSplitter
+from .availability import ACTIVE_STATUSES, check_availability, find_available_slots, invalidate_availability, record_reservation_change
+from .booking import book_reservation, update_reservation
+from .transactions import release_connection, release_connection_async
+from .prompt_cache import assemble_messages, cache_params, record_usage, static_prefix, summarize_usage
+from .llm_gateway import LLMUnavailable, chat, achat, astream, kb_fallback_reply
+from .metrics import timed, observe_stage, record_agent_turn, record_llm_fallback
 
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", ""))
 
 # Base URL de tes endpoints internes (local dev ou production)
 INTERNAL_API_BASE = os.getenv("INTERNAL_API_BASE", "http://localhost:8000")
 
+# Tools sans écriture: quand le LLM en demande plusieurs d'affilée, ils tournent en parallèle
+# (chacun dans sa propre session). Les tools d'écriture restent exécutés un par un, dans l'ordre.
+READ_ONLY_TOOLS = {"check_availability"}
+# Label "stage" des métriques: un nom inventé par le LLM ne crée pas de nouvelle série
+TOOL_NAMES = {"check_availability", "create_reservation", "modify_reservation", "cancel_reservation", "handoff_to_human"}
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "4"))
+
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tools")
+_tool_semaphore = asyncio.Semaphore(TOOL_WORKERS)
+
 
 class ToolExecutor:
     """
@@ -35,6 +56,11 @@ class ToolExecutor:
         Route et exécute le tool approprié.
         Retourne le résultat sous forme de dict.
         """
+        stage = f"tool:{tool_name}" if tool_name in TOOL_NAMES else "tool:unknown"
+        with timed(stage, self.tenant_id):
+            return self._route_tool(tool_name, arguments)
+    
+    def _route_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
         if tool_name == "check_availability":
             return self._check_availability(arguments)
         
@@ -56,77 +82,10 @@ class ToolExecutor:
     def _check_availability(self, args: Dict[str, Any]) -> Dict[str, Any]:
         """
         Vérifie la disponibilité pour une réservation.
-        Pour MVP: logique simple (heures d'ouverture + capacité max).
+        Heures de service + capacité du tenant (tenant_settings), via l'index d'occupation en mémoire.
         """
         try:
-            start_time_str = args.get("start_time")
-            party_size = args.get("party_size")
-            
-            # Parse datetime
-            start_time = datetime.fromisoformat(start_time_str.replace('Z', '+00:00'))
-            
-            # 1) Vérifier heures d'ouverture (simplifié - à adapter selon tenant_settings)
-            hour = start_time.hour
-            day_of_week = start_time.strftime("%A").lower()
-            
-            # Pour MVP: ouvert 11h-02h tous les jours (adapter selon ta KB)
-            if hour < 11 or hour > 23:
-                return {
-                    "available": False,
-                    "reason": "en_dehors_heures",
-                    "suggestions": [
-                        (start_time.replace(hour=18, minute=0)).isoformat(),
-                        (start_time.replace(hour=19, minute=0)).isoformat(),
-                        (start_time.replace(hour=20, minute=0)).isoformat(),
-                    ]
-                }
-            
-            # 2) Vérifier capacité (simplifié - checker réservations existantes)
-            existing = self.db.execute(
-                text("""
-                SELECT COUNT(*) as cnt, COALESCE(SUM(party_size), 0) as total_guests
-                FROM reservations
-                WHERE tenant_id = :tenant_id
-                  AND status IN ('confirmed', 'pending')
-                  AND start_time BETWEEN :start - INTERVAL '2 hours' AND :start + INTERVAL '2 hours'
-                """),
-                {"tenant_id": self.tenant_id, "start": start_time}
-            ).mappings().first()
-            
-            # Capacité max (à mettre dans tenant_settings plus tard)
-            MAX_CAPACITY = 80
-            MAX_CONCURRENT_RESERVATIONS = 15
-            
-            total_guests = existing["total_guests"] or 0
-            total_reservations = existing["cnt"] or 0
-            
-            if total_guests + party_size > MAX_CAPACITY:
-                return {
-                    "available": False,
-                    "reason": "capacité_atteinte",
-                    "suggestions": [
-                        (start_time + timedelta(hours=1)).isoformat(),
-                        (start_time + timedelta(hours=2)).isoformat(),
-                    ]
-                }
-            
-            if total_reservations >= MAX_CONCURRENT_RESERVATIONS:
-                return {
-                    "available": False,
-                    "reason": "trop_réservations_simultanées",
-                    "suggestions": [
-                        (start_time + timedelta(minutes=30)).isoformat(),
-                        (start_time + timedelta(hours=1)).isoformat(),
-                    ]
-                }
-            
-            # Disponible !
-            return {
-                "available": True,
-                "start_time": start_time.isoformat(),
-                "party_size": party_size,
-                "current_occupancy": total_guests,
-            }
+            return check_availability(self.db, self.tenant_id, args.get("start_time"), args.get("party_size"))
         
         except Exception as e:
             return {"error": f"Erreur check_availability: {str(e)}"}
@@ -180,30 +139,26 @@ class ToolExecutor:
                 }
             ).scalar_one()
             
-            # Créer réservation
-            reservation_id = self.db.execute(
-                text("""
-                INSERT INTO reservations (
-                    id, tenant_id, customer_id, source_conversation_id,
-                    party_size, start_time, status, notes, created_at, updated_at
-                )
-                VALUES (
-                    uuid_generate_v4(), :tenant_id, :customer_id, :conversation_id,
-                    :party_size, :start_time, 'confirmed', :notes, now(), now()
-                )
-                RETURNING id
-                """),
-                {
-                    "tenant_id": self.tenant_id,
-                    "customer_id": str(customer_id),
-                    "conversation_id": self.conversation_id,
-                    "party_size": party_size,
-                    "start_time": start_time,
-                    "notes": notes,
+            # Client enregistré à part: une réservation refusée ou rejouée ne l'annule pas
+            self.db.commit()
+            
+            # Créer réservation: capacité revérifiée sous verrou (booking.py)
+            booking = book_reservation(
+                self.db, self.tenant_id, str(customer_id), self.conversation_id,
+                start_time, party_size, notes
+            )
+            
+            if not booking["success"]:
+                # L'index en mémoire était en retard (réservation d'un autre process): on le recharge
+                invalidate_availability(self.tenant_id)
+                return {
+                    "success": False,
+                    "error": "Créneau devenu indisponible",
+                    "suggestions": find_available_slots(self.db, self.tenant_id, start_time, party_size)
                 }
-            ).scalar_one()
             
-            self.db.commit()
+            reservation_id = booking["reservation_id"]
+            record_reservation_change(self.tenant_id, new=(booking["local_start"], party_size), written_at=booking["written_at"])
             
             # TODO: Créer événement Google Calendar ici (optionnel MVP)
             
@@ -230,7 +185,7 @@ class ToolExecutor:
             
             # Build UPDATE dynamically
             set_clauses = []
-            params = {"reservation_id": reservation_id, "tenant_id": self.tenant_id}
+            params = {}
             
             if "start_time" in changes:
                 set_clauses.append("start_time = :new_start_time")
@@ -253,21 +208,28 @@ class ToolExecutor:
             
             set_clauses.append("updated_at = now()")
             
-            query = f"""
-            UPDATE reservations
-            SET {", ".join(set_clauses)}
-            WHERE id = :reservation_id AND tenant_id = :tenant_id
-            RETURNING id
-            """
-            
-            result = self.db.execute(text(query), params).scalar_one_or_none()
+            # Capacité revérifiée sous verrou si l'heure ou le nombre de couverts change (booking.py)
+            outcome = update_reservation(self.db, self.tenant_id, reservation_id, set_clauses, params)
             
-            if not result:
-                return {"success": False, "error": "Réservation non trouvée"}
+            if not outcome["success"]:
+                if outcome["reason"] == "introuvable":
+                    return {"success": False, "error": "Réservation non trouvée"}
+                invalidate_availability(self.tenant_id)
+                return {
+                    "success": False,
+                    "error": "Créneau indisponible pour cette modification",
+                    "reason": outcome["reason"],
+                }
             
-            self.db.commit()
+            result = outcome["row"]
+            record_reservation_change(
+                self.tenant_id,
+                old=(result["old_start"], result["old_party_size"]) if result["old_status"] in ACTIVE_STATUSES else None,
+                new=(result["new_start"], result["new_party_size"]) if result["new_status"] in ACTIVE_STATUSES else None,
+                written_at=outcome["written_at"],
+            )
             
-            return {"success": True, "reservation_id": str(result)}
+            return {"success": True, "reservation_id": str(result["id"])}
         
         except Exception as e:
             self.db.rollback()
@@ -281,22 +243,20 @@ class ToolExecutor:
             reservation_id = args.get("reservation_id")
             reason = args.get("reason", "Annulée par le client")
             
-            result = self.db.execute(
-                text("""
-                UPDATE reservations
-                SET status = 'cancelled', notes = COALESCE(notes || E'\n', '') || :reason, updated_at = now()
-                WHERE id = :reservation_id AND tenant_id = :tenant_id
-                RETURNING id
-                """),
-                {"reservation_id": reservation_id, "tenant_id": self.tenant_id, "reason": f"Annulation: {reason}"}
-            ).scalar_one_or_none()
+            outcome = update_reservation(
+                self.db, self.tenant_id, reservation_id,
+                ["status = :new_status", "notes = COALESCE(r.notes || E'\\n', '') || :reason", "updated_at = now()"],
+                {"new_status": "cancelled", "reason": f"Annulation: {reason}"}
+            )
             
-            if not result:
+            if not outcome["success"]:
                 return {"success": False, "error": "Réservation non trouvée"}
             
-            self.db.commit()
+            result = outcome["row"]
+            if result["old_status"] in ACTIVE_STATUSES:
+                record_reservation_change(self.tenant_id, old=(result["old_start"], result["old_party_size"]), written_at=outcome["written_at"])
             
-            return {"success": True, "reservation_id": str(result), "status": "cancelled"}
+            return {"success": True, "reservation_id": str(result["id"]), "status": "cancelled"}
         
         except Exception as e:
             self.db.rollback()
@@ -354,6 +314,199 @@ class ToolExecutor:
             return {"success": False, "error": f"Erreur handoff: {str(e)}"}
 
 
+def _build_messages(system_prompt: str, kb_chunks: List[Dict[str, Any]], user_text: str, history: List[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+    # Build KB context (rag_search retourne le texte dans chunk_text)
+    kb_context = "\n".join([
+        f"[{i+1}] {c.get('chunk_text', '')}"
+        for i, c in enumerate(kb_chunks[:5])
+    ]) if kb_chunks else "Aucune information dans la base de connaissance."
+    
+    # Préfixe statique (prompt système) d'abord: la KB du tour vient après l'historique
+    return assemble_messages(system_prompt, history, [f"BASE DE CONNAISSANCE:\n{kb_context}"], user_text)
+
+
+def _assistant_tool_calls_message(message) -> Dict[str, Any]:
+    return {
+        "role": "assistant",
+        "content": message.content,
+        "tool_calls": [
+            {
+                "id": tc.id,
+                "type": "function",
+                "function": {
+                    "name": tc.function.name,
+                    "arguments": tc.function.arguments
+                }
+            }
+            for tc in message.tool_calls
+        ]
+    }
+
+
+def _prepare_tool_args(tool_call, tenant_id: str, conversation_id: str) -> Dict[str, Any]:
+    tool_name = tool_call.function.name
+    tool_args = json.loads(tool_call.function.arguments)
+    
+    # Injecter automatiquement tenant_id et conversation_id si manquants
+    if "tenant_id" not in tool_args:
+        tool_args["tenant_id"] = tenant_id
+    if "conversation_id" not in tool_args and tool_name == "handoff_to_human":
+        tool_args["conversation_id"] = conversation_id
+    if "source_conversation_id" not in tool_args and tool_name == "create_reservation":
+        tool_args["source_conversation_id"] = conversation_id
+    return tool_args
+
+
+def _record_tool_result(messages: List[Dict[str, Any]], tool_calls_made: List[Dict[str, Any]], tool_call, tool_args: Dict[str, Any], result: Dict[str, Any]):
+    tool_calls_made.append({
+        "name": tool_call.function.name,
+        "arguments": tool_args,
+        "result": result,
+    })
+    
+    # Ajouter résultat aux messages
+    messages.append({
+        "role": "tool",
+        "tool_call_id": tool_call.id,
+        "name": tool_call.function.name,
+        "content": json.dumps(result, ensure_ascii=False)
+    })
+
+
+def _tool_batches(tool_calls) -> List[List[Any]]:
+    """
+    Découpe les tool calls en lots exécutables: les tools lecture seule consécutifs forment un lot,
+    chaque tool d'écriture est seul dans le sien. Un check_availability demandé après une
+    création voit donc bien la réservation créée.
+    """
+    batches = []
+    for tool_call in tool_calls:
+        read_only = tool_call.function.name in READ_ONLY_TOOLS
+        if read_only and batches and batches[-1][0].function.name in READ_ONLY_TOOLS:
+            batches[-1].append(tool_call)
+        else:
+            batches.append([tool_call])
+    return batches
+
+
+def _execute_tool_in_own_session(bind, tenant_id: str, conversation_id: str, customer_phone: str, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
+    """Une Session SQLAlchemy n'est pas thread-safe: une session par tool parallèle"""
+    session = Session(bind=bind)
+    try:
+        return ToolExecutor(session, tenant_id, conversation_id, customer_phone).execute_tool(tool_name, tool_args)
+    finally:
+        session.close()
+
+
+def _run_tool_calls(db: Session, executor: ToolExecutor, tool_calls, tenant_id: str, conversation_id: str, customer_phone: str) -> List[tuple]:
+    """Exécute les tool calls d'un tour, retourne [(tool_call, args, résultat)] dans l'ordre du LLM"""
+    outcomes = []
+    for batch in _tool_batches(tool_calls):
+        prepared = [(tool_call, _prepare_tool_args(tool_call, tenant_id, conversation_id)) for tool_call in batch]
+        
+        if len(prepared) == 1:
+            tool_call, tool_args = prepared[0]
+            outcomes.append((tool_call, tool_args, executor.execute_tool(tool_call.function.name, tool_args)))
+            continue
+        
+        bind = db.get_bind()
+        futures = [
+            _tool_pool.submit(
+                contextvars.copy_context().run,
+                _execute_tool_in_own_session, bind, tenant_id, conversation_id, customer_phone,
+                tool_call.function.name, tool_args
+            )
+            for tool_call, tool_args in prepared
+        ]
+        outcomes.extend(
+            (tool_call, tool_args, future.result())
+            for (tool_call, tool_args), future in zip(prepared, futures)
+        )
+    return outcomes
+
+
+async def _execute_tool_in_own_async_session(bind, tenant_id: str, conversation_id: str, customer_phone: str, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
+    """Une AsyncSession n'accepte pas d'opérations concurrentes: une session par tool parallèle"""
+    async with _tool_semaphore:
+        async with AsyncSession(bind=bind) as session:
+            return await session.run_sync(
+                lambda sync_session: ToolExecutor(sync_session, tenant_id, conversation_id, customer_phone)
+                .execute_tool(tool_name, tool_args)
+            )
+
+
+async def _run_tool_calls_async(db: AsyncSession, tool_calls, tenant_id: str, conversation_id: str, customer_phone: str) -> List[tuple]:
+    """Équivalent asyncio de _run_tool_calls"""
+    outcomes = []
+    for batch in _tool_batches(tool_calls):
+        prepared = [(tool_call, _prepare_tool_args(tool_call, tenant_id, conversation_id)) for tool_call in batch]
+        
+        if len(prepared) == 1:
+            tool_call, tool_args = prepared[0]
+            result = await db.run_sync(
+                lambda session: ToolExecutor(session, tenant_id, conversation_id, customer_phone)
+                .execute_tool(tool_call.function.name, tool_args)
+            )
+            outcomes.append((tool_call, tool_args, result))
+            continue
+        
+        results = await asyncio.gather(*(
+            _execute_tool_in_own_async_session(
+                db.bind, tenant_id, conversation_id, customer_phone, tool_call.function.name, tool_args
+            )
+            for tool_call, tool_args in prepared
+        ))
+        outcomes.extend((tool_call, tool_args, result) for (tool_call, tool_args), result in zip(prepared, results))
+    return outcomes
+
+
+def _final_result(choice, tool_calls_made: List[Dict[str, Any]], iteration: int, kb_chunks: List[Dict[str, Any]], usage: Dict[str, Any]) -> Dict[str, Any]:
+    record_agent_turn(iteration, choice.finish_reason)
+    return {
+        "reply_text": choice.message.content or "",
+        "tool_calls_made": tool_calls_made,
+        "finish_reason": choice.finish_reason,
+        "debug": {
+            "iterations": iteration,
+            "kb_chunks_used": len(kb_chunks),
+            "usage": usage,
+        }
+    }
+
+
+TECHNICAL_DIFFICULTY_REPLY = "Je rencontre une difficulté technique. Un membre de l'équipe va vous contacter."
+
+
+def _max_iterations_result(tool_calls_made: List[Dict[str, Any]], iteration: int, usage: Dict[str, Any]) -> Dict[str, Any]:
+    record_agent_turn(iteration, "max_iterations")
+    return {
+        "reply_text": TECHNICAL_DIFFICULTY_REPLY,
+        "tool_calls_made": tool_calls_made,
+        "finish_reason": "max_iterations",
+        "debug": {"iterations": iteration, "usage": usage}
+    }
+
+
+def _fallback_result(error: LLMUnavailable, tool_calls_made: List[Dict[str, Any]], iteration: int, kb_chunks: List[Dict[str, Any]], usage: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    LLM indisponible (llm_gateway): extrait de la KB. Si des tools ont déjà tourné, leur issue ne peut
+    pas être formulée sans LLM: message de prise en charge par l'équipe
+    """
+    record_llm_fallback("tools", error.reason)
+    record_agent_turn(iteration, "fallback")
+    return {
+        "reply_text": TECHNICAL_DIFFICULTY_REPLY if tool_calls_made else kb_fallback_reply(kb_chunks),
+        "tool_calls_made": tool_calls_made,
+        "finish_reason": "fallback",
+        "debug": {
+            "iterations": iteration,
+            "kb_chunks_used": len(kb_chunks),
+            "usage": usage,
+            "fallback": error.reason,
+        }
+    }
+
+
 def execute_agent_with_tools(
     db: Session,
     tenant_id: str,
@@ -362,7 +515,8 @@ def execute_agent_with_tools(
     user_text: str,
     kb_chunks: List[Dict[str, Any]],
     system_prompt: str,
-    max_iterations: int = 3
+    max_iterations: int = 3,
+    history: List[Dict[str, str]] = None
 ) -> Dict[str, Any]:
     """
     Boucle complète d'exécution:
@@ -374,6 +528,7 @@ def execute_agent_with_tools(
     
     Args:
         max_iterations: nombre max de boucles tool (évite boucles infinies)
+        history: messages précédents de la conversation (history.get_history), sans le message courant
     
     Returns:
         {
@@ -387,99 +542,250 @@ def execute_agent_with_tools(
     from .prompts import TOOLS  # Import depuis ton fichier prompts.py
     
     executor = ToolExecutor(db, tenant_id, conversation_id, customer_phone)
+    messages = _build_messages(system_prompt, kb_chunks, user_text, history)
     
-    # Build KB context
-    kb_context = "\n".join([
-        f"[{i+1}] {c.get('content', '')}"
-        for i, c in enumerate(kb_chunks[:5])
-    ]) if kb_chunks else "Aucune information dans la base de connaissance."
-    
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "system", "content": f"BASE DE CONNAISSANCE:\n{kb_context}"},
-        {"role": "user", "content": user_text}
-    ]
-    
+    prefix = static_prefix(system_prompt, TOOLS)
+    usage_calls = []
     tool_calls_made = []
     iteration = 0
     
     while iteration < max_iterations:
         iteration += 1
         
-        # Appel LLM
-        response = client.chat.completions.create(
-            model=CHAT_MODEL,
-            messages=messages,
-            tools=TOOLS,
-            tool_choice="auto",
-            temperature=0.2,
-        )
+        # Appel LLM (connexion rendue au pool pendant la génération)
+        release_connection(db)
+        try:
+            with timed("llm"):
+                response = chat(
+                    "tools",
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    tools=TOOLS,
+                    tool_choice="auto",
+                    temperature=0.2,
+                    **cache_params(),
+                )
+        except LLMUnavailable as e:
+            return _fallback_result(e, tool_calls_made, iteration, kb_chunks, summarize_usage(usage_calls, prefix))
+        usage_calls.append(record_usage("tools", response.usage))
         
         choice = response.choices[0]
         message = choice.message
         
         # Si pas de tool calls → réponse finale
         if not message.tool_calls:
-            return {
-                "reply_text": message.content or "",
-                "tool_calls_made": tool_calls_made,
-                "finish_reason": choice.finish_reason,
-                "debug": {
-                    "iterations": iteration,
-                    "kb_chunks_used": len(kb_chunks),
-                }
-            }
+            return _final_result(choice, tool_calls_made, iteration, kb_chunks, summarize_usage(usage_calls, prefix))
         
         # Exécuter les tools
-        messages.append({
-            "role": "assistant",
-            "content": message.content,
-            "tool_calls": [
-                {
-                    "id": tc.id,
-                    "type": "function",
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments
-                    }
-                }
-                for tc in message.tool_calls
-            ]
-        })
+        messages.append(_assistant_tool_calls_message(message))
         
-        for tool_call in message.tool_calls:
-            tool_name = tool_call.function.name
-            tool_args = json.loads(tool_call.function.arguments)
-            
-            # Injecter automatiquement tenant_id et conversation_id si manquants
-            if "tenant_id" not in tool_args:
-                tool_args["tenant_id"] = tenant_id
-            if "conversation_id" not in tool_args and tool_name == "handoff_to_human":
-                tool_args["conversation_id"] = conversation_id
-            if "source_conversation_id" not in tool_args and tool_name == "create_reservation":
-                tool_args["source_conversation_id"] = conversation_id
-            
-            # Exécuter
-            result = executor.execute_tool(tool_name, tool_args)
-            
-            tool_calls_made.append({
-                "name": tool_name,
-                "arguments": tool_args,
-                "result": result,
-            })
-            
-            # Ajouter résultat aux messages
-            messages.append({
-                "role": "tool",
-                "tool_call_id": tool_call.id,
-                "name": tool_name,
-                "content": json.dumps(result, ensure_ascii=False)
-            })
+        for tool_call, tool_args, result in _run_tool_calls(db, executor, message.tool_calls, tenant_id, conversation_id, customer_phone):
+            _record_tool_result(messages, tool_calls_made, tool_call, tool_args, result)
     
     # Max iterations atteint (safeguard)
-    return {
-        "reply_text": "Je rencontre une difficulté technique. Un membre de l'équipe va vous contacter.",
-        "tool_calls_made": tool_calls_made,
-        "finish_reason": "max_iterations",
-        "debug": {"iterations": iteration}
-    }
+    return _max_iterations_result(tool_calls_made, iteration, summarize_usage(usage_calls, prefix))
+
+
+async def execute_agent_with_tools_async(
+    db: AsyncSession,
+    tenant_id: str,
+    conversation_id: str,
+    customer_phone: str,
+    user_text: str,
+    kb_chunks: List[Dict[str, Any]],
+    system_prompt: str,
+    max_iterations: int = 3,
+    history: List[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """
+    Équivalent asyncio de execute_agent_with_tools:
+    - appels LLM via AsyncOpenAI (l'event loop reste libre pendant l'attente)
+    - tools exécutés par ToolExecutor à travers AsyncSession.run_sync (SQL asyncpg)
+    """
+    
+    from .prompts import TOOLS
+    
+    messages = _build_messages(system_prompt, kb_chunks, user_text, history)
+    
+    prefix = static_prefix(system_prompt, TOOLS)
+    usage_calls = []
+    tool_calls_made = []
+    iteration = 0
+    
+    while iteration < max_iterations:
+        iteration += 1
+        
+        await release_connection_async(db)
+        try:
+            with timed("llm"):
+                response = await achat(
+                    "tools",
+                    model=CHAT_MODEL,
+                    messages=messages,
+                    tools=TOOLS,
+                    tool_choice="auto",
+                    temperature=0.2,
+                    **cache_params(),
+                )
+        except LLMUnavailable as e:
+            return _fallback_result(e, tool_calls_made, iteration, kb_chunks, summarize_usage(usage_calls, prefix))
+        usage_calls.append(record_usage("tools", response.usage))
+        
+        choice = response.choices[0]
+        message = choice.message
+        
+        if not message.tool_calls:
+            return _final_result(choice, tool_calls_made, iteration, kb_chunks, summarize_usage(usage_calls, prefix))
+        
+        messages.append(_assistant_tool_calls_message(message))
+        
+        for tool_call, tool_args, result in await _run_tool_calls_async(db, message.tool_calls, tenant_id, conversation_id, customer_phone):
+            _record_tool_result(messages, tool_calls_made, tool_call, tool_args, result)
+    
+    return _max_iterations_result(tool_calls_made, iteration, summarize_usage(usage_calls, prefix))
+
+
+def _merge_tool_call_deltas(pending: Dict[int, Dict[str, str]], deltas) -> List[str]:
+    """Fusionne les fragments de tool calls du flux, retourne les noms de tools nouvellement détectés"""
+    detected = []
+    for delta in deltas:
+        call = pending.setdefault(delta.index, {"id": "", "name": "", "arguments": ""})
+        if delta.id:
+            call["id"] = delta.id
+        function = delta.function
+        if function and function.name:
+            if not call["name"]:
+                detected.append(function.name)
+            call["name"] += function.name
+        if function and function.arguments:
+            call["arguments"] += function.arguments
+    return detected
+
+
+def _streamed_tool_calls(pending: Dict[int, Dict[str, str]]) -> List[SimpleNamespace]:
+    """Tool calls reconstitués, même forme que message.tool_calls d'une réponse complète"""
+    return [
+        SimpleNamespace(
+            id=call["id"],
+            function=SimpleNamespace(name=call["name"], arguments=call["arguments"] or "{}")
+        )
+        for _, call in sorted(pending.items())
+    ]
+
+
+async def stream_agent_with_tools_async(
+    db: AsyncSession,
+    tenant_id: str,
+    conversation_id: str,
+    customer_phone: str,
+    user_text: str,
+    kb_chunks: List[Dict[str, Any]],
+    system_prompt: str,
+    max_iterations: int = 3,
+    history: List[Dict[str, str]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Variante streaming de execute_agent_with_tools_async: la complétion est consommée token par token.
+    
+    Événements produits:
+        {"type": "sentence", "text": str}   phrase complète, dès qu'elle est disponible
+        {"type": "tool_call", "name": str}  tool détecté dès que son nom apparaît dans le flux
+        {"type": "done", "result": dict}    même contrat que execute_agent_with_tools
+    """
+    
+    from .prompts import TOOLS
+    
+    messages = _build_messages(system_prompt, kb_chunks, user_text, history)
+    
+    prefix = static_prefix(system_prompt, TOOLS)
+    usage_calls = []
+    tool_calls_made = []
+    iteration = 0
+    
+    while iteration < max_iterations:
+        iteration += 1
+        
+        await release_connection_async(db)
+        llm_started = time.perf_counter()
+        first_token = True
+        try:
+            stream = await astream(
+                "tools",
+                model=CHAT_MODEL,
+                messages=messages,
+                tools=TOOLS,
+                tool_choice="auto",
+                temperature=0.2,
+                stream_options={"include_usage": True},
+                **cache_params(),
+            )
+        except LLMUnavailable as e:
+            result = _fallback_result(e, tool_calls_made, iteration, kb_chunks, summarize_usage(usage_calls, prefix))
+            yield {"type": "sentence", "text": result["reply_text"]}
+            yield {"type": "done", "result": result}
+            return
+        
+        splitter = SentenceSplitter()
+        content_parts = []
+        pending_calls = {}
+        finish_reason = None
+        stream_usage = None
+        spoken = False
+        
+        try:
+            async for chunk in stream:
+                # Dernier fragment (include_usage): usage de l'appel, sans choices
+                if getattr(chunk, "usage", None):
+                    stream_usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                delta = choice.delta
+                if first_token and (delta.content or delta.tool_calls):
+                    first_token = False
+                    observe_stage("llm_first_token", time.perf_counter() - llm_started)
+                
+                if delta.tool_calls:
+                    for name in _merge_tool_call_deltas(pending_calls, delta.tool_calls):
+                        yield {"type": "tool_call", "name": name}
+                
+                if delta.content:
+                    content_parts.append(delta.content)
+                    # Texte d'une itération à tools: pas de flush (ce n'est pas la réponse finale)
+                    if not pending_calls:
+                        for sentence in splitter.feed(delta.content):
+                            spoken = True
+                            yield {"type": "sentence", "text": sentence}
+                
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        except LLMUnavailable as e:
+            # Flux coupé: repli si rien n'a encore été dit, sinon la réponse s'arrête à ce qui a été envoyé
+            if not spoken:
+                result = _fallback_result(e, tool_calls_made, iteration, kb_chunks, summarize_usage(usage_calls, prefix))
+                yield {"type": "sentence", "text": result["reply_text"]}
+                yield {"type": "done", "result": result}
+                return
+            finish_reason, pending_calls = "interrupted", {}
+        
+        # Durée du flux complet (inclut le temps de consommation des phrases par l'appelant)
+        observe_stage("llm", time.perf_counter() - llm_started)
+        content = "".join(content_parts)
+        usage_calls.append(record_usage("tools", stream_usage))
+        
+        # Pas de tool calls → réponse finale
+        if not pending_calls:
+            rest = splitter.flush()
+            if rest:
+                yield {"type": "sentence", "text": rest}
+            final_choice = SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)
+            yield {"type": "done", "result": _final_result(final_choice, tool_calls_made, iteration, kb_chunks, summarize_usage(usage_calls, prefix))}
+            return
+        
+        tool_calls = _streamed_tool_calls(pending_calls)
+        messages.append(_assistant_tool_calls_message(SimpleNamespace(content=content or None, tool_calls=tool_calls)))
+        
+        for tool_call, tool_args, result in await _run_tool_calls_async(db, tool_calls, tenant_id, conversation_id, customer_phone):
+            _record_tool_result(messages, tool_calls_made, tool_call, tool_args, result)
+    
+    yield {"type": "done", "result": _max_iterations_result(tool_calls_made, iteration, summarize_usage(usage_calls, prefix))}
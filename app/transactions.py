@@ -0,0 +1,21 @@
+"""
+Transactions par tour de conversation
+Une session SQLAlchemy garde sa connexion tant qu'une transaction est ouverte: une lecture (RAG,
+historique, réglages) suivie d'un appel LLM de plusieurs secondes immobilise une connexion du pool
+("idle in transaction"), et avec PgBouncer en mode transaction, une connexion serveur.
+Les écritures d'un tour sont regroupées; la transaction est terminée avant chaque attente LLM.
+
+Sans dépendance à app.db (moteurs): utilisable avec db=None (benchmarks sans base).
+"""
+
+
+def release_connection(db) -> None:
+    """Termine la transaction en cours (commit) pour rendre la connexion au pool"""
+    if db is not None and db.in_transaction():
+        db.commit()
+
+
+async def release_connection_async(db) -> None:
+    """Équivalent AsyncSession de release_connection"""
+    if db is not None and db.in_transaction():
+        await db.commit()
@@ -22,7 +22,8 @@ def twiml_gather_speech(prompt: str, action_url: str) -> str:
 
 def twiml_say_and_gather(reply: str, action_url: str) -> str:
     vr = VoiceResponse()
-    vr.say(reply, language="fr-CA", voice="Polly.Celine")
+    if reply:
+        vr.say(reply, language="fr-CA", voice="Polly.Celine")
     g = Gather(input="speech", action=action_url, method="POST", speech_timeout="auto", language="fr-CA", enhanced=True, timeout=6)
     g.say("Je vous écoute.", language="fr-CA", voice="Polly.Celine")
     vr.append(g)
@@ -0,0 +1,109 @@
+"""
+Préchauffage au démarrage (hook startup de l'app): la première requête ne paie pas l'établissement
+des connexions
+- pools DB: PREWARM_DB_CONNECTIONS connexions ouvertes puis rendues au pool (sync et/ou asyncio)
+- OpenAI: une requête légère (GET /models) ouvre la connexion TLS keep-alive du client partagé;
+  une réponse d'erreur (clé invalide) suffit aussi à ouvrir la connexion
+- tokenizer + taille du préfixe statique du prompt (tiktoken)
+Les tâches tournent en parallèle, au plus PREWARM_TIMEOUT secondes: au-delà le démarrage continue,
+une erreur de préchauffage n'empêche jamais l'app de démarrer (WARNING).
+
+Désactivation: PREWARM=false
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PREWARM = os.getenv("PREWARM", "true").lower() == "true"
+PREWARM_DB_CONNECTIONS = int(os.getenv("PREWARM_DB_CONNECTIONS", "2"))
+PREWARM_TIMEOUT = float(os.getenv("PREWARM_TIMEOUT", "10"))
+
+
+async def _timed(name: str, coro, timings: Dict[str, Any]) -> None:
+    started = time.perf_counter()
+    try:
+        await coro
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    except Exception as e:
+        timings[name] = f"erreur: {e.__class__.__name__}"
+        logger.warning("Préchauffage %s en échec: %s", name, e)
+
+
+async def warm_async_pool(connections: int) -> None:
+    """Ouvre les connexions en même temps (elles restent dans le pool: pool_size >= connections)"""
+    from .db import get_async_engine
+    engine = get_async_engine()
+
+    async def one():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(one() for _ in range(connections)))
+
+
+def warm_sync_pool(connections: int) -> None:
+    from .db import get_engine
+    engine = get_engine()
+    opened = [engine.connect() for _ in range(connections)]
+    for conn in opened:
+        conn.execute(text("SELECT 1"))
+        conn.close()
+
+
+async def warm_openai() -> None:
+    from .clients import async_openai_client
+    try:
+        await async_openai_client().with_options(max_retries=0, timeout=PREWARM_TIMEOUT).models.list()
+    except Exception as e:
+        # Erreur HTTP (401, 404...): la connexion est quand même établie
+        if getattr(e, "status_code", None) is None:
+            raise
+
+
+def warm_openai_sync() -> None:
+    from .clients import openai_client
+    try:
+        openai_client().with_options(max_retries=0, timeout=PREWARM_TIMEOUT).models.list()
+    except Exception as e:
+        if getattr(e, "status_code", None) is None:
+            raise
+
+
+def warm_prompts() -> None:
+    from .prompts import SYSTEM_PROMPT, TOOLS
+    from .prompt_cache import static_prefix
+    static_prefix(SYSTEM_PROMPT, TOOLS)
+
+
+async def prewarm(sync_db: bool = False, sync_openai: bool = False) -> Dict[str, Any]:
+    """
+    Préchauffe ce que l'app utilise: pool asyncio toujours, pool sync / client OpenAI sync si
+    sync_db / sync_openai (main_minimal). Retourne la durée de chaque tâche (ms).
+    """
+    timings: Dict[str, Any] = {}
+    if not PREWARM:
+        return timings
+    started = time.perf_counter()
+    tasks = [
+        _timed("db_async", warm_async_pool(PREWARM_DB_CONNECTIONS), timings),
+        _timed("openai", warm_openai(), timings),
+        _timed("prompts", asyncio.to_thread(warm_prompts), timings),
+    ]
+    if sync_db:
+        tasks.append(_timed("db_sync", asyncio.to_thread(warm_sync_pool, PREWARM_DB_CONNECTIONS), timings))
+    if sync_openai:
+        tasks.append(_timed("openai_sync", asyncio.to_thread(warm_openai_sync), timings))
+
+    done, pending = await asyncio.wait([asyncio.ensure_future(t) for t in tasks], timeout=PREWARM_TIMEOUT)
+    if pending:
+        # Les tâches restantes continuent en arrière-plan
+        logger.warning("Préchauffage: %s tâche(s) encore en cours après %gs", len(pending), PREWARM_TIMEOUT)
+    timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Préchauffage terminé", extra={"timings": timings})
+    return timings
@@ -1,33 +1,37 @@
 import os
-from twilio.rest import Client
 from twilio.twiml.messaging_response import MessagingResponse
 from sqlalchemy.orm import Session
-from .agent_simple import agent_reply
+from sqlalchemy.ext.asyncio import AsyncSession
+from .agent_simple import agent_reply, agent_reply_async
+from .clients import twilio_client
+from .metrics import set_request_labels
 
-# Twilio credentials
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+# Identifiants Twilio: lus par clients.twilio_client() au premier envoi
 TWILIO_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER", "whatsapp:+14155238886")
 
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+TENANT_ID = "11111111-1111-1111-1111-111111111111"
 
-def send_whatsapp_message(to_number: str, message: str):
-    """Envoie un message WhatsApp via Twilio"""
+def send_message(to_address: str, body: str, from_address: str = None) -> str:
+    """Envoie un message via l'API REST Twilio (adresses complètes, ex: whatsapp:+1418...)"""
     
-    message = client.messages.create(
-        from_=TWILIO_WHATSAPP_NUMBER,
-        body=message,
-        to=f"whatsapp:{to_number}"
+    message = twilio_client().messages.create(
+        from_=from_address or TWILIO_WHATSAPP_NUMBER,
+        body=body,
+        to=to_address
     )
     
     return message.sid
 
+def send_whatsapp_message(to_number: str, message: str):
+    """Envoie un message WhatsApp via Twilio"""
+    
+    return send_message(f"whatsapp:{to_number}", message)
+
 def process_whatsapp_message(from_number: str, message_body: str, db: Session) -> str:
     """Traite un message WhatsApp et retourne la réponse"""
     
+    set_request_labels(TENANT_ID, "whatsapp")
     # Utilise l'agent IA existant
-    TENANT_ID = "11111111-1111-1111-1111-111111111111"
-    
     response = agent_reply(
         db=db,
         tenant_id=TENANT_ID,
@@ -35,4 +39,15 @@ def process_whatsapp_message(from_number: str, message_body: str, db: Session) -
         conversation_history=[]
     )
     
-    return response
\ No newline at end of file
+    return response
+
+async def process_whatsapp_message_async(from_number: str, message_body: str, db: AsyncSession) -> str:
+    """Équivalent asyncio de process_whatsapp_message"""
+    
+    set_request_labels(TENANT_ID, "whatsapp")
+    return await agent_reply_async(
+        db=db,
+        tenant_id=TENANT_ID,
+        user_message=message_body,
+        conversation_history=[]
+    )
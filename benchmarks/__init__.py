@@ -0,0 +1 @@
+"""Benchmarks hors-ligne (python -m benchmarks.<nom>); outils partagés dans benchmarks.common"""
@@ -0,0 +1,91 @@
+"""
+Benchmark de concurrence: agent synchrone vs asyncio dans un même event loop
+Un faux serveur OpenAI local (latence fixe) remplace l'API: aucun réseau ni clé requis.
+
+    python -m benchmarks.async_webhooks --requests 50 --latency-ms 300
+
+Le scénario "sync" reproduit l'ancien comportement des webhooks (async def qui appelle
+le client OpenAI synchrone): chaque appel LLM bloque l'event loop, les requêtes passent une par une.
+"""
+
+import time
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from .common import completion, emit, latency_ms, start_fake_llm, use_fake_llm
+
+
+def start_stub_llm(delay_ms: int) -> int:
+    """Faux LLM à latence fixe"""
+    async def chat_completions(request):
+        await asyncio.sleep(delay_ms / 1000.0)
+        return web.json_response(completion("Nous sommes ouverts de 17h à 3h."))
+
+    return start_fake_llm(chat_completions)
+
+
+async def run_scenario(name, handler, n_requests):
+    """n_requests arrivent en même temps: latence = attente jusqu'à la réponse de chacune"""
+    latencies = []
+
+    async def one():
+        await handler()
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n_requests)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "requests": n_requests,
+        "wall_s": round(elapsed, 3),
+        "throughput_rps": round(n_requests / elapsed, 1),
+        **latency_ms(latencies),
+    }
+
+
+async def main(args):
+    from app.tool_executor import execute_agent_with_tools, execute_agent_with_tools_async
+
+    kb_chunks = [{"chunk_text": "Horaires: 17h - 03h"}]
+    common = dict(
+        db=None,  # aucun tool appelé par le faux LLM: pas de base nécessaire
+        tenant_id="11111111-1111-1111-1111-111111111111",
+        conversation_id="22222222-2222-2222-2222-222222222222",
+        customer_phone="+14185551234",
+        user_text="Quelles sont vos heures d'ouverture?",
+        kb_chunks=kb_chunks,
+        system_prompt="Tu es un réceptionniste.",
+    )
+
+    async def sync_handler():
+        # Ancien chemin: appel bloquant dans l'event loop
+        return execute_agent_with_tools(**common)
+
+    async def async_handler():
+        return await execute_agent_with_tools_async(**common)
+
+    # Échauffement (connexions keep-alive)
+    await async_handler()
+
+    results = [
+        await run_scenario("sync (bloquant)", sync_handler, args.requests),
+        await run_scenario("asyncio", async_handler, args.requests),
+    ]
+    for r in results:
+        emit(r)
+    print(f"\nGain de débit: x{results[1]['throughput_rps'] / results[0]['throughput_rps']:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark webhooks sync vs asyncio (LLM local)")
+    parser.add_argument("--requests", type=int, default=50, help="Requêtes simultanées")
+    parser.add_argument("--latency-ms", type=int, default=300, help="Latence simulée du LLM")
+    args = parser.parse_args()
+
+    use_fake_llm(start_stub_llm(args.latency_ms))
+
+    asyncio.run(main(args))
@@ -0,0 +1,170 @@
+"""
+Benchmark de contention des réservations contre un Postgres local
+Des centaines de create_reservation simultanés visent le même créneau (trois heures à 15 minutes
+d'écart, toutes dans la même fenêtre de capacité). À la fin, le total des couverts confirmés doit
+rester <= capacité: sinon il y a surréservation.
+
+    DATABASE_URL=postgresql://postgres@localhost/ktios python -m benchmarks.booking_contention --bookings 400 --concurrency 64
+
+Modes:
+    atomic  ToolExecutor.create_reservation (verrous consultatifs + revérification, booking.py)
+    naive   ancien check-then-insert (pour comparaison: surréserve sous contention)
+
+Le schéma (schema_simple.sql) doit être appliqué. Un tenant jetable est créé puis supprimé.
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from .common import emit, latency_ms
+
+
+def naive_booking(session, tenant_id, phone, start_time, party_size, capacity, max_reservations):
+    """Ancien _create_reservation: vérification puis insertion, sans verrou"""
+    from sqlalchemy import text
+
+    existing = session.execute(
+        text("""
+        SELECT COUNT(*) AS cnt, COALESCE(SUM(party_size), 0) AS total_guests
+        FROM reservations
+        WHERE tenant_id = :tenant_id
+          AND status IN ('confirmed', 'pending')
+          AND start_time BETWEEN CAST(:start AS timestamptz) - INTERVAL '2 hours' AND CAST(:start AS timestamptz) + INTERVAL '2 hours'
+        """),
+        {"tenant_id": tenant_id, "start": start_time}
+    ).mappings().first()
+    if existing["total_guests"] + party_size > capacity or existing["cnt"] >= max_reservations:
+        return {"success": False}
+
+    customer_id = session.execute(
+        text("""
+        INSERT INTO customers (id, tenant_id, phone_e164, created_at, updated_at)
+        VALUES (uuid_generate_v4(), :tenant_id, :phone, now(), now())
+        ON CONFLICT (tenant_id, phone_e164) DO UPDATE SET updated_at = now()
+        RETURNING id
+        """),
+        {"tenant_id": tenant_id, "phone": phone}
+    ).scalar_one()
+    session.execute(
+        text("""
+        INSERT INTO reservations (id, tenant_id, customer_id, party_size, start_time, status, created_at, updated_at)
+        VALUES (uuid_generate_v4(), :tenant_id, :customer_id, :party_size, :start_time, 'confirmed', now(), now())
+        """),
+        {"tenant_id": tenant_id, "customer_id": str(customer_id), "party_size": party_size, "start_time": start_time}
+    )
+    session.commit()
+    return {"success": True}
+
+
+def run_mode(mode, session_factory, tenant_id, args):
+    from app.tool_executor import ToolExecutor
+
+    day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=7)
+    slots = [day.replace(hour=19) + timedelta(minutes=15 * i) for i in range(3)]
+    rng = random.Random(42)
+    requests = [(f"+1418{i:07d}", rng.choice(slots), rng.randint(2, 6)) for i in range(args.bookings)]
+
+    latencies = []
+    outcomes = {"booked": 0, "refused": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def book(request):
+        phone, start_time, party_size = request
+        session = session_factory()
+        started = time.perf_counter()
+        try:
+            if mode == "atomic":
+                result = ToolExecutor(session, tenant_id, None, phone).execute_tool("create_reservation", {
+                    "start_time": start_time.isoformat(),
+                    "party_size": party_size,
+                    "customer": {"phone_e164": phone},
+                })
+            else:
+                result = naive_booking(session, tenant_id, phone, start_time, party_size, args.capacity, args.max_reservations)
+            key = "booked" if result.get("success") else ("errors" if "Erreur" in str(result.get("error", "")) else "refused")
+        except Exception as e:
+            session.rollback()
+            print(f"ERROR {mode}: {e}", file=sys.stderr)
+            key = "errors"
+        finally:
+            session.close()
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            outcomes[key] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(book, requests))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "attempts": args.bookings,
+        **outcomes,
+        "throughput_per_s": round(args.bookings / elapsed, 1),
+        **latency_ms(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Contention des réservations: aucune surréservation")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Postgres local (défaut: $DATABASE_URL)")
+    parser.add_argument("--bookings", type=int, default=400, help="Tentatives de réservation")
+    parser.add_argument("--concurrency", type=int, default=64, help="Réservations simultanées")
+    parser.add_argument("--capacity", type=int, default=80, help="Capacité (couverts) du tenant de test")
+    parser.add_argument("--max-reservations", type=int, default=1000, help="Réservations simultanées max du tenant de test")
+    parser.add_argument("--mode", choices=["atomic", "naive", "both"], default="both")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("--database-url ou DATABASE_URL requis")
+    os.environ["DATABASE_URL"] = args.database_url
+    # Index d'occupation rechargé à chaque appel: simule des process distincts (index jamais à jour)
+    os.environ.setdefault("AVAILABILITY_INDEX_TTL", "0")
+
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.orm import sessionmaker
+
+    engine = create_engine(args.database_url, pool_size=args.concurrency, max_overflow=0)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+
+    results = []
+    for mode in (["atomic", "naive"] if args.mode == "both" else [args.mode]):
+        tenant_id = str(uuid.uuid4())
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO tenants (id, name, industry) VALUES (:id, 'bench', 'bar')"), {"id": tenant_id})
+            conn.execute(
+                text("""
+                INSERT INTO tenant_settings (tenant_id, max_capacity, max_concurrent_reservations)
+                VALUES (:id, :capacity, :max_reservations)
+                """),
+                {"id": tenant_id, "capacity": args.capacity, "max_reservations": args.max_reservations}
+            )
+        try:
+            result = run_mode(mode, session_factory, tenant_id, args)
+            with engine.connect() as conn:
+                guests = conn.execute(
+                    text("SELECT COALESCE(SUM(party_size), 0) FROM reservations WHERE tenant_id = :id AND status = 'confirmed'"),
+                    {"id": tenant_id}
+                ).scalar_one()
+            result.update({"guests_booked": guests, "capacity": args.capacity, "overbooked": guests > args.capacity})
+            results.append(result)
+            emit(result)
+        finally:
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM tenants WHERE id = :id"), {"id": tenant_id})
+
+    if any(r["mode"] == "atomic" and r["overbooked"] for r in results):
+        print("ÉCHEC: surréservation en mode atomic")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Outils partagés des benchmarks: faux serveur OpenAI local, percentiles de latence, sortie en lignes JSON
+Les benchmarks se lancent depuis la racine du dépôt (package app importable):
+
+    python -m benchmarks.<nom> --help
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, Sequence
+
+from aiohttp import web
+
+
+def completion(content: str, completion_tokens: int = 10) -> Dict[str, Any]:
+    """Corps d'une réponse /v1/chat/completions non streamée"""
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": completion_tokens, "total_tokens": 100 + completion_tokens},
+    }
+
+
+def start_fake_llm(chat_completions: Callable[[web.Request], Awaitable[web.Response]], port: int = 0) -> int:
+    """Démarre un faux POST /v1/chat/completions (handler aiohttp) dans un thread, avec son propre event loop; retourne le port"""
+    ready = threading.Event()
+    state = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        stub = web.Application()
+        stub.router.add_post("/v1/chat/completions", chat_completions)
+        runner = web.AppRunner(stub)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        loop.run_until_complete(site.start())
+        state["port"] = runner.addresses[0][1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return state["port"]
+
+
+def use_fake_llm(port: int) -> None:
+    """Clients OpenAI de l'app (app.clients) vers le faux serveur: à appeler avant leur création"""
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+
+
+def percentile(values: Iterable[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def latency_ms(latencies: Sequence[float], percentiles: Sequence[int] = (50, 95), digits: int = 1) -> Dict[str, float]:
+    """Latences en secondes → {"p50_ms": ..., "p95_ms": ...}"""
+    return {f"p{p}_ms": round(percentile(latencies, p) * 1000, digits) for p in percentiles}
+
+
+def emit(record: Dict[str, Any]) -> None:
+    """Une ligne JSON par résultat (accents conservés)"""
+    print(json.dumps(record, ensure_ascii=False), flush=True)
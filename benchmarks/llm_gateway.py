@@ -0,0 +1,213 @@
+"""
+Benchmark de la passerelle LLM (app/llm_gateway.py) contre un faux serveur OpenAI qui injecte
+latence de queue, erreurs et panne
+Latence du faux serveur: log-normale de médiane --median-ms, plus --slow-rate requêtes à --slow-ms (queue).
+
+    python -m benchmarks.llm_gateway --requests 400 --concurrency 20 --median-ms 300 --slow-rate 0.04 --slow-ms 4000
+
+Scénarios (canal voice: délai LLM_DEADLINES["voice"]):
+- tail: queue de latence, aucune erreur
+- errors: --error-rate des requêtes en 500 / 429
+- outage: toutes les requêtes en 503 pendant --outage-s, puis retour à la normale; tour complet de
+  l'agent à tools (execute_agent_with_tools_async): sans LLM, réponse de secours (extrait de la KB)
+Chaque scénario compare "sdk" (client OpenAI direct: pas de délai propre, 2 reprises du SDK) et
+"gateway" (délai, doublement au p95, reprises à gigue, disjoncteur).
+Par ligne: latence p50/p95/p99 (ms), échecs (exception remontée), secours, requêtes reçues par le serveur.
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+
+from aiohttp import web
+
+from .common import completion, emit, latency_ms, start_fake_llm, use_fake_llm
+
+TENANT_ID = "11111111-1111-1111-1111-111111111111"
+# Appels de chauffe de la passerelle: historique de latences avant le seuil de doublement (p95)
+WARMUP_CALLS = 40
+REPLY = "Nous sommes ouverts du mercredi au dimanche, de 17h à 3h du matin."
+
+
+def start_faulty_llm(faults: dict):
+    """Faux /v1/chat/completions (non streamé) piloté par le dict faults, modifiable en cours de route"""
+    state = {"requests": 0}
+
+    async def chat_completions(request):
+        await request.json()
+        state["requests"] += 1
+        if faults["outage"]:
+            await asyncio.sleep(0.05)
+            return web.json_response({"error": {"message": "overloaded", "type": "server_error"}}, status=503)
+        if random.random() < faults["error_rate"]:
+            await asyncio.sleep(random.lognormvariate(0, 0.5) * faults["median_ms"] / 4000.0)
+            status = random.choice((500, 429))
+            return web.json_response({"error": {"message": "injected", "type": "server_error"}}, status=status)
+        if random.random() < faults["slow_rate"]:
+            delay = faults["slow_ms"] / 1000.0
+        else:
+            delay = random.lognormvariate(0, 0.35) * faults["median_ms"] / 1000.0
+        await asyncio.sleep(delay)
+        return web.json_response(completion(REPLY, completion_tokens=20))
+
+    state["port"] = start_fake_llm(chat_completions)
+    return state
+
+
+def summarize(scenario, variant, runs, server_requests, **extra):
+    latencies = [elapsed for elapsed, _ in runs]
+    outcomes = [outcome for _, outcome in runs]
+    return {
+        "scenario": scenario,
+        "variant": variant,
+        "requests": len(runs),
+        **latency_ms(latencies, (50, 95, 99)),
+        "max_ms": round(max(latencies) * 1000, 1),
+        "failed": outcomes.count("failed"),
+        "fallback": outcomes.count("fallback"),
+        "server_requests": server_requests,
+        **extra,
+    }
+
+
+async def run_load(handler, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            outcome = await handler()
+            return time.perf_counter() - started, outcome
+
+    return await asyncio.gather(*(one() for _ in range(requests)))
+
+
+def counter_total(counter, **match):
+    """Somme d'un Counter de app.metrics sur les séries dont les labels correspondent"""
+    with counter._lock:
+        items = list(counter._values.items())
+    total = 0
+    for labels, value in items:
+        named = dict(zip(counter.label_names, labels))
+        if all(named.get(k) == v for k, v in match.items()):
+            total += value
+    return total
+
+
+async def main(args, server, faults):
+    from app.clients import async_openai_client
+    from app.metrics import set_request_labels, llm_hedges, llm_retries
+    from app.llm_gateway import LLMGateway, LLMUnavailable, gateway
+    from app.tool_executor import execute_agent_with_tools_async
+
+    set_request_labels(TENANT_ID, "voice")
+    params = dict(model="gpt-4o-mini", messages=[{"role": "user", "content": "Vous êtes ouverts quand?"}], max_tokens=50)
+
+    async def sdk_call():
+        try:
+            await async_openai_client().chat.completions.create(**params)
+            return "ok"
+        except Exception:
+            return "failed"
+
+    def gateway_call(gw):
+        async def call():
+            try:
+                await gw.achat("bench", **params)
+                return "ok"
+            except LLMUnavailable:
+                return "failed"
+        return call
+
+    async def measure(scenario, variant, handler, gw=None):
+        before = server["requests"]
+        hedges = counter_total(llm_hedges, result="launched"), counter_total(llm_hedges, result="won")
+        retries = counter_total(llm_retries)
+        runs = await run_load(handler, args.requests, args.concurrency)
+        extra = {}
+        if gw is not None:
+            extra = {
+                "hedges": counter_total(llm_hedges, result="launched") - hedges[0],
+                "hedges_won": counter_total(llm_hedges, result="won") - hedges[1],
+                "retries": counter_total(llm_retries) - retries,
+                "breaker": gw.status()["breaker"],
+            }
+        return summarize(scenario, variant, runs, server["requests"] - before, **extra)
+
+    await sdk_call()  # échauffement (connexions keep-alive)
+
+    results = []
+    faults.update(error_rate=0.0)
+    results.append(await measure("tail", "sdk", sdk_call))
+    # Passerelle sans disjoncteur pour tail/errors: on mesure doublement et reprises seuls
+    tail_gateway = LLMGateway(breaker=False)
+    await run_load(gateway_call(tail_gateway), WARMUP_CALLS, args.concurrency)  # historique de latences (seuil p95)
+    results.append(await measure("tail", "gateway", gateway_call(tail_gateway), tail_gateway))
+
+    faults.update(error_rate=args.error_rate)
+    results.append(await measure("errors", "sdk", sdk_call))
+    results.append(await measure("errors", "gateway", gateway_call(tail_gateway), tail_gateway))
+    faults.update(error_rate=0.0)
+
+    # Panne: tour complet de l'agent à tools avec la passerelle du module (disjoncteur compris)
+    common = dict(
+        db=None,  # aucun tool appelé par le faux LLM: pas de base nécessaire
+        tenant_id=TENANT_ID,
+        conversation_id="22222222-2222-2222-2222-222222222222",
+        customer_phone="+14185551234",
+        user_text="Vous êtes ouverts quand?",
+        kb_chunks=[{"chunk_text": "Horaires: mercredi au dimanche, 17h - 03h"}],
+        system_prompt="Tu es un réceptionniste.",
+    )
+
+    async def agent_turn():
+        try:
+            result = await execute_agent_with_tools_async(**common)
+            return "fallback" if result["finish_reason"] == "fallback" else "ok"
+        except Exception:
+            return "failed"
+
+    faults.update(outage=True)
+    outage_started = time.perf_counter()
+    results.append(await measure("outage", "sdk", sdk_call))
+    results.append(await measure("outage", "gateway", agent_turn, gateway))
+    await asyncio.sleep(max(0.0, args.outage_s - (time.perf_counter() - outage_started)))
+    faults.update(outage=False)
+
+    # Retour à la normale: le disjoncteur reste ouvert jusqu'à la fin du refroidissement, puis un essai le referme
+    recovery_started = time.perf_counter()
+    while gateway.status()["breaker"] != "closed" and time.perf_counter() - recovery_started < 120:
+        await agent_turn()
+        await asyncio.sleep(0.1)
+    results.append({
+        "scenario": "recovery",
+        "breaker": gateway.status()["breaker"],
+        "breaker_opened": gateway.status()["breaker_opened"],
+        "closed_after_ms": round((time.perf_counter() - recovery_started) * 1000, 1),
+    })
+
+    for r in results:
+        emit(r)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark passerelle LLM: délais, doublement, reprises, disjoncteur")
+    parser.add_argument("--requests", type=int, default=400, help="Appels par scénario")
+    parser.add_argument("--concurrency", type=int, default=20, help="Appels simultanés")
+    parser.add_argument("--median-ms", type=float, default=300, help="Latence médiane du faux LLM")
+    parser.add_argument("--slow-rate", type=float, default=0.04, help="Part des requêtes lentes (queue)")
+    parser.add_argument("--slow-ms", type=float, default=4000, help="Latence d'une requête lente")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="Part des requêtes en erreur (500/429), scénario errors")
+    parser.add_argument("--outage-s", type=float, default=2, help="Durée minimale de la panne")
+    parser.add_argument("--cooldown-s", type=float, default=3, help="Refroidissement du disjoncteur (LLM_BREAKER_COOLDOWN_S)")
+    args = parser.parse_args()
+
+    faults = {"median_ms": args.median_ms, "slow_rate": args.slow_rate, "slow_ms": args.slow_ms, "error_rate": 0.0, "outage": False}
+    server = start_faulty_llm(faults)
+    # Clients OpenAI et passerelle lisent l'environnement à leur création / import: configurer avant
+    use_fake_llm(server["port"])
+    os.environ.setdefault("LLM_BREAKER_COOLDOWN_S", str(args.cooldown_s))
+
+    asyncio.run(main(args, server, faults))
@@ -0,0 +1,135 @@
+"""
+Benchmark hors-ligne de la recherche KB: qualité (recall@k, MRR) et latence par mode
+Questions étiquetées (ktios_retrieval_questions.json) sur ktios_complete_real.json, ingéré dans un
+tenant jetable (supprimé à la fin, kb_documents / kb_chunks partent en cascade).
+
+    python -m benchmarks.retrieval --chunk-tokens 200 --top-k 5 --modes lexical,vector,hybrid
+
+Un chunk est pertinent s'il contient la réponse attendue (casse et accents ignorés).
+Les embeddings sont calculés localement (KB_EMBEDDINGS=true, EMBEDDER=local par défaut): aucun réseau ni clé requis.
+Les fonctions de recherche sont appelées directement: le cache de rag_search n'intervient pas.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+
+from .common import emit, latency_ms
+
+QUESTIONS_PATH = "ktios_retrieval_questions.json"
+KB_PATH = "ktios_complete_real.json"
+RECALL_AT = (1, 3, 5)
+
+
+def first_relevant_rank(results, answer, normalize):
+    """Rang (1..n) du premier chunk contenant la réponse, None si absent"""
+    expected = normalize(answer)
+    for rank, result in enumerate(results, start=1):
+        if expected in normalize(result["chunk_text"]):
+            return rank
+    return None
+
+
+def evaluate(name, search, questions, top_k, repeat, normalize):
+    ranks, latencies, misses = [], [], []
+    for q in questions:
+        results = search(q["question"], top_k)  # échauffement (index lexical, plan de requête)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = search(q["question"], top_k)
+            latencies.append(time.perf_counter() - started)
+        rank = first_relevant_rank(results, q["answer"], normalize)
+        ranks.append(rank)
+        if rank is None:
+            misses.append(q["question"])
+
+    summary = {"mode": name, "questions": len(questions), "top_k": top_k}
+    for k in RECALL_AT:
+        if k <= top_k:
+            summary[f"recall@{k}"] = round(sum(1 for r in ranks if r and r <= k) / len(ranks), 3)
+    summary["mrr"] = round(sum(1.0 / r for r in ranks if r) / len(ranks), 3)
+    summary.update(latency_ms(latencies, (50, 95, 99), digits=2))
+    summary["misses"] = misses
+    return summary
+
+
+def main(args):
+    # Configuration lue à l'import des modules app: à fixer avant
+    os.environ["KB_CHUNK_TOKENS"] = str(args.chunk_tokens)
+    os.environ.setdefault("KB_EMBEDDINGS", "true")
+    os.environ.setdefault("EMBEDDER", "local")
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    from sqlalchemy import text
+    from app.db import SessionLocal
+    from app.lexical import fold_accents
+    from app.rag import load_kb_file, ingest_kb_documents, lexical_search, vector_search, hybrid_search
+
+    def normalize(value):
+        return " ".join(fold_accents(value.lower()).split())
+
+    with open(args.questions, encoding="utf-8") as f:
+        questions = json.load(f)
+
+    tenant_id = str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        db.execute(
+            text("INSERT INTO tenants (id, name, industry) VALUES (:id, 'bench_retrieval', 'bar')"),
+            {"id": tenant_id}
+        )
+        db.commit()
+        ingest = ingest_kb_documents(db, tenant_id, load_kb_file(args.kb))
+        emit({
+            "chunk_tokens": args.chunk_tokens,
+            "embedder": os.environ["EMBEDDER"],
+            "documents": ingest["documents"],
+            "chunks": ingest["chunks"],
+        })
+
+        def in_transaction(search_fn):
+            # Une transaction par requête, comme dans un webhook (SET LOCAL ivfflat.probes compris)
+            def search(query, top_k):
+                try:
+                    return search_fn(db, tenant_id, query, top_k)
+                finally:
+                    db.commit()
+            return search
+
+        modes = {
+            "lexical": in_transaction(lexical_search),
+            "vector": in_transaction(vector_search),
+            "hybrid": in_transaction(lambda d, t, q, k: hybrid_search(d, t, q, k, budget_ms=args.budget_ms)),
+        }
+        for name in args.modes.split(","):
+            summary = evaluate(name, modes[name], questions, args.top_k, args.repeat, normalize)
+            if not args.verbose:
+                summary["misses"] = len(summary["misses"])
+            emit(summary)
+    finally:
+        db.rollback()
+        db.execute(text("DELETE FROM tenants WHERE id = :id"), {"id": tenant_id})
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark qualité / latence de la recherche KB (hors-ligne)")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Base Postgres (défaut: $DATABASE_URL)")
+    parser.add_argument("--questions", default=QUESTIONS_PATH, help="Questions étiquetées [{question, answer}]")
+    parser.add_argument("--kb", default=KB_PATH, help="Documents KB à ingérer")
+    parser.add_argument("--chunk-tokens", type=int, default=int(os.getenv("KB_CHUNK_TOKENS", "200")), help="Taille max des chunks")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks retournés par requête")
+    parser.add_argument("--modes", default="lexical,vector,hybrid", help="Modes évalués (séparés par des virgules)")
+    parser.add_argument("--repeat", type=int, default=5, help="Mesures de latence par question")
+    parser.add_argument("--budget-ms", type=int, default=None, help="Budget du mode hybrid (défaut: HYBRID_BUDGET_MS)")
+    parser.add_argument("--verbose", action="store_true", help="Afficher les questions sans chunk pertinent")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        sys.exit("DATABASE_URL requis (--database-url)")
+    main(args)
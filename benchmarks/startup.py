@@ -0,0 +1,155 @@
+"""
+Benchmark du démarrage à froid (redémarrage de dyno): import de l'app, hook startup, première requête
+Chaque mesure tourne dans un process neuf.
+
+    python -m benchmarks.startup --module app.main_minimal --import-budget-ms 1000
+    python -m benchmarks.startup --module app.main --database-url postgresql://...
+
+- import: sans DATABASE_URL / OPENAI_API_KEY / TWILIO_*: l'import doit réussir sans effet de bord
+  (aucun moteur, aucun client créé); médiane sur --repeat process + modules les plus lents (-X importtime)
+- démarrage (si une base est fournie): create_app() + hooks startup, puis GET /health deux fois,
+  avec et sans préchauffage (PREWARM); la première requête ne doit pas payer les connexions
+Code de sortie 1 si un budget est dépassé (utilisable en CI).
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from .common import emit
+
+SECRETS = ("DATABASE_URL", "OPENAI_API_KEY", "TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN")
+
+IMPORT_PROBE = """
+import time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+from app.clients import created_clients
+import app.db
+print(elapsed, ",".join(created_clients()), ",".join(app.db._engines))
+"""
+
+
+def clean_env(**extra):
+    env = {k: v for k, v in os.environ.items() if k not in SECRETS}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    env.update(extra)
+    return env
+
+
+def measure_import(module, repeat):
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE.format(module=module)],
+            env=clean_env(), capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            sys.exit(f"Import de {module} impossible sans configuration:\n{out.stderr}")
+        elapsed, clients, engines = (out.stdout.strip().splitlines()[-1].split(" ") + ["", ""])[:3]
+        if clients or engines:
+            sys.exit(f"Effet de bord à l'import de {module}: clients={clients!r} moteurs={engines!r}")
+        times.append(float(elapsed))
+    return times
+
+
+def slowest_imports(module, top):
+    """Modules de premier niveau les plus lents (temps cumulé, -X importtime)"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=clean_env(), capture_output=True, text=True
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("   ") and not name.startswith("    ") and cumulative.strip().isdigit():
+            rows.append((int(cumulative), name.strip()))
+    return [{"module": name, "ms": round(us / 1000, 1)} for us, name in sorted(rows, reverse=True)[:top]]
+
+
+STARTUP_PROBE = """
+import time, json, asyncio
+started = time.perf_counter()
+import httpx
+from {module} import create_app
+imported = time.perf_counter()
+
+async def main():
+    app = create_app()
+    await app.router.startup()
+    ready = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        t0 = time.perf_counter()
+        first = await client.get("/health")
+        t1 = time.perf_counter()
+        await client.get("/health")
+        t2 = time.perf_counter()
+    await app.router.shutdown()
+    print(json.dumps({{
+        "status": first.json().get("status"),
+        "import_ms": round((imported - started) * 1000, 1),
+        "startup_ms": round((ready - imported) * 1000, 1),
+        "first_request_ms": round((t1 - t0) * 1000, 1),
+        "second_request_ms": round((t2 - t1) * 1000, 1),
+    }}))
+
+asyncio.run(main())
+"""
+
+
+def measure_startup(module, database_url, prewarm):
+    out = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE.format(module=module)],
+        env=clean_env(DATABASE_URL=database_url, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "bench"),
+                      PREWARM="true" if prewarm else "false"),
+        capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        sys.exit(f"Démarrage de {module} en échec:\n{out.stderr}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return {"scenario": "démarrage", "prewarm": prewarm, **result}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark du démarrage à froid de l'app (import, startup, 1re requête)")
+    parser.add_argument("--module", default="app.main_minimal", help="Module de l'app (create_app)")
+    parser.add_argument("--repeat", type=int, default=5, help="Process lancés pour la mesure d'import")
+    parser.add_argument("--top", type=int, default=8, help="Modules les plus lents affichés")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="Base pour la mesure de démarrage (défaut: $DATABASE_URL)")
+    parser.add_argument("--import-budget-ms", type=float, default=1000, help="Budget de l'import (médiane)")
+    parser.add_argument("--first-request-budget-ms", type=float, default=50, help="Budget de la 1re requête après préchauffage")
+    args = parser.parse_args()
+
+    failures = []
+    times = measure_import(args.module, args.repeat)
+    import_ms = statistics.median(times) * 1000
+    emit({
+        "scenario": "import",
+        "module": args.module,
+        "median_ms": round(import_ms, 1),
+        "max_ms": round(max(times) * 1000, 1),
+        "budget_ms": args.import_budget_ms,
+        "slowest": slowest_imports(args.module, args.top),
+    })
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import {import_ms:.0f} ms > {args.import_budget_ms:.0f} ms")
+
+    if args.database_url:
+        for prewarm in (False, True):
+            result = measure_startup(args.module, args.database_url, prewarm)
+            emit(result)
+        if result["first_request_ms"] > args.first_request_budget_ms:
+            failures.append(f"1re requête {result['first_request_ms']:.0f} ms > {args.first_request_budget_ms:.0f} ms")
+    else:
+        print("Démarrage non mesuré: pas de DATABASE_URL (--database-url)")
+
+    if failures:
+        print("BUDGET DÉPASSÉ: " + "; ".join(failures))
+        sys.exit(1)
+    print("Budgets respectés")
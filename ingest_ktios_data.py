@@ -1,21 +1,81 @@
-﻿import json
+﻿"""
+Ingestion en masse de la KB (JSON ou JSONL, ex: ktios_complete_real.json)
+
+Via l'API (un appel /api/kb/bulk_ingest par lot):
+    python ingest_ktios_data.py ktios_complete_real.json
+Directement en base (DATABASE_URL requis):
+    python ingest_ktios_data.py ktios_complete_real.json --direct
+
+L'ingestion est idempotente: relancer le script ne réécrit que les chunks modifiés.
+--prune supprime les documents du tenant absents du fichier.
+"""
+
+import argparse
+import time
 import requests
 
-API_URL = "http://localhost:8000/api/kb/quick_ingest"
+API_URL = "http://localhost:8000/api/kb/bulk_ingest"
 TENANT_ID = "11111111-1111-1111-1111-111111111111"
 
-with open("ktios_complete_real.json", "r", encoding="utf-8") as f:
-    documents = json.load(f)
 
-for doc in documents:
-    doc["tenant_id"] = TENANT_ID
+def ingest_via_api(documents, tenant_id, batch_size, api_url, prune=False):
+    totals = {"documents": 0, "chunks": 0, "batches": 0}
+    if prune:
+        # Le nettoyage doit voir tous les documents: un seul appel, découpé en lots côté serveur
+        response = requests.post(api_url, json={"tenant_id": tenant_id, "documents": documents, "batch_size": batch_size, "prune": True})
+        if response.status_code != 200:
+            raise RuntimeError(f"ERREUR: {response.text}")
+        result = response.json()
+        print(f"OK: {result['documents_deleted']} documents supprimés")
+        return {key: result[key] for key in totals}
+    for start in range(0, len(documents), batch_size):
+        batch = documents[start:start + batch_size]
+        response = requests.post(api_url, json={"tenant_id": tenant_id, "documents": batch})
+        if response.status_code != 200:
+            raise RuntimeError(f"ERREUR lot {start // batch_size + 1}: {response.text}")
+        result = response.json()
+        totals["documents"] += result["documents"]
+        totals["chunks"] += result["chunks"]
+        totals["batches"] += 1
+        print(f"OK lot {totals['batches']}: {result['documents_inserted']} ajoutés, "
+              f"{result['documents_updated']} modifiés, {result['documents_unchanged']} inchangés")
+    return totals
+
+
+def ingest_direct(documents, tenant_id, batch_size, prune=False):
+    from app.db import SessionLocal
+    from app.rag import ingest_kb_documents
+
+    db = SessionLocal()
     try:
-        response = requests.post(API_URL, json=doc)
-        if response.status_code == 200:
-            print(f"OK: {doc['title']}")
-        else:
-            print(f"ERREUR: {response.text}")
-    except Exception as e:
-        print(f"EXCEPTION: {str(e)}")
-
-print(f"\nTermine ! {len(documents)} documents.")
\ No newline at end of file
+        return ingest_kb_documents(db, tenant_id, documents, batch_size, prune)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from app.rag import load_kb_file
+
+    parser = argparse.ArgumentParser(description="Ingestion en masse de documents KB")
+    parser.add_argument("path", nargs="?", default="ktios_complete_real.json", help="Fichier .json ou .jsonl")
+    parser.add_argument("--tenant", default=TENANT_ID)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--direct", action="store_true", help="Écrit directement en base (DATABASE_URL)")
+    parser.add_argument("--prune", action="store_true", help="Supprime les documents absents du fichier")
+    args = parser.parse_args()
+
+    documents = load_kb_file(args.path)
+    for doc in documents:
+        doc.pop("tenant_id", None)
+
+    started = time.perf_counter()
+    if args.direct:
+        totals = ingest_direct(documents, args.tenant, args.batch_size, args.prune)
+    else:
+        totals = ingest_via_api(documents, args.tenant, args.batch_size, args.api_url, args.prune)
+    elapsed = time.perf_counter() - started
+
+    print(f"\nTermine ! {totals['documents']} documents, {totals['chunks']} chunks, "
+          f"{totals['batches']} lots en {elapsed:.2f}s "
+          f"({totals['documents'] / elapsed:.1f} docs/s, {totals['chunks'] / elapsed:.1f} chunks/s)")
@@ -5,17 +5,20 @@ CREATE TABLE IF NOT EXISTS kb_documents (
     title text NOT NULL,
     source text,
     raw_text text NOT NULL,
+    content_hash text,
     created_at timestamptz NOT NULL DEFAULT now(),
     updated_at timestamptz NOT NULL DEFAULT now()
 );
 
 -- Table pour stocker les chunks SANS embeddings (recherche texte simple)
+-- Avec ce schéma: KB_EMBEDDINGS=false et RETRIEVAL_MODE=lexical
 CREATE TABLE IF NOT EXISTS kb_chunks (
     id uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
     document_id uuid NOT NULL REFERENCES kb_documents(id) ON DELETE CASCADE,
     tenant_id uuid NOT NULL REFERENCES tenants(id) ON DELETE CASCADE,
     chunk_index int NOT NULL,
     chunk_text text NOT NULL,
+    content_hash text,
     metadata jsonb,
     created_at timestamptz NOT NULL DEFAULT now()
 );
@@ -24,4 +27,20 @@ CREATE TABLE IF NOT EXISTS kb_chunks (
 CREATE INDEX IF NOT EXISTS kb_chunks_text_idx ON kb_chunks USING gin(to_tsvector('french', chunk_text));
 
 -- Index pour filtrer par tenant
-CREATE INDEX IF NOT EXISTS kb_chunks_tenant_idx ON kb_chunks(tenant_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS kb_chunks_tenant_idx ON kb_chunks(tenant_id);
+
+-- Ingestion incrémentale: hash du contenu (documents et chunks), colonnes ajoutées aux bases existantes
+ALTER TABLE kb_documents ADD COLUMN IF NOT EXISTS content_hash text;
+ALTER TABLE kb_chunks ADD COLUMN IF NOT EXISTS content_hash text;
+
+-- Un document par (tenant, titre, source): supprime les doublons des anciennes ingestions (garde le plus récent)
+DELETE FROM kb_documents d
+USING kb_documents newer
+WHERE d.tenant_id = newer.tenant_id
+  AND d.title = newer.title
+  AND COALESCE(d.source, 'manual') = COALESCE(newer.source, 'manual')
+  AND (d.created_at, d.id) < (newer.created_at, newer.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS kb_documents_tenant_title_source_idx ON kb_documents(tenant_id, title, COALESCE(source, 'manual'));
+
+CREATE INDEX IF NOT EXISTS kb_chunks_document_idx ON kb_chunks(document_id);
\ No newline at end of file
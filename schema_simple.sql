@@ -77,4 +77,74 @@ CREATE TABLE IF NOT EXISTS handoff_requests (
   status text NOT NULL DEFAULT 'open',
   created_at timestamptz NOT NULL DEFAULT now(),
   updated_at timestamptz NOT NULL DEFAULT now()
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS tenant_settings (
+  tenant_id uuid PRIMARY KEY REFERENCES tenants(id) ON DELETE CASCADE,
+  retrieval_mode text CHECK (retrieval_mode IN ('lexical', 'vector', 'hybrid')),
+  retrieval_budget_ms int,
+  max_capacity int,
+  max_concurrent_reservations int,
+  first_seating_hour int CHECK (first_seating_hour BETWEEN 0 AND 23),
+  last_seating_hour int CHECK (last_seating_hour BETWEEN 0 AND 23),
+  reservation_window_minutes int,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Capacité par tenant (remplace MAX_CAPACITY / MAX_CONCURRENT_RESERVATIONS en dur), bases existantes
+ALTER TABLE tenant_settings ADD COLUMN IF NOT EXISTS max_capacity int;
+ALTER TABLE tenant_settings ADD COLUMN IF NOT EXISTS max_concurrent_reservations int;
+ALTER TABLE tenant_settings ADD COLUMN IF NOT EXISTS first_seating_hour int;
+ALTER TABLE tenant_settings ADD COLUMN IF NOT EXISTS last_seating_hour int;
+ALTER TABLE tenant_settings ADD COLUMN IF NOT EXISTS reservation_window_minutes int;
+
+-- Chargement de l'index d'occupation (availability.py): réservations d'un tenant sur une plage de jours
+CREATE INDEX IF NOT EXISTS reservations_tenant_start_idx ON reservations (tenant_id, start_time);
+
+-- Un client par (tenant, téléphone): fusionne les doublons des anciennes versions avant l'index unique.
+-- Garde le plus ancien, complète ses champs vides avec les valeurs les plus récentes des doublons,
+-- rattache conversations et réservations au client gardé puis supprime les doublons (une seule instruction)
+WITH ranked AS (
+  SELECT id, first_value(id) OVER (PARTITION BY tenant_id, phone_e164 ORDER BY created_at, id) AS keep_id
+  FROM customers
+  WHERE phone_e164 IS NOT NULL
+),
+duplicates AS (
+  SELECT id, keep_id FROM ranked WHERE id <> keep_id
+),
+latest AS (
+  SELECT d.keep_id,
+         (array_agg(c.full_name ORDER BY c.created_at DESC) FILTER (WHERE c.full_name IS NOT NULL))[1] AS full_name,
+         (array_agg(c.email ORDER BY c.created_at DESC) FILTER (WHERE c.email IS NOT NULL))[1] AS email,
+         (array_agg(c.language ORDER BY c.created_at DESC) FILTER (WHERE c.language IS NOT NULL))[1] AS language
+  FROM duplicates d JOIN customers c ON c.id = d.id
+  GROUP BY d.keep_id
+),
+kept AS (
+  UPDATE customers k
+  SET full_name = COALESCE(k.full_name, l.full_name),
+      email = COALESCE(k.email, l.email),
+      language = COALESCE(k.language, l.language),
+      updated_at = now()
+  FROM latest l
+  WHERE k.id = l.keep_id
+),
+merged_conversations AS (
+  UPDATE conversations c SET customer_id = d.keep_id FROM duplicates d WHERE c.customer_id = d.id
+),
+merged_reservations AS (
+  UPDATE reservations r SET customer_id = d.keep_id FROM duplicates d WHERE r.customer_id = d.id
+)
+DELETE FROM customers c USING duplicates d WHERE c.id = d.id;
+
+-- Upsert client de create_reservation (ON CONFLICT (tenant_id, phone_e164))
+CREATE UNIQUE INDEX IF NOT EXISTS customers_tenant_phone_uidx ON customers (tenant_id, phone_e164);
+
+-- Historique de conversation (history.py): derniers messages d'une conversation, un seul parcours d'index
+CREATE INDEX IF NOT EXISTS messages_conversation_created_idx ON messages (conversation_id, created_at DESC);
+
+-- Réponses différées (deferred.py): statut de la réponse d'un message entrant, reprise des 'pending' au démarrage
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS reply_status text;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS reply_claimed_at timestamptz;
+CREATE INDEX IF NOT EXISTS messages_reply_pending_idx ON messages (reply_claimed_at) WHERE reply_status = 'pending';
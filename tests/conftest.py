@@ -0,0 +1,122 @@
+"""
+Fixtures partagées des tests
+- fake_openai: faux serveur OpenAI (/v1/chat/completions) piloté par un script de réponses, dans un thread
+  (aiohttp); les clients OpenAI de l'app sont recréés pour chaque test et pointent dessus
+"""
+
+import json
+import time
+import asyncio
+import threading
+from typing import Any, Dict, List
+
+import pytest
+from aiohttp import web
+
+from app import clients
+
+REPLY = "Nous sommes ouverts du mercredi au dimanche."
+
+
+def completion(content: str = REPLY) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+def chunk(content: str = None, finish_reason: str = None) -> bytes:
+    delta = {"content": content} if content else {}
+    payload = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+
+class FakeOpenAI:
+    """
+    Chaque requête reçue consomme l'action suivante de script (liste de dicts), puis reply par défaut:
+        {"status": 429}                    erreur HTTP
+        {"delay": 1.0}                     réponse normale après 1 s (se combine avec status / stream)
+        {"stream": ["Bonjour. ", "Au"], "cut": True}   flux SSE, connexion coupée après les fragments
+    """
+
+    def __init__(self):
+        self.script: List[Dict[str, Any]] = []
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.port = None
+
+    def reset(self, *script: Dict[str, Any]) -> None:
+        with self._lock:
+            self.script = list(script)
+            self.requests = 0
+
+    def _next(self) -> Dict[str, Any]:
+        with self._lock:
+            self.requests += 1
+            return self.script.pop(0) if self.script else {}
+
+    async def _chat_completions(self, request):
+        body = await request.json()
+        action = self._next()
+        if action.get("delay"):
+            await asyncio.sleep(action["delay"])
+        if action.get("status"):
+            return web.json_response({"error": {"message": "fake", "type": "fake_error"}}, status=action["status"])
+        if "stream" in action or body.get("stream"):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for text in action.get("stream", [REPLY]):
+                await response.write(chunk(text))
+                await asyncio.sleep(0.01)
+            if action.get("cut"):
+                request.transport.close()
+                return response
+            await response.write(chunk(finish_reason="stop"))
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        return web.json_response(completion())
+
+    def start(self) -> None:
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            application = web.Application()
+            application.router.add_post("/v1/chat/completions", self._chat_completions)
+            runner = web.AppRunner(application)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            loop.run_until_complete(site.start())
+            self.port = runner.addresses[0][1]
+            self._ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        self._ready.wait()
+
+
+@pytest.fixture(scope="session")
+def _fake_openai_server():
+    server = FakeOpenAI()
+    server.start()
+    return server
+
+
+@pytest.fixture
+def fake_openai(_fake_openai_server, monkeypatch):
+    """Faux serveur remis à zéro; clients OpenAI neufs (un event loop par test) pointant dessus"""
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{_fake_openai_server.port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(clients, "_clients", {})
+    _fake_openai_server.reset()
+    return _fake_openai_server
@@ -0,0 +1,153 @@
+"""Pool des réponses différées (app/deferred.py) avec le faux Twilio (FakeReplySender) et un statut en mémoire"""
+
+import uuid
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+from app import deferred
+from app.deferred import DeferredReplyQueue, FakeReplySender
+
+CUSTOMER = "whatsapp:+14185551234"
+CHANNEL = "whatsapp:+14155238886"
+
+
+class MemoryReplyStore:
+    """Équivalent en mémoire de ReplyStore: messages entrants et leur reply_status"""
+
+    def __init__(self):
+        self.messages: Dict[uuid.UUID, Dict[str, Any]] = {}
+        self.stale: List[uuid.UUID] = []
+
+    def add(self, content: str, stale: bool = False) -> uuid.UUID:
+        message_id = uuid.uuid4()
+        self.messages[message_id] = {"content": content, "status": "pending"}
+        if stale:
+            self.stale.append(message_id)
+        return message_id
+
+    async def claim(self, message_id) -> Optional[Dict[str, Any]]:
+        message = self.messages[message_id]
+        if message["status"] != "pending":
+            return None
+        return {"id": message_id, "content": message["content"], "to_address": CUSTOMER, "from_address": CHANNEL}
+
+    async def finish(self, message_id, status: str) -> None:
+        self.messages[message_id]["status"] = status
+
+    async def claim_stale(self, older_than_s: float, limit: int) -> List[uuid.UUID]:
+        stale, self.stale = self.stale[:limit], self.stale[limit:]
+        return stale
+
+    def statuses(self) -> List[str]:
+        return [message["status"] for message in self.messages.values()]
+
+
+class FlakySender(FakeReplySender):
+    """Faux Twilio dont les failures premiers envois échouent"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    async def send(self, to: str, from_: str, body: str) -> str:
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("Twilio injoignable")
+        return await super().send(to, from_, body)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(deferred, "SEND_RETRY_BASE_S", 0.01)
+
+
+async def echo(inbound: Dict[str, Any]) -> str:
+    return f"Réponse à: {inbound['content']}"
+
+
+def run_queue(store, sender, handler=echo, message_ids=(), workers: int = 2, recover_interval: float = 0):
+    async def scenario():
+        queue = DeferredReplyQueue(workers=workers, max_size=100, sender=sender, store=store)
+        queue.start(handler, recover_interval=recover_interval)
+        for message_id in message_ids:
+            queue.enqueue(message_id)
+        await queue.stop(timeout=5)
+        return queue.snapshot()
+
+    return asyncio.run(scenario())
+
+
+def test_job_sent_and_marked():
+    store, sender = MemoryReplyStore(), FakeReplySender()
+    message_id = store.add("Vous êtes ouverts?")
+    stats = run_queue(store, sender, message_ids=[message_id])
+    assert sender.sent == [{"sid": "SMfake000001", "to": CUSTOMER, "from": CHANNEL, "body": "Réponse à: Vous êtes ouverts?"}]
+    assert store.statuses() == ["sent"]
+    assert stats["sent"] == 1 and stats["failed"] == 0
+
+
+def test_send_retried_then_sent():
+    store, sender = MemoryReplyStore(), FlakySender(failures=deferred.SEND_RETRIES - 1)
+    stats = run_queue(store, sender, message_ids=[store.add("Bonjour")])
+    assert sender.attempts == deferred.SEND_RETRIES
+    assert len(sender.sent) == 1
+    assert store.statuses() == ["sent"] and stats["sent"] == 1
+
+
+def test_send_gives_up_after_retries():
+    store, sender = MemoryReplyStore(), FlakySender(failures=deferred.SEND_RETRIES)
+    stats = run_queue(store, sender, message_ids=[store.add("Bonjour")])
+    assert sender.sent == []
+    assert store.statuses() == ["failed"] and stats["failed"] == 1
+
+
+def test_queue_drained_on_shutdown():
+    store, sender = MemoryReplyStore(), FakeReplySender()
+
+    async def slow(inbound):
+        await asyncio.sleep(0.02)
+        return await echo(inbound)
+
+    message_ids = [store.add(f"Question {i}") for i in range(20)]
+    stats = run_queue(store, sender, handler=slow, message_ids=message_ids)
+    assert len(sender.sent) == 20
+    assert store.statuses() == ["sent"] * 20
+    assert stats["queued"] == 0 and stats["workers"] == 0
+
+
+def test_already_answered_message_not_sent_twice():
+    store, sender = MemoryReplyStore(), FakeReplySender()
+    message_id = store.add("Bonjour")
+    run_queue(store, sender, message_ids=[message_id, message_id])
+    assert len(sender.sent) == 1
+
+
+def test_empty_reply_skipped():
+    store, sender = MemoryReplyStore(), FakeReplySender()
+
+    async def nothing(inbound):
+        return None
+
+    run_queue(store, sender, handler=nothing, message_ids=[store.add("ok")])
+    assert sender.sent == [] and store.statuses() == ["skipped"]
+
+
+def test_pending_messages_recovered_at_startup():
+    store, sender = MemoryReplyStore(), FakeReplySender()
+    store.add("Resté en attente avant le redéploiement", stale=True)
+    store.add("Celui-là aussi", stale=True)
+
+    async def scenario():
+        queue = DeferredReplyQueue(workers=2, max_size=100, sender=sender, store=store)
+        queue.start(echo, recover_interval=60)
+        await asyncio.sleep(0.1)
+        await queue.stop(timeout=5)
+        return queue.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert stats["recovered"] == 2
+    assert sorted(m["body"] for m in sender.sent) == ["Réponse à: Celui-là aussi", "Réponse à: Resté en attente avant le redéploiement"]
+    assert store.statuses() == ["sent", "sent"]
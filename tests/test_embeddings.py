@@ -0,0 +1,56 @@
+"""Embedder local (app/embeddings.py): déterministe, sans réseau, proximité par fragments de mots"""
+
+import math
+
+from app.embeddings import LocalHashEmbedder, embed_texts, to_pgvector
+
+
+def cosine(a, b) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def test_deterministic_across_instances():
+    text = "Horaires d'ouverture du bar: mercredi au dimanche"
+    first = LocalHashEmbedder().embed_one(text)
+    assert first == LocalHashEmbedder().embed_one(text)
+    assert LocalHashEmbedder().embed([text, text]) == [first, first]
+
+
+def test_unit_norm_and_dimension():
+    vector = LocalHashEmbedder(dim=256).embed_one("Réservation pour quatre personnes")
+    assert len(vector) == 256
+    assert math.isclose(math.sqrt(sum(v * v for v in vector)), 1.0)
+
+
+def test_empty_text_is_zero_vector():
+    assert set(LocalHashEmbedder(dim=64).embed_one("")) == {0.0}
+
+
+def test_accents_and_case_ignored():
+    embedder = LocalHashEmbedder()
+    assert embedder.embed_one("Réservation ÉTÉ") == embedder.embed_one("reservation ete")
+
+
+def test_similarity_ordering():
+    embedder = LocalHashEmbedder()
+    query = embedder.embed_one("heures d'ouverture le dimanche")
+    close = embedder.embed_one("Heures d'ouverture: ouvert le dimanche de 17h à 3h")
+    related = embedder.embed_one("Le bar est fermé le lundi")
+    unrelated = embedder.embed_one("Cocktail Hennessy et tonic")
+    assert cosine(query, close) > cosine(query, related) > cosine(query, unrelated)
+
+
+def test_shared_word_fragments_are_close():
+    embedder = LocalHashEmbedder()
+    hennessy = embedder.embed_one("Hennessy")
+    assert cosine(embedder.embed_one("Hennes"), hennessy) > cosine(embedder.embed_one("Tequila"), hennessy)
+
+
+def test_embed_texts_batches_keep_order():
+    embedder = LocalHashEmbedder(dim=32, batch_size=2)
+    texts = [f"question {i}" for i in range(5)]
+    assert embed_texts(texts, embedder) == [embedder.embed_one(t) for t in texts]
+
+
+def test_to_pgvector_literal():
+    assert to_pgvector([0.5, -1.0, 0.0]) == "[0.500000,-1.000000,0.000000]"
@@ -0,0 +1,155 @@
+"""Passerelle LLM (app/llm_gateway.py) contre le faux serveur OpenAI: délai, reprises, disjoncteur, doublement"""
+
+import time
+import asyncio
+
+import pytest
+
+from app import llm_gateway
+from app.llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable
+
+PARAMS = dict(model="gpt-4o-mini", messages=[{"role": "user", "content": "Vous êtes ouverts quand?"}], max_tokens=20)
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_BASE_S", 0.01)
+    monkeypatch.setattr(llm_gateway, "LLM_RETRY_CAP_S", 0.02)
+
+
+def gateway(**kwargs) -> LLMGateway:
+    options = dict(max_retries=2, hedge=False, breaker=False, default_deadline=3.0, deadlines={})
+    options.update(kwargs)
+    return LLMGateway(**options)
+
+
+def with_breaker(gw: LLMGateway, cooldown: float = 0.3, min_calls: int = 2) -> LLMGateway:
+    gw.breaker = CircuitBreaker(window=4, min_calls=min_calls, failure_ratio=0.5, cooldown=cooldown)
+    return gw
+
+
+def reply_text(response) -> str:
+    return response.choices[0].message.content
+
+
+def test_deadline_expires(fake_openai):
+    fake_openai.reset({"delay": 2.0})
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailable) as raised:
+        asyncio.run(gateway(default_deadline=0.5).achat("test", **PARAMS))
+    assert raised.value.reason == "deadline"
+    assert time.monotonic() - started < 1.5
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retries_transient_errors(fake_openai, status):
+    fake_openai.reset({"status": status}, {"status": status})
+    response = asyncio.run(gateway().achat("test", **PARAMS))
+    assert reply_text(response)
+    assert fake_openai.requests == 3
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404])
+def test_client_errors_not_retried(fake_openai, status):
+    fake_openai.reset({"status": status})
+    with pytest.raises(LLMUnavailable) as raised:
+        asyncio.run(gateway().achat("test", **PARAMS))
+    assert raised.value.reason == "client_error"
+    assert fake_openai.requests == 1
+
+
+def test_sync_chat_retries(fake_openai):
+    fake_openai.reset({"status": 502})
+    assert reply_text(gateway().chat("test", **PARAMS))
+    assert fake_openai.requests == 2
+
+
+def test_refused_key_counts_as_breaker_failure(fake_openai):
+    gw = with_breaker(gateway(), min_calls=4)
+    fake_openai.reset({"status": 401}, {"status": 400})
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            gw.chat("test", **PARAMS)
+    assert list(gw.breaker._results) == [False, True]
+
+
+def test_breaker_opens_then_half_open_probe_closes_it(fake_openai):
+    gw = with_breaker(gateway(max_retries=0), cooldown=0.3)
+    fake_openai.reset({"status": 503}, {"status": 503})
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(LLMUnavailable) as raised:
+                await gw.achat("test", **PARAMS)
+            assert raised.value.reason == "error"
+        assert gw.status()["breaker"] == "open"
+
+        # Ouvert: échec immédiat, sans requête au fournisseur
+        with pytest.raises(LLMUnavailable) as raised:
+            await gw.achat("test", **PARAMS)
+        assert raised.value.reason == "breaker_open"
+        assert fake_openai.requests == 2
+
+        # Après le refroidissement: un seul appel d'essai (semi-ouvert), les autres échouent aussitôt
+        await asyncio.sleep(0.35)
+        fake_openai.reset({"delay": 0.2})
+        results = await asyncio.gather(*(gw.achat("test", **PARAMS) for _ in range(3)), return_exceptions=True)
+        assert sum(not isinstance(r, Exception) for r in results) == 1
+        assert all(r.reason == "breaker_open" for r in results if isinstance(r, Exception))
+        assert fake_openai.requests == 1
+        assert gw.status()["breaker"] == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_failed_probe_reopens_breaker(fake_openai):
+    gw = with_breaker(gateway(max_retries=0), cooldown=0.2)
+    fake_openai.reset({"status": 500}, {"status": 500}, {"status": 500})
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            gw.chat("test", **PARAMS)
+    time.sleep(0.25)
+    with pytest.raises(LLMUnavailable):
+        gw.chat("test", **PARAMS)
+    assert gw.status()["breaker"] == "open"
+    assert gw.status()["breaker_opened"] == 2
+
+
+def hedging_gateway() -> LLMGateway:
+    gw = gateway(max_retries=0, hedge=True, hedge_min_samples=5, hedge_ratio=1.0)
+    for _ in range(5):
+        gw._observe_latency("test", 0.05)
+    return gw
+
+
+def test_hedge_wins_over_slow_primary(fake_openai):
+    fake_openai.reset({"delay": 2.0})
+    started = time.monotonic()
+    response = asyncio.run(hedging_gateway().achat("test", **PARAMS))
+    assert reply_text(response)
+    assert time.monotonic() - started < 1.0
+    assert fake_openai.requests == 2
+
+
+def test_sync_hedge_takes_over_failed_primary(fake_openai):
+    fake_openai.reset({"delay": 0.3, "status": 500})
+    response = hedging_gateway().chat("test", **PARAMS)
+    assert reply_text(response)
+    assert fake_openai.requests == 2
+
+
+def test_stream_cut_mid_way_raises_and_counts_as_failure(fake_openai):
+    gw = with_breaker(gateway(), min_calls=4)
+    fake_openai.reset({"stream": ["Nous sommes ", "ouverts"], "cut": True})
+
+    async def consume():
+        parts = []
+        stream = await gw.astream("test", **PARAMS)
+        with pytest.raises(LLMUnavailable):
+            async for part in stream:
+                if part.choices and part.choices[0].delta.content:
+                    parts.append(part.choices[0].delta.content)
+        return parts
+
+    assert asyncio.run(consume()) == ["Nous sommes ", "ouverts"]
+    assert list(gw.breaker._results) == [True, False]
@@ -0,0 +1,154 @@
+"""Cache L1 + L2 (app/shared_cache.py) avec le faux Redis en mémoire; deux instances = deux workers"""
+
+import time
+import uuid
+import asyncio
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+from app import shared_cache
+from app.shared_cache import InMemoryRedis, L2Client, SharedCache
+
+TENANT = "11111111-1111-1111-1111-111111111111"
+
+
+@pytest.fixture(autouse=True)
+def short_l1(monkeypatch):
+    # Génération et entrées L1 relues en L2 toutes les 50 ms (CACHE_L1_TTL lu à la création du cache)
+    monkeypatch.setattr(shared_cache, "CACHE_L1_TTL", 0.05)
+
+
+def workers(count: int = 2, **kwargs):
+    redis = InMemoryRedis()
+    return [SharedCache("test", l2=redis, **kwargs) for _ in range(count)]
+
+
+class BrokenRedis:
+    """Serveur Redis injoignable: chaque appel échoue"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError("Redis injoignable")
+        return fail
+
+
+def test_l1_only_get_set_delete():
+    cache = SharedCache("test", l2=None)
+    cache.set(TENANT, ("q",), {"answer": 42})
+    assert cache.get(TENANT, ("q",)) == {"answer": 42}
+    cache.delete(TENANT, ("q",))
+    assert cache.get(TENANT, ("q",), default="absent") == "absent"
+    assert cache.stats()["l2"] is None
+
+
+def test_l2_shared_between_workers():
+    first, second = workers()
+    value = {"id": uuid.uuid4(), "at": datetime(2031, 2, 20, 19, tzinfo=timezone.utc), "rows": [1, 2]}
+    first.set(TENANT, ("q",), value)
+    # Valeur décodée du JSON L2: UUID et datetime retrouvés, tuples en listes
+    assert second.get(TENANT, ("q",)) == value
+    assert second.stats()["l2_hits"] == 1
+    assert second.get(TENANT, ("q",)) == value
+    assert second.stats()["l1_hits"] == 1
+
+
+def test_none_is_not_cached():
+    (cache,) = workers(1)
+    cache.set(TENANT, ("q",), None)
+    assert cache.get(TENANT, ("q",), default="absent") == "absent"
+
+
+def test_async_get_set():
+    first, second = workers()
+
+    async def scenario():
+        await first.aset(TENANT, ("q",), ["a", "b"])
+        return await second.aget(TENANT, ("q",))
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+
+
+def test_tenant_generation_bump_invalidates_other_workers():
+    first, second = workers(l1_ttl=60)
+    first.set(TENANT, ("q",), "ancienne")
+    first.set("autre-tenant", ("q",), "autre")
+    assert second.get(TENANT, ("q",)) == "ancienne"
+
+    first.invalidate_tenant(TENANT)
+    assert first.get(TENANT, ("q",)) is None
+    # L'autre worker relit la génération en L2 au plus CACHE_L1_TTL plus tard, même avec une entrée L1 valide
+    time.sleep(0.1)
+    assert second.get(TENANT, ("q",)) is None
+    assert second.get("autre-tenant", ("q",)) == "autre"
+
+    second.set(TENANT, ("q",), "nouvelle")
+    assert first.get(TENANT, ("q",)) == "nouvelle"
+
+
+def test_single_flight_across_threads_and_workers():
+    caches = workers(4)
+    calls = []
+    barrier = threading.Barrier(16)
+    results = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return "calculé", True
+
+    def request(cache):
+        barrier.wait()
+        results.append(cache.get_or_compute(TENANT, ("q",), compute))
+
+    threads = [threading.Thread(target=request, args=(caches[i % 4],)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ["calculé"] * 16
+
+
+def test_single_flight_async():
+    first, second = workers()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "calculé", True
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute_async(TENANT, ("q",), compute) for cache in [first, second] * 10))
+
+    assert asyncio.run(scenario()) == ["calculé"] * 20
+    assert len(calls) == 1
+
+
+def test_uncacheable_result_recomputed():
+    (cache,) = workers(1)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "partiel", False
+
+    assert cache.get_or_compute(TENANT, ("q",), compute) == "partiel"
+    assert cache.get_or_compute(TENANT, ("q",), compute) == "partiel"
+    assert len(calls) == 2
+
+
+def test_falls_back_to_l1_when_l2_raises():
+    cache = SharedCache("test", l2=L2Client(BrokenRedis()))
+    cache.set(TENANT, ("q",), "local")
+    assert cache.get(TENANT, ("q",)) == "local"
+    assert cache.get_or_compute(TENANT, ("autre",), lambda: ("calculé", True)) == "calculé"
+    assert cache.get(TENANT, ("autre",)) == "calculé"
+    stats = cache.stats()
+    assert stats["l2_errors"] == 1  # L2 suspendu après la première erreur (CACHE_L2_RETRY_S)
+    assert stats["hits"] == 2
+
+    cache.invalidate_tenant(TENANT)
+    assert cache.get(TENANT, ("q",)) is None
@@ -1,41 +1,29 @@
 import os
-import requests
+import time
 from dotenv import load_dotenv
 
 load_dotenv('.env.production')
 
-API_URL = "https://hghvipyvtwizxebuwbcp.supabase.co"
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 print(f"Connexion a Supabase...")
 print(f"Database URL: {DATABASE_URL[:50]}...")
 
-import psycopg2
-import json
-
-conn = psycopg2.connect(DATABASE_URL)
-cursor = conn.cursor()
+# Import après load_dotenv: app.db lit DATABASE_URL au chargement
+from app.db import SessionLocal
+from app.rag import ingest_kb_documents, load_kb_file
 
 TENANT_ID = "11111111-1111-1111-1111-111111111111"
 
-with open('ktios_complete_real.json', 'r', encoding='utf-8') as f:
-    documents = json.load(f)
-
-for doc in documents:
-    print(f"Upload: {doc['title']}")
-    
-    # Ingest via API locale d'abord pour avoir le code qui marche
-    response = requests.post("http://localhost:8000/api/kb/quick_ingest", json={
-        "tenant_id": TENANT_ID,
-        "title": doc['title'],
-        "raw_text": doc['raw_text'],
-        "source": "manual"
-    })
-    
-    if response.status_code == 200:
-        print(f"  OK!")
-    else:
-        print(f"  ERREUR: {response.text}")
-
-conn.close()
-print("\nTermine!")
\ No newline at end of file
+documents = load_kb_file('ktios_complete_real.json')
+
+db = SessionLocal()
+try:
+    started = time.perf_counter()
+    result = ingest_kb_documents(db, TENANT_ID, documents)
+    elapsed = time.perf_counter() - started
+finally:
+    db.close()
+
+print(f"\nTermine! {result['documents']} documents, {result['chunks']} chunks, "
+      f"{result['batches']} lots en {elapsed:.2f}s")